@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import warnings
+
+import torch
+
+from davsn.benchmarks.synthetic import ensure_synthetic_data
+from davsn.benchmarks.suite import run_suite, compare
+from davsn.domain_adaptation.config import cfg, cfg_from_file
+from davsn.utils.device import setup_device
+
+warnings.filterwarnings("ignore")
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks of the DA-VSN hot paths on synthetic video data")
+    parser.add_argument('--cfg', type=str, default=None,
+                        help='optional config file', )
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='synthetic data directory, generated if missing (default: a temporary directory)')
+    parser.add_argument('--size', type=int, nargs=2, default=[256, 128],
+                        help='frame width and height')
+    parser.add_argument('--sequences', type=int, default=4,
+                        help='synthetic sequences per dataset')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='timed repetitions of each benchmark')
+    parser.add_argument('--train-iters', type=int, default=5,
+                        help='timed train_DAVSN iterations')
+    parser.add_argument('--only', type=str, nargs='+', default=None,
+                        help='run the benchmarks starting with these names '
+                             '(getitem, warp, itcr, train_iteration, eval_pass)')
+    parser.add_argument('--cpu', action='store_true',
+                        help='run on the CPU')
+    parser.add_argument('--output', type=str, default=None,
+                        help='JSON file for the results, usable as a baseline')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='JSON results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slowdown of the median reported as a regression')
+    return parser.parse_args()
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    if args.cfg is not None:
+        cfg_from_file(args.cfg)
+    if args.cpu:
+        cfg.DEVICE = 'cpu'
+    cfg.NUM_WORKERS = 0
+    device = setup_device(cfg)
+    size = tuple(args.size)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or os.path.join(tmp_dir, 'data')
+        work_dir = os.path.join(tmp_dir, 'work')
+        os.makedirs(work_dir)
+        ensure_synthetic_data(data_dir, size, num_sequences=args.sequences)
+        results = run_suite(data_dir, cfg, size, device, args.repeats, args.train_iters, work_dir, args.only)
+
+    report = {'meta': {'size': list(size),
+                       'device': str(device),
+                       'num_threads': torch.get_num_threads(),
+                       'torch': torch.__version__,
+                       'platform': platform.platform()},
+              'results': results}
+    print(f'{"benchmark":<40}{"median (ms)":>14}{"mean (ms)":>14}{"p90 (ms)":>14}')
+    for name, stats in results.items():
+        print(f'{name:<40}{stats["median_s"] * 1000:>14.2f}{stats["mean_s"] * 1000:>14.2f}'
+              f'{stats["p90_s"] * 1000:>14.2f}')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ('size', 'device'):
+            if baseline['meta'][key] != report['meta'][key]:
+                print(f'Warning: baseline {key} {baseline["meta"][key]} differs from {report["meta"][key]}')
+        rows = compare(results, baseline['results'], args.tolerance)
+        print(f'{"benchmark":<40}{"baseline (ms)":>14}{"current (ms)":>14}{"ratio":>8}')
+        for name, base, current, ratio, regressed in rows:
+            print(f'{name:<40}{base * 1000:>14.2f}{current * 1000:>14.2f}{ratio:>8.2f}'
+                  + ('  REGRESSION' if regressed else ''))
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import copy
+import itertools
+import json
+import os
+import os.path as osp
+import time
+
+import numpy as np
+import torch
+from torch.utils import data
+
+from davsn.dataset.CityscapesSeq import CityscapesSeqDataSet
+from davsn.dataset.SynthiaSeq import SynthiaSeqDataSet
+from davsn.dataset.sampler import InfiniteSampler
+from davsn.dataset.Viper import ViperDataSet
+from davsn.domain_adaptation.eval_video_UDA import evaluate_domain_adaptation
+from davsn.domain_adaptation.train_video_UDA import train_DAVSN, propagate_kf_predictions
+from davsn.model.accel_deeplabv2 import get_accel_deeplab_v2
+from davsn.utils import project_root
+from davsn.utils.flow import resize_flow
+
+INFO_TARGET = str(project_root / 'davsn/dataset/CityscapesSeq_list/info_Viper.json')
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def summarize(seconds):
+    seconds = np.asarray(seconds)
+    return {'median_s': float(np.median(seconds)),
+            'mean_s': float(seconds.mean()),
+            'p90_s': float(np.percentile(seconds, 90)),
+            'repeats': len(seconds)}
+
+
+def time_fn(fn, repeats, device, warmup=1):
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def get_datasets(root, cfg, size, num_iters=None):
+    """Datasets over the synthetic trees of `root` (see `make_synthetic_data`)."""
+    w, h = size
+    flow_dir = lambda name: osp.join(root, f'Estimated_optical_flow_{name}')
+    return {
+        'Viper': ViperDataSet(root=osp.join(root, 'Viper'),
+                              list_path=osp.join(root, 'Viper_list/{}.txt'), set='train',
+                              max_iters=num_iters, crop_size=size, mean=cfg.TRAIN.IMG_MEAN,
+                              flow_path=flow_dir('Viper_train')),
+        'SynthiaSeq': SynthiaSeqDataSet(root=osp.join(root, 'SynthiaSeq'),
+                                        list_path=osp.join(root, 'SynthiaSeq_list/{}.txt'), set='train',
+                                        max_iters=num_iters, crop_size=(w, h + 120), mean=cfg.TRAIN.IMG_MEAN,
+                                        flow_path=flow_dir('SynthiaSeq_train')),
+        'CityscapesSeq': CityscapesSeqDataSet(root=osp.join(root, 'Cityscapes'),
+                                              list_path=osp.join(root, 'CityscapesSeq_list/{}.txt'), set='train',
+                                              info_path=INFO_TARGET, max_iters=num_iters, crop_size=size,
+                                              mean=cfg.TRAIN.IMG_MEAN,
+                                              flow_path=flow_dir('Cityscapes-Seq_train')),
+    }
+
+
+def bench_getitem(root, cfg, size, repeats):
+    """`__getitem__` of each dataset class, cycling over its samples."""
+    results = {}
+    for name, dataset in get_datasets(root, cfg, size).items():
+        indices = itertools.cycle(range(len(dataset)))
+        results[f'getitem/{name}'] = time_fn(lambda: dataset[next(indices)], repeats, torch.device('cpu'))
+    return results
+
+
+def _logits(cfg, size, device, seed=0):
+    # random (main, aux) logits at the 1/8 resolution of the DeepLabv2 outputs
+    generator = torch.Generator().manual_seed(seed)
+    w, h = size
+    shape = (1, cfg.NUM_CLASSES, h // 8 + 1, w // 8 + 1)
+    return [torch.randn(shape, generator=generator).to(device) for _ in range(2)]
+
+
+def _flow(size, device, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    w, h = size
+    return (torch.randn((1, 2, h, w), generator=generator) * 2).double().to(device)
+
+
+def bench_warp(model, cfg, size, device, repeats):
+    """Key-frame logit warp and score fusion of `ResNetMulti.forward` (`fuse`)."""
+    cf_aux, cf = _logits(cfg, size, device, seed=0)
+    kf_aux, kf = _logits(cfg, size, device, seed=1)
+    flow = _flow(size, device)
+
+    def fn():
+        with torch.no_grad():
+            model.fuse(cf_aux, cf, kf_aux, kf, flow)
+    return time_fn(fn, repeats, device)
+
+
+def bench_itcr(cfg, size, device, repeats):
+    """Propagation of the key-frame probabilities and entropies of the ITCR loss."""
+    kf_aux, kf = _logits(cfg, size, device)
+    flow = resize_flow(_flow(size, device), kf.shape[-2:])
+    return time_fn(lambda: propagate_kf_predictions(kf, kf_aux, flow), repeats, device)
+
+
+def bench_train_iteration(model, root, cfg, size, device, iters, work_dir):
+    """Iterations of `train_DAVSN` (Viper -> Cityscapes-Seq), timed by its profiler.
+
+    Besides the full iteration, the median of every profiled stage is reported.
+    """
+    cfg = copy.deepcopy(cfg)
+    cfg.TRAIN.INPUT_SIZE_SOURCE = tuple(size)
+    cfg.TRAIN.INPUT_SIZE_TARGET = tuple(size)
+    cfg.TRAIN.EARLY_STOP = iters - 1
+    cfg.TRAIN.SAVE_PRED_EVERY = iters + 1
+    cfg.TRAIN.SNAPSHOT_DIR = work_dir
+    cfg.TRAIN.TENSORBOARD_LOGDIR = ''
+    cfg.TRAIN.PROFILE = True
+    cfg.TRAIN.PROFILE_WINDOW = iters
+    cfg.TRAIN.PROFILE_EVERY = iters
+    cfg.TRAIN.PROFILE_FILE = osp.join(work_dir, 'profile.jsonl')
+    if osp.exists(cfg.TRAIN.PROFILE_FILE):
+        os.remove(cfg.TRAIN.PROFILE_FILE)
+    datasets = get_datasets(root, cfg, size, num_iters=iters * cfg.TRAIN.ACCUM_STEPS
+                            * max(cfg.TRAIN.BATCH_SIZE_SOURCE, cfg.TRAIN.BATCH_SIZE_TARGET))
+    source_loader, target_loader = [
+        data.DataLoader(dataset, batch_size=batch_size, num_workers=cfg.NUM_WORKERS,
+                        sampler=InfiniteSampler(len(dataset), num_samples=dataset.max_iters, shuffle=False))
+        for dataset, batch_size in ((datasets['Viper'], cfg.TRAIN.BATCH_SIZE_SOURCE),
+                                    (datasets['CityscapesSeq'], cfg.TRAIN.BATCH_SIZE_TARGET))]
+    train_DAVSN(model, source_loader, target_loader, cfg)
+    with open(cfg.TRAIN.PROFILE_FILE) as f:
+        profile = json.loads(f.readlines()[-1])
+    results = {}
+    for region, stats in profile['regions'].items():
+        name = 'train_iteration' if region == 'iteration' else f'train_iteration/{region}'
+        results[name] = {'median_s': stats['p50_ms'] / 1000,
+                         'mean_s': stats['mean_ms'] / 1000,
+                         'p90_s': stats['p90_ms'] / 1000,
+                         'repeats': stats['count']}
+    return results
+
+
+def bench_eval_pass(model, root, cfg, size, device, repeats, work_dir):
+    """`eval_video_single` over the synthetic Cityscapes-Seq val list."""
+    cfg = copy.deepcopy(cfg)
+    checkpoint = osp.join(work_dir, 'model_eval.pth')
+    torch.save(model.state_dict(), checkpoint)
+    cfg.TEST.MODE = 'video_single'
+    cfg.TEST.MODEL = ('ACCEL_DeepLabv2',)
+    cfg.TEST.MODEL_WEIGHT = (1.0,)
+    cfg.TEST.RESTORE_FROM = (checkpoint,)
+    cfg.TEST.SNAPSHOT_DIR = (work_dir,)
+    cfg.TEST.INPUT_SIZE_TARGET = tuple(size)
+    cfg.TEST.OUTPUT_SIZE_TARGET = tuple(size)
+    dataset = CityscapesSeqDataSet(root=osp.join(root, 'Cityscapes'),
+                                   list_path=osp.join(root, 'CityscapesSeq_list/{}.txt'), set='val',
+                                   info_path=INFO_TARGET, crop_size=size, mean=cfg.TEST.IMG_MEAN,
+                                   labels_size=size,
+                                   flow_path=osp.join(root, 'Estimated_optical_flow_Cityscapes-Seq_val'))
+    loader = data.DataLoader(dataset, batch_size=cfg.TEST.BATCH_SIZE_TARGET,
+                             num_workers=cfg.NUM_WORKERS, shuffle=False)
+    return time_fn(lambda: evaluate_domain_adaptation([model], loader, cfg, verbose=False), repeats, device)
+
+
+def run_suite(root, cfg, size, device, repeats, train_iters, work_dir, only=None):
+    """Run the benchmarks whose name starts with one of `only` (all by default)."""
+    selected = lambda name: only is None or any(name.startswith(prefix) for prefix in only)
+    torch.manual_seed(cfg.TRAIN.RANDOM_SEED)
+    results = {}
+    if selected('getitem'):
+        results.update(bench_getitem(root, cfg, size, repeats))
+    model = get_accel_deeplab_v2(num_classes=cfg.NUM_CLASSES, multi_level=cfg.TRAIN.MULTI_LEVEL).to(device)
+    model.eval()
+    if selected('warp'):
+        results['warp'] = bench_warp(model, cfg, size, device, repeats)
+    if selected('itcr'):
+        results['itcr'] = bench_itcr(cfg, size, device, repeats)
+    if selected('train_iteration'):
+        results.update(bench_train_iteration(model, root, cfg, size, device, train_iters, work_dir))
+    if selected('eval_pass'):
+        results['eval_pass'] = bench_eval_pass(model, root, cfg, size, device, repeats, work_dir)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare the medians of `results` with the ones of a saved `baseline`.
+
+    Returns (name, baseline_s, current_s, ratio, regressed) for the benchmarks
+    present in both; a benchmark regressed when it is more than `tolerance`
+    (relative) slower.
+    """
+    rows = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        base, current = baseline[name]['median_s'], results[name]['median_s']
+        ratio = current / base if base > 0 else float('inf')
+        rows.append((name, base, current, ratio, ratio > 1 + tolerance))
+    return rows
@@ -0,0 +1,138 @@
+import json
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from davsn.dataset.flow_store import FLOW_SUFFIX
+
+# label ids drawn for each dataset, in its own id space
+VIPER_IDS = (2, 3, 4, 6, 7, 8, 9, 11, 13, 14, 20, 22, 23, 24, 26, 27)
+SYNTHIA_IDS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 15)
+CITYSCAPES_IDS = tuple(range(34))
+
+
+def _write_image(path, rng, size):
+    w, h = size
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(rng.randint(0, 256, (h, w, 3), dtype=np.uint8)).save(path)
+
+
+def _write_label(path, rng, size, ids):
+    w, h = size
+    path.parent.mkdir(parents=True, exist_ok=True)
+    label = np.asarray(ids, dtype=np.uint8)[rng.randint(0, len(ids), (h, w))]
+    Image.fromarray(label).save(path)
+
+
+def _write_flow(flow_dir, name, rng, size):
+    # (H, W, 2) int16 displacements x 10, as read by `davsn.dataset.flow_store`
+    w, h = size
+    flow = np.clip(rng.randn(h, w, 2) * 20, -32768, 32767).astype(np.int16)
+    np.save(flow_dir / (name + '.npy'), flow)
+
+
+def _write_list(path, names):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('\n'.join(names) + '\n')
+
+
+def make_cityscapes_seq(root, split, num_sequences, size, flow_size, rng):
+    """Cityscapes-Seq tree: labeled frame 000019 and key frame 000018 of each sequence."""
+    root = Path(root)
+    flow_dir = root / f'Estimated_optical_flow_Cityscapes-Seq_{split}'
+    flow_dir.mkdir(parents=True, exist_ok=True)
+    names = []
+    for seq in range(num_sequences):
+        stem = f'synth/synth_{seq:06d}'
+        for frame in (18, 19):
+            _write_image(root / 'Cityscapes/leftImg8bit_sequence' / split / f'{stem}_{frame:06d}_leftImg8bit.png',
+                         rng, size)
+        _write_label(root / 'Cityscapes/gtFine' / split / f'{stem}_000019_gtFine_labelIds.png',
+                     rng, size, CITYSCAPES_IDS)
+        name = f'{stem}_000019_leftImg8bit.png'
+        _write_flow(flow_dir, name.split('/')[-1].replace('leftImg8bit.png', '000018' + FLOW_SUFFIX),
+                    rng, flow_size)
+        names.append(name)
+    _write_list(root / 'CityscapesSeq_list' / f'{split}.txt', names)
+    return names
+
+
+def make_viper(root, num_sequences, frames, size, flow_size, rng):
+    """Viper tree: labeled frames 00010, 00020, ... and their preceding key frames."""
+    root = Path(root)
+    flow_dir = root / 'Estimated_optical_flow_Viper_train'
+    flow_dir.mkdir(parents=True, exist_ok=True)
+    names = []
+    for seq in range(1, num_sequences + 1):
+        for frame in range(10, 10 * (frames + 1), 10):
+            name = f'{seq:03d}/{seq:03d}_{frame:05d}.jpg'
+            _write_image(root / 'Viper/train/img' / name, rng, size)
+            _write_image(root / 'Viper/train/img' / f'{seq:03d}/{seq:03d}_{frame - 1:05d}.jpg', rng, size)
+            _write_label(root / 'Viper/train/cls' / name.replace('jpg', 'png'), rng, size, VIPER_IDS)
+            _write_flow(flow_dir, name.split('/')[-1].replace('.jpg', f'{frame - 1:05d}' + FLOW_SUFFIX),
+                        rng, flow_size)
+            names.append(name)
+    _write_list(root / 'Viper_list/train.txt', names)
+    return names
+
+
+def make_synthia_seq(root, frames, size, flow_size, rng):
+    """SynthiaSeq tree: consecutive frames 000000 ... `frames`, all but the first labeled.
+
+    Labels are 16-bit with the class ids in the red channel. `size` is the frame
+    size before the 120 bottom rows are cropped by the loader.
+    """
+    root = Path(root)
+    flow_dir = root / 'Estimated_optical_flow_SynthiaSeq_train'
+    flow_dir.mkdir(parents=True, exist_ok=True)
+    w, h = size
+    (root / 'SynthiaSeq/label').mkdir(parents=True, exist_ok=True)
+    names = []
+    for frame in range(frames + 1):
+        name = f'{frame:06d}.png'
+        _write_image(root / 'SynthiaSeq/rgb' / name, rng, size)
+        if frame == 0:
+            continue
+        label = np.zeros((h, w, 3), dtype=np.uint16)
+        label[:, :, 2] = np.asarray(SYNTHIA_IDS, dtype=np.uint16)[rng.randint(0, len(SYNTHIA_IDS), (h, w))]
+        cv2.imwrite(str(root / 'SynthiaSeq/label' / name), label)
+        _write_flow(flow_dir, name.replace('.png', FLOW_SUFFIX), rng, flow_size)
+        names.append(name)
+    _write_list(root / 'SynthiaSeq_list/train.txt', names)
+    return names
+
+
+def make_synthetic_data(root, size=(256, 128), num_sequences=4, frames=2, seed=0):
+    """Write small fake Cityscapes-Seq (train and val), Viper and SynthiaSeq trees
+    with their `_int16_x10.npy` flows and list files under `root`.
+
+    Frames and flows are `size` (width, height); SynthiaSeq frames are 120 rows
+    taller so that they are `size` once cropped. Returns the description written
+    to `root/synthetic.json`.
+    """
+    root = Path(root)
+    rng = np.random.RandomState(seed)
+    w, h = size
+    make_cityscapes_seq(root, 'train', num_sequences, size, size, rng)
+    make_cityscapes_seq(root, 'val', num_sequences, size, size, rng)
+    make_viper(root, num_sequences, frames, size, size, rng)
+    make_synthia_seq(root, num_sequences * frames, (w, h + 120), size, rng)
+    info = {'size': list(size), 'num_sequences': num_sequences, 'frames': frames, 'seed': seed}
+    with open(root / 'synthetic.json', 'w') as f:
+        json.dump(info, f)
+    return info
+
+
+def ensure_synthetic_data(root, size=(256, 128), num_sequences=4, frames=2, seed=0):
+    """Reuse the synthetic trees of `root` when they were written with the same settings."""
+    info = {'size': list(size), 'num_sequences': num_sequences, 'frames': frames, 'seed': seed}
+    path = os.path.join(root, 'synthetic.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            if json.load(f) == info:
+                return info
+    return make_synthetic_data(root, size, num_sequences, frames, seed)
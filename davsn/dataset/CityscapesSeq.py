@@ -1,20 +1,25 @@
+import time
+
+import cv2
 import numpy as np
 
 from advent.utils.serialization import json_load
 from davsn.dataset.base_dataset import BaseDataset
+from davsn.dataset.flow_generation import FlowEstimator
 
 class CityscapesSeqDataSet(BaseDataset):
     def __init__(self, root, list_path, set='val',
                  max_iters=None,
                  crop_size=(321, 321), mean=(128, 128, 128),
                  load_labels=True,
-                 info_path='', labels_size=None):
-        super().__init__(root, list_path, set, max_iters, crop_size, labels_size, mean)
+                 info_path='', labels_size=None, flow_path=None, image_cache=None):
+        super().__init__(root, list_path, set, max_iters, crop_size, labels_size, mean, flow_path,
+                         image_cache)
         self.load_labels = load_labels
         self.info = json_load(info_path)
-        self.class_names = np.array(self.info['label'], dtype=np.str)
-        self.mapping = np.array(self.info['label2train'], dtype=np.int)
-        self.map_vector = np.zeros((self.mapping.shape[0],), dtype=np.int64)
+        self.class_names = np.array(self.info['label'], dtype=str)
+        self.mapping = np.array(self.info['label2train'], dtype=np.int64)
+        self.map_vector = np.zeros((self.mapping.shape[0],), dtype=np.uint8)
         for source_label, target_label in self.mapping:
             self.map_vector[source_label] = target_label
 
@@ -24,18 +29,70 @@ class CityscapesSeqDataSet(BaseDataset):
         label_file = self.root / 'gtFine' / self.set / label_name
         return img_file, label_file
 
+    def get_frame_file(self, name, offset):
+        # frame `offset` frames away from `name` in its sequence
+        frame = int(name.split('/')[-1].replace('_leftImg8bit.png','')[-6:])
+        name_frame = name.replace(str(frame).zfill(6) + '_leftImg8bit.png', str(frame + offset).zfill(6) + '_leftImg8bit.png')
+        return self.root / 'leftImg8bit_sequence' / self.set / name_frame
+
+    def get_kf_file(self, name):
+        return self.get_frame_file(name, -1)
+
+    def get_flow_name(self, name):
+        file_name = name.split('/')[-1]
+        frame = int(file_name.replace('_leftImg8bit.png', '')[-6:])
+        return file_name.replace('leftImg8bit.png', str(frame - 1).zfill(6) + '_int16_x10')
+
     def map_labels(self, input_):
         return self.map_vector[input_.astype(np.int64, copy=False)]
 
     def __getitem__(self, index):
-        img_file, label_file, name_cf = self.files[index]
+        img_file, label_file, name_cf = self.get_files(index)
         label = self.get_labels(label_file)
         label_cf = self.map_labels(label).copy()
         image_cf = self.get_image(img_file)
         image_cf = self.preprocess(image_cf)
-        frame_cf = int(name_cf.split('/')[-1].replace('_leftImg8bit.png','')[-6:])
-        name_kf = name_cf.replace(str(frame_cf).zfill(6) + '_leftImg8bit.png', str(frame_cf - 1).zfill(6) + '_leftImg8bit.png')
-        file_kf = self.root / 'leftImg8bit_sequence' / self.set / name_kf
-        image_kf = self.get_image(file_kf)
-        image_kf = self.preprocess(image_kf.copy())
-        return image_cf.copy(), label_cf, image_kf.copy(), np.array(image_cf.shape), name_cf
+        image_kf = self.get_image(self.get_kf_file(name_cf))
+        image_kf = self.preprocess(image_kf)
+        sample = (image_cf, label_cf, image_kf, np.array(image_cf.shape), name_cf)
+        if self.flow_store is not None:
+            sample += (self.get_flow(name_cf),)
+        return sample
+
+class CityscapesSeqClipDataSet(CityscapesSeqDataSet):
+    """Clips of `clip_length` consecutive frames ending at each labeled frame.
+
+    The flows between consecutive frames are estimated on the fly with
+    `FlowEstimator`, in the convention of the stored flows (defined on the
+    earlier frame). Samples are (frames (L, 3, H, W), label, flows
+    (L - 1, 2, H, W) float32, seconds spent estimating the flows, name).
+    """
+
+    def __init__(self, root, list_path, set='val', clip_length=5, flow_method='dis', flow_preset='fast',
+                 crop_size=(321, 321), mean=(128, 128, 128), info_path='', labels_size=None, image_cache=None):
+        super().__init__(root, list_path, set, crop_size=crop_size, mean=mean, info_path=info_path,
+                         labels_size=labels_size, image_cache=image_cache)
+        assert clip_length >= 2, 'Clips need at least two frames'
+        self.clip_length = clip_length
+        self.flow_method = flow_method
+        self.flow_preset = flow_preset
+        # created in each DataLoader worker, OpenCV estimators can not be pickled
+        self._estimator = None
+
+    def __getitem__(self, index):
+        img_file, label_file, name = self.get_files(index)
+        label = self.map_labels(self.get_labels(label_file)).copy()
+        frames = [self.get_image(self.get_frame_file(name, offset)) for offset in range(1 - self.clip_length, 1)]
+        if self._estimator is None:
+            self._estimator = FlowEstimator(self.flow_method, self.flow_preset)
+        gray = [cv2.cvtColor(np.asarray(frame, dtype=np.uint8), cv2.COLOR_RGB2GRAY) for frame in frames]
+        start = time.perf_counter()
+        flows = [self._estimator(kf, cf).transpose((2, 0, 1)) for kf, cf in zip(gray[:-1], gray[1:])]
+        flow_seconds = time.perf_counter() - start
+        frames = np.stack([self.preprocess(frame) for frame in frames])
+        return frames, label, np.stack(flows).astype(np.float32), flow_seconds, name
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_estimator'] = None
+        return state
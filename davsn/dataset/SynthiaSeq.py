@@ -1,34 +1,46 @@
 import numpy as np
 
 from advent.utils.serialization import json_load
-from davsn.dataset.base_dataset import BaseDataset
+from davsn.dataset.base_dataset import BaseDataset, label_lut
 
 class SynthiaSeqDataSet(BaseDataset):
     def __init__(self, root, list_path, set='all',
-                 max_iters=None, crop_size=(321, 321), mean=(128, 128, 128)):
-        super().__init__(root, list_path, set, max_iters, crop_size, None, mean)
+                 max_iters=None, crop_size=(321, 321), mean=(128, 128, 128), flow_path=None,
+                 image_cache=None, label_cache=None):
+        super().__init__(root, list_path, set, max_iters, crop_size, None, mean, flow_path, image_cache,
+                         label_cache)
         # map to cityscape's ids
         self.id_to_trainid = {3: 0, 4: 1, 2: 2, 5: 3, 7: 4, 15: 5, 9: 6, 6: 7, 1: 8, 10: 9, 11: 10, 8: 11,}
+        self.label_lut = label_lut(self.id_to_trainid)
 
     def get_metadata(self, name):
         img_file = self.root / 'rgb' / name
         label_file = self.root / 'label' / name
         return img_file, label_file
 
+    def get_kf_file(self, name):
+        frame = int(name.split('/')[-1].replace('.png',''))
+        name_kf = name.replace(str(frame).zfill(6) + '.png', str(frame-1).zfill(6) + '.png')
+        return self.root / 'rgb' / name_kf
+
+    def get_flow_name(self, name):
+        return name.split('/')[-1].replace('.png', '_int16_x10')
+
+    def convert_labels(self, file):
+        label = self.get_labels_synthia_seq(file)
+        label = label[:-120, :]
+        return self.label_lut[label.astype(np.int64)]
+
     def __getitem__(self, index):
-        img_file, label_file, name = self.files[index]
+        img_file, label_file, name = self.get_files(index)
         image = self.get_image(img_file)
-        label = self.get_labels_synthia_seq(label_file)
         image = image[:-120, :, :]
-        label = label[:-120, :]
-        label_copy = 255 * np.ones(label.shape, dtype=np.float32)
-        for k, v in self.id_to_trainid.items():
-            label_copy[label == k] = v
+        label_copy = self.get_trainid_labels(label_file).astype(np.float32)
         image = self.preprocess(image)
-        frame = int(name.split('/')[-1].replace('.png',''))
-        name_kf = name.replace(str(frame).zfill(6) + '.png', str(frame-1).zfill(6) + '.png')
-        file_kf = self.root / 'rgb' / name_kf
-        image_kf = self.get_image(file_kf)
+        image_kf = self.get_image(self.get_kf_file(name))
         image_kf = image_kf[:-120, :, :]
-        image_kf = self.preprocess(image_kf.copy())
-        return image.copy(), label_copy.copy(), image_kf.copy(), np.array(image.shape), name
+        image_kf = self.preprocess(image_kf)
+        sample = (image, label_copy, image_kf, np.array(image.shape), name)
+        if self.flow_store is not None:
+            sample += (self.get_flow(name),)
+        return sample
@@ -1,15 +1,18 @@
 import numpy as np
 
-from davsn.dataset.base_dataset import BaseDataset
+from davsn.dataset.base_dataset import BaseDataset, label_lut
 import cv2
 
 class ViperDataSet(BaseDataset):
     def __init__(self, root, list_path, set='train',
-                 max_iters=None, crop_size=(321, 321), mean=(128, 128, 128)):
-        super().__init__(root, list_path, set, max_iters, crop_size, None, mean)
+                 max_iters=None, crop_size=(321, 321), mean=(128, 128, 128), flow_path=None,
+                 image_cache=None, label_cache=None):
+        super().__init__(root, list_path, set, max_iters, crop_size, None, mean, flow_path, image_cache,
+                         label_cache)
         # map to cityscape's ids
         self.id_to_trainid = {3: 0, 4: 1, 9: 2, 11: 3, 13: 4, 14: 5, 7: 6, 8: 6, 6: 7, 2: 8, 20: 9, 24: 10, 27: 11,
                           26: 12, 23: 13, 22: 14}
+        self.label_lut = label_lut(self.id_to_trainid)
         self.ignore_ego_vehicle = True
 
     def get_metadata(self, name):
@@ -17,23 +20,34 @@ class ViperDataSet(BaseDataset):
         label_file = self.root / 'train/cls' / name.replace('jpg','png')
         return img_file, label_file
 
-    def __getitem__(self, index):
-        img_file, label_file, name = self.files[index]
-        image = self.get_image(img_file)
-        label = self.get_labels(label_file)
+    def get_kf_file(self, name):
+        frame = int(name.split('/')[-1].replace('.jpg','')[-5:])
+        name_kf = name.replace(str(frame).zfill(5) + '.jpg', str(frame - 1).zfill(5) + '.jpg')
+        return self.root / 'train/img' / name_kf
+
+    def get_flow_name(self, name):
+        file_name = name.split('/')[-1]
+        frame = int(file_name.replace('.jpg', '')[-5:])
+        return file_name.replace('.jpg', str(frame - 1).zfill(5) + '_int16_x10')
+
+    def convert_labels(self, file):
+        label = self.get_labels(file)
         if self.ignore_ego_vehicle:
             lbl_car = label == 24
             ret, lbs, stats, centroid = cv2.connectedComponentsWithStats(np.uint8(lbl_car))
             lb_vg = lbs[-1, lbs.shape[1] // 2]
             if lb_vg > 0:
                 label[lbs == lb_vg] = 0
-        label_copy = 255 * np.ones(label.shape, dtype=np.float32)
-        for k, v in self.id_to_trainid.items():
-            label_copy[label == k] = v
+        return self.label_lut[label.astype(np.int64)]
+
+    def __getitem__(self, index):
+        img_file, label_file, name = self.get_files(index)
+        image = self.get_image(img_file)
+        label_copy = self.get_trainid_labels(label_file).astype(np.float32)
         image = self.preprocess(image)
-        frame = int(name.split('/')[-1].replace('.jpg','')[-5:])
-        name_kf = name.replace(str(frame).zfill(5) + '.jpg', str(frame - 1).zfill(5) + '.jpg')
-        file_kf = self.root / 'train/img' / name_kf
-        image_kf = self.get_image(file_kf)
-        image_kf = self.preprocess(image_kf.copy())
-        return image.copy(), label_copy.copy(), image_kf.copy(), np.array(image.shape), name
+        image_kf = self.get_image(self.get_kf_file(name))
+        image_kf = self.preprocess(image_kf)
+        sample = (image, label_copy, image_kf, np.array(image.shape), name)
+        if self.flow_store is not None:
+            sample += (self.get_flow(name),)
+        return sample
@@ -3,11 +3,15 @@ import numpy as np
 from PIL import Image
 from torch.utils import data
 import random
-import imageio
+import cv2
+
+from davsn.dataset.flow_store import open_flow_store
+from davsn.dataset.image_cache import ImageCache
 
 class BaseDataset(data.Dataset):
     def __init__(self, root, list_path, set_,
-                 max_iters, image_size, labels_size, mean):
+                 max_iters, image_size, labels_size, mean, flow_path=None,
+                 image_cache=None, label_cache=None):
         self.root = Path(root)
         self.set = set_
         self.list_path = list_path.format(self.set)
@@ -17,27 +21,48 @@ class BaseDataset(data.Dataset):
         else:
             self.labels_size = labels_size
         self.mean = mean
+        self.flow_store = None if flow_path is None else open_flow_store(flow_path)
+        self.image_cache = None if image_cache is None else ImageCache(image_cache)
+        self.label_cache = None if label_cache is None else ImageCache(label_cache)
+        # one array shared by the DataLoader workers
         with open(self.list_path) as f:
-            self.img_ids = [i_id.strip() for i_id in f]
-        if max_iters is not None:
-            self.img_ids = self.img_ids * int(np.ceil(float(max_iters) / len(self.img_ids)))
-        self.files = []
-        for name in self.img_ids:
-            img_file, label_file = self.get_metadata(name)
-            self.files.append((img_file, label_file, name))
+            self.img_ids = np.array([i_id.strip() for i_id in f])
+        # samples drawn in training, an `InfiniteSampler` cycles over the names instead of repeating them
+        self.max_iters = max_iters
 
     def get_metadata(self, name):
         raise NotImplementedError
 
+    def get_files(self, index):
+        name = str(self.img_ids[index])
+        img_file, label_file = self.get_metadata(name)
+        return img_file, label_file, name
+
+    def get_kf_file(self, name):
+        raise NotImplementedError
+
+    def get_flow_name(self, name):
+        raise NotImplementedError
+
+    def convert_labels(self, file):
+        raise NotImplementedError
+
+    def get_cache_key(self, file):
+        return Path(file).relative_to(self.root).as_posix()
+
     def __len__(self):
-        return len(self.files)
+        return len(self.img_ids)
 
     def preprocess(self, image):
-        image = image[:, :, ::-1]  # change to BGR
-        image -= self.mean
-        return image.transpose((2, 0, 1))
+        # change to BGR and subtract the mean in one pass; also accepts cached uint8 frames
+        image = np.subtract(image[:, :, ::-1], self.mean, dtype=np.float32)
+        return np.ascontiguousarray(image.transpose((2, 0, 1)))
 
     def get_image(self, file):
+        if self.image_cache is not None:
+            key = self.get_cache_key(file)
+            if key in self.image_cache:
+                return self.image_cache[key]
         return _load_img(file, self.image_size, Image.BICUBIC, rgb=True)
 
     def get_image_crop(self, file):
@@ -53,21 +78,40 @@ class BaseDataset(data.Dataset):
         img = img.resize(self.image_size, Image.BICUBIC)
         return np.asarray(img, np.float32)
 
+    def get_flow(self, name):
+        # int16 flow scaled by 10, (2, H, W); decoded on the training device
+        flow = self.flow_store[self.get_flow_name(name)]
+        return np.ascontiguousarray(flow.transpose((2, 0, 1)))
+
     def get_labels(self, file):
         return _load_img(file, self.labels_size, Image.NEAREST, rgb=False)
 
+    def get_trainid_labels(self, file):
+        # uint8 trainId map, 255 for ignored pixels
+        if self.label_cache is not None:
+            key = self.get_cache_key(file)
+            if key in self.label_cache:
+                return self.label_cache[key]
+        return self.convert_labels(file)
+
     def get_labels_sf(self, file):
         img = Image.open(file)
         img = img.resize(self.labels_size, Image.NEAREST)
         return np.asarray(img, np.float32)[:,:,0]
 
     def get_labels_synthia_seq(self, file):
-        # img = Image.open(file)
-        lbl = imageio.imread(file, format='PNG-FI')[:, :, 0]
+        # 16-bit png, class ids in the red channel (last one in OpenCV's BGR order)
+        lbl = cv2.imread(str(file), cv2.IMREAD_UNCHANGED)[:, :, 2]
         img = Image.fromarray(lbl)
         img = img.resize(self.labels_size, Image.NEAREST)
         return np.asarray(img, np.float32)
 
+def label_lut(id_to_trainid, size=65536):
+    lut = 255 * np.ones((size,), dtype=np.uint8)
+    for k, v in id_to_trainid.items():
+        lut[k] = v
+    return lut
+
 def _load_img(file, size, interpolation, rgb):
     img = Image.open(file)
     if rgb:
@@ -0,0 +1,111 @@
+import os
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+FLOW_METHODS = ('dis', 'farneback')
+DIS_PRESETS = {'ultrafast': cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST,
+               'fast': cv2.DISOPTICAL_FLOW_PRESET_FAST,
+               'medium': cv2.DISOPTICAL_FLOW_PRESET_MEDIUM}
+
+
+def encode_flow(flow):
+    """Convert float displacements to the stored int16 pixels x 10 (see `decode_flow`)."""
+    return np.clip(np.round(flow * 10), -32768, 32767).astype(np.int16)
+
+
+class FlowEstimator:
+    """Classical OpenCV optical flow between a key frame and a current frame.
+
+    Returns (H, W, 2) float32 (x, y) displacements in the convention of
+    `davsn.utils.flow.flow_splat_index`: the flow is defined on the key frame
+    and its pixel p lands on p - flow(p) in the current frame.
+    """
+
+    def __init__(self, method='dis', preset='medium'):
+        if method == 'dis':
+            self.dis = cv2.DISOpticalFlow_create(DIS_PRESETS[preset])
+        elif method != 'farneback':
+            raise NotImplementedError(f"Not yet supported flow method {method}")
+        self.method = method
+
+    def __call__(self, kf, cf):
+        if self.method == 'dis':
+            motion = self.dis.calc(kf, cf, None)
+        else:
+            motion = cv2.calcOpticalFlowFarneback(kf, cf, None, pyr_scale=0.5, levels=5, winsize=15,
+                                                  iterations=3, poly_n=5, poly_sigma=1.2, flags=0)
+        return -motion
+
+
+def flow_jobs(dataset, output_dir):
+    """(current frame, key frame, output file) of every sample of `dataset`,
+    following the dataset's key-frame and flow naming rules."""
+    jobs = []
+    for name in dataset.img_ids:
+        name = str(name)
+        img_file, _ = dataset.get_metadata(name)
+        jobs.append((img_file, dataset.get_kf_file(name),
+                     os.path.join(output_dir, dataset.get_flow_name(name) + '.npy')))
+    return jobs
+
+
+_dataset = None
+_estimator = None
+_crop_bottom = 0
+
+
+def _init_worker(dataset, method, preset, crop_bottom):
+    global _dataset, _estimator, _crop_bottom
+    # one thread per process, the pool provides the parallelism
+    cv2.setNumThreads(1)
+    _dataset = dataset
+    _estimator = FlowEstimator(method, preset)
+    _crop_bottom = crop_bottom
+
+
+def _load_gray(file):
+    # the frame as fed to the model: resized to the dataset's image size (and cropped)
+    image = np.asarray(_dataset.get_image(file), dtype=np.uint8)
+    if _crop_bottom:
+        image = image[:-_crop_bottom]
+    return cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_RGB2GRAY)
+
+
+def _estimate(job):
+    img_file, kf_file, output = job
+    flow = encode_flow(_estimator(_load_gray(kf_file), _load_gray(img_file)))
+    # written under a temporary name, so that an interrupted run leaves no partial flow behind
+    tmp_output = output + '.tmp'
+    with open(tmp_output, 'wb') as f:
+        np.save(f, flow)
+    os.replace(tmp_output, output)
+    return flow.shape[0] * flow.shape[1]
+
+
+def generate_flows(dataset, output_dir, method='dis', preset='medium', crop_bottom=0, num_workers=4):
+    """Estimate the `_int16_x10.npy` flow of every sample of `dataset` into `output_dir`.
+
+    Flows already in `output_dir` are kept, so an interrupted run resumes where
+    it stopped. Frames are read through the dataset (image cache and resizing
+    included), `crop_bottom` rows are dropped as SynthiaSeq does. Returns the
+    numbers of computed and skipped flows, the elapsed seconds and the
+    throughput in pairs and megapixels per second.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = flow_jobs(dataset, output_dir)
+    pending = [job for job in jobs if not os.path.exists(job[2])]
+    start = time.time()
+    pixels = 0
+    with Pool(num_workers, initializer=_init_worker, initargs=(dataset, method, preset, crop_bottom)) as pool:
+        for num_pixels in tqdm(pool.imap_unordered(_estimate, pending, chunksize=4), total=len(pending)):
+            pixels += num_pixels
+    elapsed = time.time() - start
+    return {'computed': len(pending),
+            'skipped': len(jobs) - len(pending),
+            'seconds': elapsed,
+            'pairs_per_second': len(pending) / elapsed if elapsed > 0 else 0.0,
+            'megapixels_per_second': pixels / 1e6 / elapsed if elapsed > 0 else 0.0}
@@ -0,0 +1,90 @@
+import json
+import os
+import os.path as osp
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+FLOW_SUFFIX = '_int16_x10'
+
+
+def _index_path(path):
+    return str(path)[:-len('.npy')] + '.json'
+
+
+class NpyFlowStore:
+    """Reads one `<name>_int16_x10.npy` file per frame pair from a directory."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def __contains__(self, name):
+        return (self.root / (name + '.npy')).exists()
+
+    def __getitem__(self, name):
+        return np.load(self.root / (name + '.npy'), mmap_mode='r')
+
+
+class PackedFlowStore:
+    """Reads flows from a container written by `pack_flow_dir`.
+
+    The container is a flat int16 `.npy` array, memory-mapped on first access,
+    next to a `.json` index mapping each flow name to `[offset, height, width]`.
+    Items are returned as read-only (H, W, 2) views, without copy.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(_index_path(self.path)) as f:
+            self.index = json.load(f)
+        self._data = None
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        if self._data is None:
+            self._data = np.load(self.path, mmap_mode='r')
+        offset, h, w = self.index[name]
+        return self._data[offset:offset + h * w * 2].reshape(h, w, 2)
+
+    def __getstate__(self):
+        # DataLoader workers open their own mapping
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+
+def open_flow_store(path):
+    if str(path).endswith('.npy'):
+        return PackedFlowStore(path)
+    return NpyFlowStore(path)
+
+
+def pack_flow_dir(flow_dir, output):
+    """Pack every `*_int16_x10.npy` file of `flow_dir` into a single container.
+
+    Writes `output` (must end with `.npy`) and its `.json` index, and returns the
+    number of packed flows.
+    """
+    assert str(output).endswith('.npy'), 'Packed flow store must be a .npy file'
+    names = sorted(f[:-len('.npy')] for f in os.listdir(flow_dir)
+                   if f.endswith(FLOW_SUFFIX + '.npy'))
+    index = {}
+    offset = 0
+    for name in names:
+        h, w, c = np.load(osp.join(flow_dir, name + '.npy'), mmap_mode='r').shape
+        assert c == 2, f'Unexpected flow shape for {name}'
+        index[name] = [offset, h, w]
+        offset += h * w * 2
+    data = np.lib.format.open_memmap(str(output), mode='w+', dtype=np.int16, shape=(offset,))
+    for name in tqdm(names):
+        offset, h, w = index[name]
+        flow = np.load(osp.join(flow_dir, name + '.npy'))
+        data[offset:offset + h * w * 2] = flow.astype(np.int16, copy=False).reshape(-1)
+    data.flush()
+    del data
+    with open(_index_path(output), 'w') as f:
+        json.dump(index, f)
+    return len(names)
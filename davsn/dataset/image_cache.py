@@ -0,0 +1,113 @@
+import json
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+
+def _index_path(path):
+    return str(path)[:-len('.npy')] + '.json'
+
+
+class ImageCache:
+    """Read-only cache of resized uint8 RGB frames built by `build_image_cache`,
+    or of trainId label maps built by `build_label_cache`.
+
+    The arrays are stored in a single (N, H, W[, 3]) `.npy` array, memory-mapped
+    on first access, next to a `.json` index mapping each image path (relative
+    to the dataset root) to its row. DataLoader workers share the pages of the
+    mapping instead of decoding and resizing every frame again.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(_index_path(self.path)) as f:
+            self.index = json.load(f)
+        self._data = None
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        if self._data is None:
+            self._data = np.load(self.path, mmap_mode='r')
+        return self._data[self.index[key]]
+
+    def __getstate__(self):
+        # DataLoader workers open their own mapping
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+
+def _decode(args):
+    file, size = args
+    img = Image.open(file).convert('RGB')
+    img = img.resize(size, Image.BICUBIC)
+    return np.asarray(img, np.uint8)
+
+
+def build_image_cache(dataset, output, num_workers=4):
+    """Decode and resize every current and key frame of `dataset` once.
+
+    Writes `output` (must end with `.npy`) and its `.json` index, and returns the
+    number of cached frames.
+    """
+    assert str(output).endswith('.npy'), 'Image cache must be a .npy file'
+    files = []
+    for name in dict.fromkeys(dataset.img_ids):
+        img_file, _ = dataset.get_metadata(name)
+        files += [img_file, dataset.get_kf_file(name)]
+    files = list(dict.fromkeys(files))
+    width, height = dataset.image_size
+    data = np.lib.format.open_memmap(str(output), mode='w+', dtype=np.uint8,
+                                     shape=(len(files), height, width, 3))
+    index = {}
+    with Pool(num_workers) as pool:
+        images = pool.imap(_decode, [(file, dataset.image_size) for file in files], chunksize=8)
+        for row, (file, image) in enumerate(tqdm(zip(files, images), total=len(files))):
+            data[row] = image
+            index[dataset.get_cache_key(file)] = row
+    data.flush()
+    del data
+    with open(_index_path(output), 'w') as f:
+        json.dump(index, f)
+    return len(files)
+
+
+_dataset = None
+
+
+def _init_label_worker(dataset):
+    global _dataset
+    _dataset = dataset
+
+
+def _convert_labels(file):
+    return _dataset.convert_labels(file)
+
+
+def build_label_cache(dataset, output, num_workers=4):
+    """Convert every label map of `dataset` to a uint8 trainId map once, with the
+    dataset's own resizing, cropping, mapping and ego-vehicle removal.
+
+    Writes `output` (must end with `.npy`) and its `.json` index, and returns the
+    number of cached label maps.
+    """
+    assert str(output).endswith('.npy'), 'Label cache must be a .npy file'
+    files = list(dict.fromkeys(dataset.get_metadata(name)[1] for name in dataset.img_ids))
+    shape = dataset.convert_labels(files[0]).shape
+    data = np.lib.format.open_memmap(str(output), mode='w+', dtype=np.uint8,
+                                     shape=(len(files),) + shape)
+    index = {}
+    with Pool(num_workers, initializer=_init_label_worker, initargs=(dataset,)) as pool:
+        labels = pool.imap(_convert_labels, files, chunksize=8)
+        for row, (file, label) in enumerate(tqdm(zip(files, labels), total=len(files))):
+            data[row] = label
+            index[dataset.get_cache_key(file)] = row
+    data.flush()
+    del data
+    with open(_index_path(output), 'w') as f:
+        json.dump(index, f)
+    return len(files)
@@ -0,0 +1,52 @@
+import itertools
+
+import torch
+from torch.utils import data
+
+
+class InfiniteSampler(data.Sampler):
+    """Sampler cycling over a dataset epoch after epoch, without materializing
+    the repeated index list.
+
+    Each epoch is a permutation of the `dataset_size` indices drawn from
+    `seed + epoch` (the list order without `shuffle`). The concatenated epochs
+    are dealt between the `num_replicas` processes of a distributed run, one
+    index each in turn. Every process yields `num_samples` indices, or never
+    stops when it is None. The first `start` ones are skipped in O(1), which
+    is how a resumed run continues where it stopped (see
+    `davsn.utils.checkpoint.resume_loader`).
+    """
+
+    def __init__(self, dataset_size, num_samples=None, shuffle=True, seed=0,
+                 rank=0, num_replicas=1, start=0):
+        assert dataset_size > 0, 'Empty dataset'
+        self.dataset_size = dataset_size
+        self.num_samples = num_samples
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.num_replicas = num_replicas
+        self.start = start
+
+    def epoch_order(self, epoch):
+        if not self.shuffle:
+            return torch.arange(self.dataset_size)
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        return torch.randperm(self.dataset_size, generator=generator)
+
+    def __iter__(self):
+        position = self.start * self.num_replicas + self.rank
+        steps = itertools.count() if self.num_samples is None else range(len(self))
+        epoch, order = -1, None
+        for _ in steps:
+            epoch_, i = divmod(position, self.dataset_size)
+            if epoch_ != epoch:
+                epoch, order = epoch_, self.epoch_order(epoch_).tolist()
+            yield order[i]
+            position += self.num_replicas
+
+    def __len__(self):
+        if self.num_samples is None:
+            raise TypeError('InfiniteSampler without num_samples has no length')
+        return max(self.num_samples - self.start, 0)
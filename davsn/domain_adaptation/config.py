@@ -13,11 +13,22 @@ cfg.EXP_ROOT = project_root / 'experiments'
 cfg.EXP_ROOT_SNAPSHOT = osp.join(cfg.EXP_ROOT, 'snapshots')
 cfg.EXP_ROOT_LOGS = osp.join(cfg.EXP_ROOT, 'logs')
 cfg.GPU_ID = 0
+# execution device: '' for cuda:GPU_ID (cpu when CUDA is not available), or e.g. 'cpu', 'cuda:1'
+cfg.DEVICE = ''
+cfg.NUM_THREADS = 0  # intra-op CPU threads, 0 for the torch default
+cfg.NUM_INTEROP_THREADS = 0  # inter-op CPU threads, 0 for the torch default
+cfg.CHANNELS_LAST = False
+# multi-process training (scripts/train.py --num-processes): backend '' for nccl on CUDA, gloo on the CPU
+cfg.DIST_BACKEND = ''
+cfg.DIST_URL = 'tcp://127.0.0.1:29500'
 cfg.TRAIN = EasyDict()
 cfg.TRAIN.SET_SOURCE = 'all'
 cfg.TRAIN.SET_TARGET = 'train'
 cfg.TRAIN.BATCH_SIZE_SOURCE = 1
 cfg.TRAIN.BATCH_SIZE_TARGET = 1
+cfg.TRAIN.ACCUM_STEPS = 1  # micro-batches per optimizer step, effective batch = BATCH_SIZE_* x ACCUM_STEPS
+cfg.TRAIN.GRAD_CHECKPOINT_LAYERS = ()  # backbone layers ('layer1'..'layer4') of the current frame recomputed in the backward
+cfg.TRAIN.GRAD_CHECKPOINT_BLOCKS = 0  # Bottlenecks per recomputed segment, 0 for whole layers
 cfg.TRAIN.IGNORE_LABEL = 255
 cfg.TRAIN.INPUT_SIZE_SOURCE = (1280, 720)
 cfg.TRAIN.INPUT_SIZE_TARGET = (1024, 512)
@@ -38,9 +49,17 @@ cfg.TRAIN.MAX_ITERS = 250000
 cfg.TRAIN.EARLY_STOP = 120000
 cfg.TRAIN.SAVE_PRED_EVERY = 1000
 cfg.TRAIN.SNAPSHOT_DIR = ''
+cfg.TRAIN.RESUME_FROM = ''  # full training state (train_state.pth) to resume from
 cfg.TRAIN.RANDOM_SEED = 1234
 cfg.TRAIN.TENSORBOARD_LOGDIR = ''
 cfg.TRAIN.TENSORBOARD_VIZRATE = 100
+cfg.TRAIN.LOG_LOSSES_EVERY = 10  # iterations of losses kept on the device before being printed/logged at once
+# per-stage timings of the training step
+cfg.TRAIN.PROFILE = False
+cfg.TRAIN.PROFILE_SYNC = False  # synchronize CUDA around the timed regions
+cfg.TRAIN.PROFILE_WINDOW = 100  # iterations of the rolling percentiles
+cfg.TRAIN.PROFILE_EVERY = 100
+cfg.TRAIN.PROFILE_FILE = ''  # JSON lines, SNAPSHOT_DIR/profile.jsonl if empty
 
 # DA-VSN
 cfg.TRAIN.DA_METHOD = 'DAVSN'
@@ -58,6 +77,12 @@ cfg.TRAIN.flow_path = '../../data/Estimated_optical_flow_Cityscapes-Seq_train'
 cfg.TRAIN.lamda_sa = 1.0
 cfg.TRAIN.lamda_wd = 1.0
 cfg.TRAIN.lamda_u = 0.001
+# optional caches of resized frames / labels built by scripts/build_image_cache.py ('' to disable)
+cfg.TRAIN.IMAGE_CACHE_SOURCE = ''
+cfg.TRAIN.IMAGE_CACHE_TARGET = ''
+cfg.TRAIN.LABEL_CACHE_SOURCE = ''
+# mixed precision {'', 'fp16', 'bf16'}, fp16 losses are scaled on CUDA
+cfg.TRAIN.AMP = ''
 
 # TEST CONFIGS
 cfg.TEST = EasyDict()
@@ -77,7 +102,25 @@ cfg.TEST.INPUT_SIZE_TARGET = (1024, 512)
 cfg.TEST.OUTPUT_SIZE_TARGET = (2048, 1024)
 cfg.TEST.INFO_TARGET = str(project_root / 'davsn/dataset/cityscapes_list/info.json')
 cfg.TEST.WAIT_MODEL = True
+cfg.TEST.SNAPSHOT_POLL = 1.0  # used in 'best' mode, seconds between checks for new snapshots without watchdog
+cfg.TEST.NUM_PARALLEL_SNAPSHOTS = 1  # used in 'best' mode, snapshots scored per pass over the val set
+cfg.TEST.SNAPSHOT_DEVICES = ()  # used in 'best' mode, devices the snapshots are spread over (default GPU_ID)
+cfg.TEST.ENSEMBLE_DEVICES = ()  # used in 'single' mode, devices the ensemble members are spread over (default GPU_ID)
 cfg.TEST.flow_path = '../../data/Estimated_optical_flow_Cityscapes-Seq_val'
+cfg.TEST.IMAGE_CACHE_TARGET = ''
+cfg.TEST.AMP = ''  # mixed precision inference {'', 'fp16', 'bf16'}
+# tiled inference
+cfg.TEST.TILE_MEMORY_MB = 0  # inference memory budget per device setting the tile size, 0 runs whole images
+cfg.TEST.TILE_OVERLAP = 128  # input pixels shared by neighbouring tiles
+cfg.TEST.TILE_BYTES_PER_PIXEL = 0  # peak inference memory per input pixel of a tile, estimated when 0
+# key-frame scheduling of streaming inference (scripts/keyframe_report.py)
+cfg.TEST.KF_CLIP_LENGTH = 5  # frames of the val clips ending at the labeled frame
+cfg.TEST.KF_MAX_INTERVAL = 5  # frames between key frames at most
+cfg.TEST.KF_FLOW_THRESHOLD = 20.0  # mean flow magnitude (pixels) accumulated since the key frame
+cfg.TEST.KF_COVERAGE_THRESHOLD = 0.9  # fraction of pixels still covered by the warps since the key frame
+cfg.TEST.KF_CORRECTION = 'lowres'  # {'lowres', 'none'} of the non-key frames
+cfg.TEST.KF_CORRECTION_SCALE = 0.5
+cfg.TEST.KF_FLOW_METHOD = 'dis'  # {'dis', 'farneback'}, estimated on the fly
 
 def _merge_a_into_b(a, b):
     """Merge config dictionary a into config dictionary b, clobbering the
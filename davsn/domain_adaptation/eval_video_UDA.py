@@ -1,18 +1,24 @@
+import copy
 import os
 import os.path as osp
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torch
 from torch import nn
 from tqdm import tqdm
-from advent.utils.func import per_class_iu, fast_hist
 from advent.utils.serialization import pickle_dump, pickle_load
+from davsn.domain_adaptation.tiled_inference import get_tiled_segmenters
+from davsn.utils.device import as_device, setup_device, model_to_device, images_to_device
+from davsn.utils.flow import decode_flow
+from davsn.utils.metrics import ConfusionMatrix, drop_ignored_classes, ignored_classes
+from davsn.utils.snapshot_watcher import SnapshotWatcher
 from PIL import Image
 
 def evaluate_domain_adaptation( models, test_loader, cfg,
                                 fixed_test_size=True,
                                 verbose=True):
-    device = cfg.GPU_ID
+    device = setup_device(cfg)
     interp = None
     if fixed_test_size:
         interp = nn.Upsample(size=(cfg.TEST.OUTPUT_SIZE_TARGET[1], cfg.TEST.OUTPUT_SIZE_TARGET[0]), mode='bilinear', align_corners=True)
@@ -48,48 +54,98 @@ def eval_video_single(cfg, models,
         return new_mask
     num_classes = cfg.NUM_CLASSES
     assert len(cfg.TEST.RESTORE_FROM) == len(models), 'Number of models are not matched'
-    for checkpoint, model in zip(cfg.TEST.RESTORE_FROM, models):
-        load_checkpoint_for_evaluation(model, checkpoint, device)
+    devices = [as_device(d) for d in cfg.TEST.ENSEMBLE_DEVICES] or [device]
+    ensemble = Ensemble(models, cfg.TEST.MODEL_WEIGHT, cfg.TEST.RESTORE_FROM, devices, cfg)
     # eval
-    hist = np.zeros((cfg.NUM_CLASSES, cfg.NUM_CLASSES))
+    metric = ConfusionMatrix(cfg.NUM_CLASSES, device, ignored_classes(cfg))
+    inference_time = 0
     for index, batch in tqdm(enumerate(test_loader)):
-        # image, label, _, name = batch
-        image, label, image2, _, name = batch
-        file_name = name[0].split('/')[-1]
-        frame = int(file_name.replace('_leftImg8bit.png', '')[-6:])
-        frame1 = frame - 1
-        flow_int16_x10_name = file_name.replace('leftImg8bit.png', str(frame1).zfill(6) + '_int16_x10')
-        flow_int16_x10 = np.load(os.path.join(cfg.TEST.flow_path, flow_int16_x10_name + '.npy'))
-        flow = torch.from_numpy(flow_int16_x10 / 10.0).permute(2, 0, 1).unsqueeze(0)
+        image, label, image2, _, name, flow = batch
         if not fixed_test_size:
             interp = nn.Upsample(size=(label.shape[1], label.shape[2]), mode='bilinear', align_corners=True)
         with torch.no_grad():
-            output = None
-            for model, model_weight in zip(models, cfg.TEST.MODEL_WEIGHT):
-                # pred_main = model(image.cuda(device))[1]
-                pred_main = models[0](image.cuda(device), image2.cuda(device), flow, device)[1]
-                output_ = interp(pred_main).cpu().data[0].numpy()
-                if output is None:
-                    output = model_weight * output_
-                else:
-                    output += model_weight * output_
-            assert output is not None, 'Output is None'
-            output = output.transpose(1, 2, 0)
-            output = np.argmax(output, axis=2)
-            amax_output_col = colorize_mask(np.asarray(output, dtype=np.uint8))
-            name = name[0].split('/')[-1]
-            image_name = name.split('.')[0]
+            start = time.time()
+            output = ensemble(image, image2, flow)
+            ensemble.synchronize()
+            inference_time += time.time() - start
+            output = torch.argmax(interp(output), dim=1)
+            metric.update(label, output)
             # vis seg maps
             os.makedirs(cfg.TEST.SNAPSHOT_DIR[0] + '/best_results', exist_ok=True)
-            amax_output_col.save('%s/%s_color.png' % (cfg.TEST.SNAPSHOT_DIR[0] + '/best_results', image_name))
-        label = label.numpy()[0]
-        hist += fast_hist(label.flatten(), output.flatten(), cfg.NUM_CLASSES)
-    inters_over_union_classes = per_class_iu(hist)
-    if cfg.SOURCE == 'SynthiaSeq':
-        ### ignore 'fence' class during evaluation
-        inters_over_union_classes = np.concatenate((inters_over_union_classes[:3], inters_over_union_classes[4:]))
+            for output_, name_ in zip(output.cpu().numpy(), name):
+                amax_output_col = colorize_mask(np.asarray(output_, dtype=np.uint8))
+                image_name = name_.split('/')[-1].split('.')[0]
+                amax_output_col.save('%s/%s_color.png' % (cfg.TEST.SNAPSHOT_DIR[0] + '/best_results', image_name))
+    inters_over_union_classes = metric.reported_iu()
     print(f'mIoU = \t{round(np.nanmean(inters_over_union_classes) * 100, 2)}')
     print([np.round(iou*100, 1) for iou in inters_over_union_classes.tolist()])
+    # the checkpoints are loaded during the first batch
+    inference_time -= ensemble.load_time
+    print(f'FPS = \t{round(len(test_loader) * test_loader.batch_size / inference_time, 2)} on {", ".join(map(str, devices))}')
+    ensemble.close()
+
+class Ensemble:
+    """Weighted ensemble of `models` evaluated as one network.
+
+    Member k runs on `devices[k % len(devices)]` and loads its checkpoint
+    `restore_froms[k]` when first called. Each batch is transferred and its
+    flow decoded once per device, the members run concurrently (one thread
+    each) and their main logits are weighted and summed on the first device.
+    Bilinear upsampling being linear, the sum is upsampled once by the
+    caller. The members run through `TiledSegmenter`, within the
+    TEST.TILE_MEMORY_MB budget of their device: the sum is at the logits
+    resolution without a budget and at the input resolution under one.
+    """
+
+    def __init__(self, models, weights, restore_froms, devices, cfg):
+        assert len(weights) == len(models), 'Number of model weights are not matched'
+        self.models = models
+        self.weights = weights
+        self.restore_froms = restore_froms
+        self.devices = [devices[k % len(devices)] for k in range(len(models))]
+        self.cfg = cfg
+        self.segmenters = get_tiled_segmenters(models, self.devices, cfg)
+        self.loaded = False
+        self.load_time = 0
+        self.executor = ThreadPoolExecutor(max_workers=len(models)) if len(models) > 1 else None
+
+    def _map(self, fn):
+        if self.executor is None:
+            return [fn(0)]
+        return list(self.executor.map(fn, range(len(self.models))))
+
+    def _load(self, k):
+        load_checkpoint_for_evaluation(self.models[k], self.restore_froms[k], self.devices[k], self.cfg)
+
+    def __call__(self, image, image2, flow):
+        if not self.loaded:
+            start = time.time()
+            self._map(self._load)
+            self.load_time = time.time() - start
+            self.loaded = True
+        inputs = {}
+        for device in dict.fromkeys(self.devices):
+            inputs[device] = (images_to_device(image, device, self.cfg), images_to_device(image2, device, self.cfg),
+                              decode_flow(flow.to(device)))
+
+        def predict(k):
+            pred_main = self.segmenters[k](*inputs[self.devices[k]])
+            return self.weights[k] * pred_main.to(self.devices[0], non_blocking=True)
+
+        outputs = self._map(predict)
+        output = outputs[0]
+        for output_ in outputs[1:]:
+            output = output + output_
+        return output
+
+    def synchronize(self):
+        for device in dict.fromkeys(self.devices):
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
 
 def eval_video_best(cfg, models,
               device, test_loader, interp,
@@ -107,60 +163,88 @@ def eval_video_best(cfg, models,
         all_res = {}
     cur_best_miou = -1
     cur_best_model = ''
-    for i_iter in range(start_iter, max_iter + 1, step):
-        restore_from = osp.join(cfg.TEST.SNAPSHOT_DIR[0], f'model_{i_iter}.pth')
-        if not osp.exists(restore_from):
-            # continue
-            if cfg.TEST.WAIT_MODEL:
-                print('Waiting for model..!')
-                while not osp.exists(restore_from):
-                    time.sleep(5)
-        print("Evaluating model", restore_from)
-        if i_iter not in all_res.keys():
-            load_checkpoint_for_evaluation(models[0], restore_from, device)
-            hist = np.zeros((cfg.NUM_CLASSES, cfg.NUM_CLASSES))
-            test_iter = iter(test_loader)
-            for index in tqdm(range(len(test_loader))):
-                # image, label, _, name = next(test_iter)
-                image, label, image2, _, name = next(test_iter)
-                if not fixed_test_size:
-                    interp = nn.Upsample(size=(label.shape[1], label.shape[2]), mode='bilinear', align_corners=True)
-                with torch.no_grad():
-                    file_name = name[0].split('/')[-1]
-                    frame = int(file_name.replace('_leftImg8bit.png', '')[-6:])
-                    frame1 = frame - 1
-                    flow_int16_x10_name = file_name.replace('leftImg8bit.png', str(frame1).zfill(6) + '_int16_x10')
-                    flow_int16_x10 = np.load(os.path.join(cfg.TEST.flow_path, flow_int16_x10_name + '.npy'))
-                    flow = torch.from_numpy(flow_int16_x10 / 10.0).permute(2, 0, 1).unsqueeze(0)
-                    # pred_main = models[0](image.cuda(device))[1]
-                    pred_main= models[0](image.cuda(device), image2.cuda(device), flow, device)[1]
-                    pred_argmax = torch.argmax(interp(pred_main),dim=1)
-                    output = pred_argmax.cpu().data[0].numpy()
-                label = label.numpy()[0]
-                hist += fast_hist(label.flatten(), output.flatten(), cfg.NUM_CLASSES)
-                if verbose and index > 0 and index % 100 == 0:
+    all_iters = list(range(start_iter, max_iter + 1, step))
+    watcher = SnapshotWatcher(cfg.TEST.SNAPSHOT_DIR[0], cfg.TEST.SNAPSHOT_POLL)
+    num_parallel = cfg.TEST.NUM_PARALLEL_SNAPSHOTS
+    snapshot_devices = [as_device(d) for d in cfg.TEST.SNAPSHOT_DEVICES] or [device]
+    replicas = [models[0]] + [copy.deepcopy(models[0]) for _ in range(num_parallel - 1)]
+    # the watchdog observer thread is stopped also on errors or Ctrl-C while waiting
+    try:
+        for i_iter in all_iters:
+            restore_from = osp.join(cfg.TEST.SNAPSHOT_DIR[0], f'model_{i_iter}.pth')
+            if i_iter not in all_res.keys():
+                if not watcher.is_ready(restore_from):
+                    if not cfg.TEST.WAIT_MODEL:
+                        print('Missing model', restore_from)
+                        continue
+                    print('Waiting for model..!')
+                    watcher.wait(restore_from)
+                # score the next snapshots already on disk in the same pass over the val set
+                group = [i_iter]
+                for j_iter in all_iters[all_iters.index(i_iter) + 1:]:
+                    if len(group) == num_parallel:
+                        break
+                    if j_iter not in all_res.keys() and \
+                            watcher.is_ready(osp.join(cfg.TEST.SNAPSHOT_DIR[0], f'model_{j_iter}.pth')):
+                        group.append(j_iter)
+                for j_iter in group:
+                    print("Evaluating model", osp.join(cfg.TEST.SNAPSHOT_DIR[0], f'model_{j_iter}.pth'))
+                ious = eval_snapshots(cfg, replicas[:len(group)],
+                                      [osp.join(cfg.TEST.SNAPSHOT_DIR[0], f'model_{j_iter}.pth') for j_iter in group],
+                                      snapshot_devices, test_loader, interp, fixed_test_size, verbose)
+                for j_iter, inters_over_union_classes in zip(group, ious):
+                    all_res[j_iter] = inters_over_union_classes
+                pickle_dump(all_res, cache_path)
+            inters_over_union_classes = drop_ignored_classes(all_res[i_iter], ignored_classes(cfg))
+            computed_miou = round(np.nanmean(inters_over_union_classes) * 100, 2)
+            if cur_best_miou < computed_miou:
+                cur_best_miou = computed_miou
+                cur_best_iou = inters_over_union_classes * 100
+                cur_best_model = restore_from
+            print('\tCurrent mIoU:', computed_miou)
+            print('\tCurrent best model:', cur_best_model)
+            print('\tCurrent best mIoU:', cur_best_miou)
+            print([np.round(iou,1) for iou in cur_best_iou])
+    finally:
+        watcher.close()
+
+def eval_snapshots(cfg, models, restore_froms,
+                   devices, test_loader, interp,
+                   fixed_test_size, verbose):
+    """Score several snapshots in a single pass over `test_loader`.
+
+    Snapshot k is loaded into `models[k]` on `devices[k % len(devices)]`. Each
+    batch is decoded once and the models run concurrently, one thread each.
+    Returns the per-class IoUs of each snapshot.
+    """
+    devices = [devices[k % len(devices)] for k in range(len(models))]
+    for model, restore_from, device in zip(models, restore_froms, devices):
+        load_checkpoint_for_evaluation(model, restore_from, device, cfg)
+    metrics = [ConfusionMatrix(cfg.NUM_CLASSES, device) for device in devices]
+    segmenters = get_tiled_segmenters(models, devices, cfg)
+
+    def predict(k, image, label, image2, flow):
+        with torch.no_grad():
+            device = devices[k]
+            pred_main = segmenters[k](images_to_device(image, device, cfg), images_to_device(image2, device, cfg),
+                                      decode_flow(flow.to(device)))
+            pred_argmax = torch.argmax(interp(pred_main), dim=1)
+            metrics[k].update(label, pred_argmax)
+
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        for index, batch in enumerate(tqdm(test_loader)):
+            image, label, image2, _, name, flow = batch
+            if not fixed_test_size:
+                interp = nn.Upsample(size=(label.shape[1], label.shape[2]), mode='bilinear', align_corners=True)
+            list(executor.map(lambda k: predict(k, image, label, image2, flow), range(len(models))))
+            if verbose and index > 0 and index % 100 == 0:
+                for metric in metrics:
                     print('{:d} / {:d}: {:0.2f}'.format(
-                        index, len(test_loader), 100 * np.nanmean(per_class_iu(hist))))
-            inters_over_union_classes = per_class_iu(hist)
-            all_res[i_iter] = inters_over_union_classes
-            pickle_dump(all_res, cache_path)
-        else:
-            inters_over_union_classes = all_res[i_iter]
-        if cfg.SOURCE == 'SynthiaSeq':
-            ### ignore 'fence' class during evaluation
-            inters_over_union_classes = np.concatenate((inters_over_union_classes[:3], inters_over_union_classes[4:]))
-        computed_miou = round(np.nanmean(inters_over_union_classes) * 100, 2)
-        if cur_best_miou < computed_miou:
-            cur_best_miou = computed_miou
-            cur_best_iou = inters_over_union_classes * 100
-            cur_best_model = restore_from
-        print('\tCurrent mIoU:', computed_miou)
-        print('\tCurrent best model:', cur_best_model)
-        print('\tCurrent best mIoU:', cur_best_miou)
-        print([np.round(iou,1) for iou in cur_best_iou])
-
-def load_checkpoint_for_evaluation(model, checkpoint, device):
-    saved_state_dict = torch.load(checkpoint)
+                        index, len(test_loader), 100 * np.nanmean(metric.per_class_iu())))
+    return [metric.per_class_iu() for metric in metrics]
+
+def load_checkpoint_for_evaluation(model, checkpoint, device, cfg):
+    saved_state_dict = torch.load(checkpoint, map_location=device)
     model.load_state_dict(saved_state_dict)
     model.eval()
-    model.cuda(device)
+    model_to_device(model, device, cfg)
@@ -0,0 +1,109 @@
+import torch
+import torch.nn.functional as F
+
+from davsn.model.streaming import StreamingAccel
+from davsn.utils.flow import resize_flow, propagate_by_flow
+
+
+class KeyFrameScheduler:
+    """Decide which frames of a stream run the full backbone.
+
+    A frame becomes a key frame when `max_interval` frames have passed since
+    the last one, when the mean flow magnitude accumulated since then exceeds
+    `flow_threshold` pixels, or when the fraction of pixels still covered by
+    the warps from the last key frame (the product of the `rec_positions`
+    masks) drops below `coverage_threshold`.
+    """
+
+    def __init__(self, max_interval=5, flow_threshold=20.0, coverage_threshold=0.9):
+        self.max_interval = max_interval
+        self.flow_threshold = flow_threshold
+        self.coverage_threshold = coverage_threshold
+        self.reset()
+
+    def reset(self):
+        self.since_key = 0
+        self.motion = 0.0
+
+    def is_key_frame(self, flow_magnitude, coverage):
+        self.since_key += 1
+        self.motion += flow_magnitude
+        is_key = (self.since_key >= self.max_interval
+                  or self.motion > self.flow_threshold
+                  or coverage < self.coverage_threshold)
+        if is_key:
+            self.reset()
+        return is_key
+
+
+class KeyFrameSegmenter:
+    """Streaming inference of `ResNetMulti` running the backbone on key frames only.
+
+    Built on the previous-frame cache of `StreamingAccel`. Key frames go
+    through `StreamingAccel.step`, fusing their logits with the cached ones
+    through `sf_layer` as `ResNetMulti.forward` does with a key frame. Other
+    frames get the cached logits warped along their flow (defined on the
+    previous frame, as the stored flows) with a cheap correction:
+    - 'lowres': the backbone on the frame downscaled by `correction_scale`,
+      fused through `sf_layer` and filling the pixels the warp left empty;
+    - 'none': the empty pixels keep the previous logits.
+    and the corrected logits are cached in place of backbone logits. A frame
+    not following the cached one (first frame, new sequence, skipped frame)
+    starts the stream as a key frame, without fusion. With `max_interval=1`
+    the predictions are those of `ResNetMulti.forward` on consecutive frame
+    pairs, for one backbone pass per frame instead of two.
+    """
+
+    def __init__(self, model, scheduler, device, correction='lowres', correction_scale=0.5, amp=''):
+        if correction not in ('lowres', 'none'):
+            raise NotImplementedError(f"Not yet supported key-frame correction {correction}")
+        self.model = model
+        self.scheduler = scheduler
+        self.correction = correction
+        self.correction_scale = correction_scale
+        self.stream = StreamingAccel(model, device, amp)
+        self.reset()
+
+    def reset(self):
+        self.stream.reset()
+        self.valid = None
+        self.scheduler.reset()
+
+    @torch.no_grad()
+    def step(self, image, flow, frame_id):
+        """Main-level logits of frame `frame_id` (sequence, index) of the stream
+        and whether it was a key frame.
+
+        `flow` goes from the previous frame to `image` and is ignored when the
+        previous frame is not cached.
+        """
+        shape = tuple(image.shape)
+        cached = self.stream.cached_logits(frame_id, shape)
+        if cached is None:
+            logits = self.stream.extract(image)
+            self.stream.update(frame_id, shape, logits)
+            self.valid = torch.ones_like(logits[1][:, :1])
+            self.scheduler.reset()
+            return logits[1], True
+        flow_logits = resize_flow(flow, cached[1].shape[-2:])
+        (warped_aux, warped, valid), rec_positions = propagate_by_flow([*cached, self.valid], flow_logits)
+        flow_magnitude = torch.norm(flow, dim=1).mean().item()
+        if self.scheduler.is_key_frame(flow_magnitude, valid.mean().item()):
+            pred = self.stream.step(image, None, flow, frame_id)[1]
+            self.valid = torch.ones_like(valid)
+            return pred, True
+        if self.correction == 'lowres':
+            small = F.interpolate(image, scale_factor=self.correction_scale, mode='bilinear', align_corners=True)
+            fill = [None if x is None else F.interpolate(x, size=warped.shape[-2:], mode='bilinear', align_corners=True)
+                    for x in self.stream.extract(small)]
+        else:
+            fill = cached
+        logits = tuple(None if x is None else rec_positions * x + (1 - rec_positions) * x_fill
+                       for x, x_fill in zip((warped_aux, warped), fill))
+        if self.correction == 'lowres':
+            pred = self.model.sf_layer(torch.cat((fill[1], rec_positions * warped), dim=1))
+        else:
+            pred = logits[1]
+        self.stream.update(frame_id, shape, logits)
+        self.valid = valid
+        return pred, False
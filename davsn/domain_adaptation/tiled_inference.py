@@ -0,0 +1,138 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+from davsn.utils.amp import autocast
+from davsn.utils.flow import resize_flow
+
+# activation elements alive at the peak of an inference forward, per input pixel:
+# the first block of layer4 holds its 1024-channel input plus three 2048-channel
+# maps (conv3, downsample, output) at 1/8 resolution
+ACTIVATION_ELEMENTS_PER_PIXEL = (1024 + 3 * 2048) / 64
+
+
+def estimate_bytes_per_pixel(num_classes, amp=''):
+    """Rough peak inference memory of `ResNetMulti` per input pixel of a tile.
+
+    Counts the activations in the autocast precision, the two input frames,
+    the float64 flow and the upsampled and weighted tile logits, plus 25% for
+    the convolution workspaces. `tiling_report.py` measures the actual value.
+    """
+    activation_bytes = ACTIVATION_ELEMENTS_PER_PIXEL * (2 if amp else 4)
+    input_bytes = 2 * 3 * 4 + 2 * 8
+    logits_bytes = 2 * num_classes * 4
+    return 1.25 * (activation_bytes + input_bytes + logits_bytes)
+
+
+def choose_tile_size(image_size, budget_bytes, bytes_per_pixel, overlap, multiple=8):
+    """Largest (height, width) tile of about `budget_bytes`, close to a square.
+
+    Returns `image_size` when the whole image fits in the budget.
+    """
+    h, w = image_size
+    if h * w * bytes_per_pixel <= budget_bytes:
+        return h, w
+    if budget_bytes <= 0:
+        raise ValueError(f'Memory budget too small for the {h}x{w} blending buffers')
+    pixels = budget_bytes / bytes_per_pixel
+    tile_w = min(w, int(math.sqrt(pixels)) // multiple * multiple)
+    tile_h = min(h, int(pixels / max(tile_w, 1)) // multiple * multiple)
+    tile_w = min(w, int(pixels / max(tile_h, 1)) // multiple * multiple)
+    if (tile_h < h and tile_h <= overlap) or (tile_w < w and tile_w <= overlap):
+        raise ValueError(f'Memory budget too small: {tile_h}x{tile_w} tiles for an overlap of {overlap} pixels')
+    return tile_h, tile_w
+
+
+def tile_starts(length, tile, overlap):
+    """Offsets of the tiles covering `length` pixels, `overlap` pixels apart at least."""
+    if tile >= length:
+        return [0]
+    return list(range(0, length - tile, tile - overlap)) + [length - tile]
+
+
+def blend_ramp(start, tile, length, overlap, device):
+    """1-D blending weights of a tile, ramping linearly over the `overlap`
+    pixels shared with a neighbour and flat at the image borders."""
+    ramp = torch.ones(tile, device=device)
+    if overlap > 0:
+        position = torch.arange(tile, device=device, dtype=torch.float32) + 0.5
+        if start > 0:
+            ramp = torch.minimum(ramp, position / overlap)
+        if start + tile < length:
+            ramp = torch.minimum(ramp, position.flip(0) / overlap)
+    return ramp
+
+
+class TiledSegmenter:
+    """Main-level logits of `ResNetMulti.forward` computed on overlapping tiles.
+
+    The tile size is the largest whose peak memory, `bytes_per_pixel` per
+    pixel (see `estimate_bytes_per_pixel` when 0), fits in `memory_budget_mb`
+    besides the full-size blending buffers. The flow is resized to the frames,
+    then both frames and the flow are cropped to the same window, so the flow
+    keeps its displacements and the key-frame pixels moving out of a tile are
+    dropped, as at the image borders. The tile logits are upsampled to the tile
+    size and blended with weights ramping over the `overlap` pixels shared by
+    neighbouring tiles. Under a budget the logits are always returned at the
+    input resolution, also when the whole image fits in one tile, so that
+    segmenters of different budgets can be summed. Without a budget the model
+    runs once and its logits are returned at their own resolution.
+    """
+
+    def __init__(self, model, device, memory_budget_mb=0, overlap=128, bytes_per_pixel=0, amp=''):
+        self.model = model
+        self.device = device
+        self.memory_budget_mb = memory_budget_mb
+        self.overlap = overlap
+        self.bytes_per_pixel = bytes_per_pixel
+        self.amp = amp
+
+    def tile_size(self, image_size, batch_size):
+        if not self.memory_budget_mb:
+            return tuple(image_size)
+        num_classes = self.model.sf_layer.out_channels
+        bytes_per_pixel = batch_size * (self.bytes_per_pixel or estimate_bytes_per_pixel(num_classes, self.amp))
+        # the blended logits and the weights of the whole image
+        buffer_bytes = batch_size * (num_classes + 1) * 4 * image_size[0] * image_size[1]
+        return choose_tile_size(image_size, self.memory_budget_mb * 2 ** 20 - buffer_bytes, bytes_per_pixel,
+                                self.overlap)
+
+    def forward(self, cf, kf, flow):
+        with autocast(self.device, self.amp):
+            pred = self.model(cf, kf, flow, self.device)[1]
+        return pred.float()
+
+    @torch.no_grad()
+    def __call__(self, cf, kf, flow):
+        h, w = cf.shape[-2:]
+        if not self.memory_budget_mb:
+            return self.forward(cf, kf, flow)
+        tile_h, tile_w = self.tile_size((h, w), cf.shape[0])
+        if (tile_h, tile_w) == (h, w):
+            return F.interpolate(self.forward(cf, kf, flow), size=(h, w), mode='bilinear', align_corners=True)
+        if flow.shape[-2:] != (h, w):
+            # cropped in input coordinates
+            flow = resize_flow(flow, (h, w))
+        output = None
+        weight = torch.zeros(h, w, device=cf.device)
+        for y in tile_starts(h, tile_h, self.overlap):
+            ramp_y = blend_ramp(y, tile_h, h, self.overlap, cf.device)
+            for x in tile_starts(w, tile_w, self.overlap):
+                window = (..., slice(y, y + tile_h), slice(x, x + tile_w))
+                pred = self.forward(cf[window], kf[window], flow[window])
+                pred = F.interpolate(pred, size=(tile_h, tile_w), mode='bilinear', align_corners=True)
+                if output is None:
+                    output = pred.new_zeros(pred.shape[:2] + (h, w))
+                tile_weight = ramp_y[:, None] * blend_ramp(x, tile_w, w, self.overlap, cf.device)
+                output[window] += tile_weight * pred
+                weight[window] += tile_weight
+        return output.div_(weight)
+
+
+def get_tiled_segmenters(models, devices, cfg):
+    """A `TiledSegmenter` for each of `models`, run concurrently on the matching
+    `devices`; the models of a device share its TEST.TILE_MEMORY_MB budget."""
+    return [TiledSegmenter(model, device, cfg.TEST.TILE_MEMORY_MB / devices.count(device), cfg.TEST.TILE_OVERLAP,
+                           cfg.TEST.TILE_BYTES_PER_PIXEL, cfg.TEST.AMP)
+            for model, device in zip(models, devices)]
@@ -1,8 +1,8 @@
+import math
 import os
 import sys
 from pathlib import Path
 import os.path as osp
-import numpy as np
 import torch
 import torch.backends.cudnn as cudnn
 import torch.nn.functional as F
@@ -13,10 +13,18 @@ from torchvision.utils import make_grid
 from tqdm import tqdm
 from advent.model.discriminator import get_fc_discriminator
 from advent.utils.func import adjust_learning_rate, adjust_learning_rate_discriminator
-from advent.utils.func import loss_calc, bce_loss
+from advent.utils.func import loss_calc
 from advent.utils.loss import entropy_loss
 from advent.utils.func import prob_2_entropy
 from advent.utils.viz_segmask import colorize_mask
+from davsn.model.discriminator import DiscriminatorBank
+from davsn.utils.amp import autocast, grad_scaler
+from davsn.utils.checkpoint import CheckpointWriter, load_checkpoint, resume_loader, get_rng_state, set_rng_state
+from davsn.utils.device import setup_device, model_to_device, images_to_device
+from davsn.utils.distributed import is_main_process, wrap_ddp, set_grad_sync
+from davsn.utils.flow import decode_flow, resize_flow, propagate_by_flow
+from davsn.utils.loss_logger import LossLogger
+from davsn.utils.profiler import StageProfiler
 
 def train_domain_adaptation(model, source_loader, target_loader, cfg):
     if cfg.TRAIN.DA_METHOD == 'DAVSN':
@@ -28,44 +36,46 @@ def train_DAVSN(model, source_loader, target_loader, cfg):
     # Create the model and start the training.
     input_size_source = cfg.TRAIN.INPUT_SIZE_SOURCE
     input_size_target = cfg.TRAIN.INPUT_SIZE_TARGET
-    device = cfg.GPU_ID
+    device = setup_device(cfg)
     num_classes = cfg.NUM_CLASSES
-    viz_tensorboard = os.path.exists(cfg.TRAIN.TENSORBOARD_LOGDIR)
+    # in a distributed run only the first process logs and takes snapshots
+    viz_tensorboard = os.path.exists(cfg.TRAIN.TENSORBOARD_LOGDIR) and is_main_process()
     if viz_tensorboard:
         writer = SummaryWriter(log_dir=cfg.TRAIN.TENSORBOARD_LOGDIR)
     # SEGMNETATION NETWORK
     model.train()
-    model.to(device)
+    model.set_gradient_checkpointing(cfg.TRAIN.GRAD_CHECKPOINT_LAYERS, cfg.TRAIN.GRAD_CHECKPOINT_BLOCKS)
+    model_to_device(model, device, cfg)
+    # autotuned kernels may differ after a restart: a resumed run is only bit-exact on the CPU
     cudnn.benchmark = True
     cudnn.enabled = True
     # DISCRIMINATOR NETWORK
     d_sta_aux = get_fc_discriminator(num_classes=num_classes*2)
-    d_sta_aux.train()
-    d_sta_aux.to(device)
     d_sta_main = get_fc_discriminator(num_classes=num_classes*2)
-    d_sta_main.train()
-    d_sta_main.to(device)
     d_sa_aux = get_fc_discriminator(num_classes=num_classes*2)
-    d_sa_aux.train()
-    d_sa_aux.to(device)
     d_sa_main = get_fc_discriminator(num_classes=num_classes*2)
-    d_sa_main.train()
-    d_sa_main.to(device)
+    # stacked into one bank evaluated with grouped convolutions, ordered (sta, sa) pairs
+    if cfg.TRAIN.MULTI_LEVEL:
+        d_bank = DiscriminatorBank([d_sta_main, d_sa_main, d_sta_aux, d_sa_aux])
+    else:
+        d_bank = DiscriminatorBank([d_sta_main, d_sa_main])
+    d_bank.train()
+    model_to_device(d_bank, device, cfg)
+    # DistributedDataParallel wrappers (the modules themselves when single-process),
+    # gradients are all-reduced in the last backward pass of each iteration only
+    ddp_model = wrap_ddp(model, device)
+    ddp_d_bank = wrap_ddp(d_bank, device)
 
     # OPTIMIZERS
     optimizer = optim.SGD(model.optim_parameters(cfg.TRAIN.LEARNING_RATE),
                           lr=cfg.TRAIN.LEARNING_RATE,
                           momentum=cfg.TRAIN.MOMENTUM,
                           weight_decay=cfg.TRAIN.WEIGHT_DECAY)
-    # discriminators' optimizers
-    optimizer_d_sta_aux = optim.Adam(d_sta_aux.parameters(), lr=cfg.TRAIN.LEARNING_RATE_D,
-                                          betas=(0.9, 0.99))
-    optimizer_d_sta_main = optim.Adam(d_sta_main.parameters(), lr=cfg.TRAIN.LEARNING_RATE_D,
-                                           betas=(0.9, 0.99))
-    optimizer_d_sa_aux = optim.Adam(d_sa_aux.parameters(), lr=cfg.TRAIN.LEARNING_RATE_D,
-                                 betas=(0.9, 0.99))
-    optimizer_d_sa_main = optim.Adam(d_sa_main.parameters(), lr=cfg.TRAIN.LEARNING_RATE_D,
-                                  betas=(0.9, 0.99))
+    # discriminators' optimizer, Adam being element-wise this is the same as one optimizer per discriminator
+    optimizer_d = optim.Adam(d_bank.parameters(), lr=cfg.TRAIN.LEARNING_RATE_D,
+                             betas=(0.9, 0.99), foreach=True)
+    # mixed precision: losses are scaled for fp16 on CUDA, unscaled before clipping
+    scaler = grad_scaler(device, cfg.TRAIN.AMP)
     # interpolate output segmaps
     interp_source = nn.Upsample(size=(input_size_source[1], input_size_source[0]), mode='bilinear',
                          align_corners=True)
@@ -74,285 +84,262 @@ def train_DAVSN(model, source_loader, target_loader, cfg):
     # labels for adversarial training
     source_label = 0
     target_label = 1
+    accum_steps = cfg.TRAIN.ACCUM_STEPS
+    # RESUME: weights, optimizers, loader positions and RNG states of the last snapshot
+    start_iter = 0
+    if cfg.TRAIN.RESUME_FROM:
+        state = load_checkpoint(cfg.TRAIN.RESUME_FROM)
+        model.load_state_dict(state['model'])
+        d_bank.load_state_dict(state['d_bank'])
+        optimizer.load_state_dict(state['optimizer'])
+        optimizer_d.load_state_dict(state['optimizer_d'])
+        scaler.load_state_dict(state['scaler'])
+        start_iter = state['iteration'] + 1
+        resume_loader(source_loader, state['samples_source'])
+        resume_loader(target_loader, state['samples_target'])
+        if is_main_process():
+            print(f'Resumed from {cfg.TRAIN.RESUME_FROM} at iteration {start_iter}')
     source_loader_iter = enumerate(source_loader)
     target_loader_iter = enumerate(target_loader)
-    for i_iter in tqdm(range(cfg.TRAIN.EARLY_STOP + 1)):
+    if cfg.TRAIN.RESUME_FROM:
+        # after creating the iterators, whose worker seeds are drawn from the torch RNG
+        set_rng_state(state['rng'], device)
+    # snapshots are written in the background
+    checkpoint_writer = CheckpointWriter() if is_main_process() else None
+    # per-stage timings of the training step
+    profiler = StageProfiler(device, enabled=cfg.TRAIN.PROFILE and is_main_process(),
+                             sync=cfg.TRAIN.PROFILE_SYNC, window=cfg.TRAIN.PROFILE_WINDOW,
+                             log_every=cfg.TRAIN.PROFILE_EVERY,
+                             jsonl_path=cfg.TRAIN.PROFILE_FILE or osp.join(cfg.TRAIN.SNAPSHOT_DIR, 'profile.jsonl'),
+                             writer=writer if viz_tensorboard else None)
+    # losses printed and logged every LOG_LOSSES_EVERY iterations, without a device sync per iteration
+    loss_logger = None
+    if is_main_process():
+        loss_logger = LossLogger(device, cfg.TRAIN.LOG_LOSSES_EVERY, writer if viz_tensorboard else None)
+    for i_iter in tqdm(range(start_iter, cfg.TRAIN.EARLY_STOP + 1), disable=not is_main_process()):
         # reset optimizers
         optimizer.zero_grad()
-        optimizer_d_sta_aux.zero_grad()
-        optimizer_d_sta_main.zero_grad()
-        optimizer_d_sa_aux.zero_grad()
-        optimizer_d_sa_main.zero_grad()
+        optimizer_d.zero_grad()
         # adapt LR if needed
         adjust_learning_rate(optimizer, i_iter, cfg)
-        adjust_learning_rate_discriminator(optimizer_d_sta_aux, i_iter, cfg)
-        adjust_learning_rate_discriminator(optimizer_d_sta_main, i_iter, cfg)
-        adjust_learning_rate_discriminator(optimizer_d_sa_aux, i_iter, cfg)
-        adjust_learning_rate_discriminator(optimizer_d_sa_main, i_iter, cfg)
+        adjust_learning_rate_discriminator(optimizer_d, i_iter, cfg)
+
+        # gradients are accumulated over accum_steps micro-batches before the optimizers step
+        current_losses = {}
+        for i_micro in range(accum_steps):
+            last_micro = i_micro == accum_steps - 1
+            ######### Source-domain supervised training
+            for param in d_bank.parameters():
+                param.requires_grad = False
+            with profiler.region('data'):
+                _, source_batch = source_loader_iter.__next__()
+            src_img_cf, src_label, src_img_kf, _, src_img_name, src_flow = source_batch
+            if src_label.dim() == 4:
+                src_label = src_label.squeeze(-1)
+            with profiler.region('flow_decode'):
+                src_flow = decode_flow(src_flow.to(device))
+            set_grad_sync(ddp_model, False)
+            with profiler.region('source_forward'), autocast(device, cfg.TRAIN.AMP):
+                src_pred_aux, src_pred, src_pred_cf_aux, src_pred_cf, src_pred_kf_aux, src_pred_kf = ddp_model(images_to_device(src_img_cf, device, cfg), images_to_device(src_img_kf, device, cfg), src_flow, device)
+                src_pred = interp_source(src_pred)
+                loss_seg_src_main = loss_calc(src_pred, src_label, device)
+                if cfg.TRAIN.MULTI_LEVEL:
+                    src_pred_aux = interp_source(src_pred_aux)
+                    loss_seg_src_aux = loss_calc(src_pred_aux, src_label, device)
+                else:
+                    loss_seg_src_aux = 0
+                loss = (cfg.TRAIN.LAMBDA_SEG_MAIN * loss_seg_src_main
+                        + cfg.TRAIN.LAMBDA_SEG_AUX * loss_seg_src_aux)
+            with profiler.region('source_backward'):
+                scaler.scale(loss / accum_steps).backward()
+
+            ######### Usupervised domain adaptation
+            with profiler.region('data'):
+                _, target_batch = target_loader_iter.__next__()
+            trg_img_cf, _, image_trg_kf, _, name, trg_flow = target_batch
+            with profiler.region('flow_decode'):
+                trg_flow = decode_flow(trg_flow.to(device))
+            set_grad_sync(ddp_model, last_micro)
+            with profiler.region('target_forward'), autocast(device, cfg.TRAIN.AMP):
+                trg_pred_aux, trg_pred, trg_pred_cf_aux, trg_pred_cf, trg_pred_kf_aux, trg_pred_kf = ddp_model(images_to_device(trg_img_cf, device, cfg), images_to_device(image_trg_kf, device, cfg), trg_flow, device, fused=False)
 
-        ######### Source-domain supervised training
-        for param in d_sta_aux.parameters():
-            param.requires_grad = False
-        for param in d_sta_main.parameters():
-            param.requires_grad = False
-        for param in d_sa_aux.parameters():
-            param.requires_grad = False
-        for param in d_sa_main.parameters():
-            param.requires_grad = False
-        _, source_batch = source_loader_iter.__next__()
-        src_img_cf, src_label, src_img_kf, _, src_img_name = source_batch
-        if src_label.dim() == 4:
-            src_label = src_label.squeeze(-1)
-        file_name = src_img_name[0].split('/')[-1]
-        if cfg.SOURCE == 'Viper':
-            frame = int(file_name.replace('.jpg', '')[-5:])
-            frame1 = frame - 1
-            flow_int16_x10_name = file_name.replace('.jpg', str(frame1).zfill(5) + '_int16_x10')
-        elif cfg.SOURCE == 'SynthiaSeq':
-            flow_int16_x10_name = file_name.replace('.png', '_int16_x10')
-        flow_int16_x10 = np.load(os.path.join(cfg.TRAIN.flow_path_src, flow_int16_x10_name + '.npy'))
-        src_flow = torch.from_numpy(flow_int16_x10 / 10.0).permute(2, 0, 1).unsqueeze(0)
-        src_pred_aux, src_pred, src_pred_cf_aux, src_pred_cf, src_pred_kf_aux, src_pred_kf = model(src_img_cf.cuda(device), src_img_kf.cuda(device), src_flow, device)
-        src_pred = interp_source(src_pred)
-        loss_seg_src_main = loss_calc(src_pred, src_label, device)
-        if cfg.TRAIN.MULTI_LEVEL:
-            src_pred_aux = interp_source(src_pred_aux)
-            loss_seg_src_aux = loss_calc(src_pred_aux, src_label, device)
-        else:
-            loss_seg_src_aux = 0
-        loss = (cfg.TRAIN.LAMBDA_SEG_MAIN * loss_seg_src_main
-                + cfg.TRAIN.LAMBDA_SEG_AUX * loss_seg_src_aux)
-        loss.backward()
+            with profiler.region('itcr'), autocast(device, cfg.TRAIN.AMP):
+                ###### Intra-domain TCR
+                adversarial_factor_aux = cfg.TRAIN.LAMBDA_ADV_AUX / cfg.TRAIN.LAMBDA_ADV_MAIN  # as in Advent
+                # for current frame (cf)
+                trg_prob_cf = F.softmax(trg_pred_cf)
+                trg_prob_cf_aux = F.softmax(trg_pred_cf_aux)
+                trg_ent_cf = torch.mean(prob_2_entropy(trg_prob_cf), dim=1, keepdim=True).detach()
+                trg_ent_cf_aux = torch.mean(prob_2_entropy(trg_prob_cf_aux), dim=1, keepdim=True).detach()
+                # for key frame (kf): generate propogated prediction via optical flow
+                trg_flow_interp = resize_flow(trg_flow, trg_prob_cf.shape[-2:])
+                trg_prob_propagated, trg_ent_propagated, trg_prob_propagated_aux, trg_ent_propagated_aux = \
+                    propagate_kf_predictions(trg_pred_kf, trg_pred_kf_aux, trg_flow_interp)
+                trg_propagated_positions = torch.sum(trg_prob_propagated.double(), 1, keepdim=True).float()
+                # force unconfident predictions in the current frame to be consistent with confident predictions propagated from the previous frames
+                loss_itcr_weights = trg_propagated_positions * (trg_ent_propagated < trg_ent_cf).float()
+                loss_itcr = weighted_l1_loss(trg_prob_cf, trg_prob_propagated, loss_itcr_weights)
+                if cfg.TRAIN.MULTI_LEVEL:
+                    loss_itcr_aux_weights = trg_propagated_positions * (trg_ent_propagated_aux < trg_ent_cf_aux).float()
+                    loss_itcr_aux = weighted_l1_loss(trg_prob_cf_aux, trg_prob_propagated_aux, loss_itcr_aux_weights)
+                else:
+                    loss_itcr_aux = 0
+                loss = (cfg.TRAIN.lamda_u * loss_itcr + cfg.TRAIN.lamda_u * loss_itcr_aux)
 
-        ######### Usupervised domain adaptation
-        _, target_batch = target_loader_iter.__next__()
-        trg_img_cf, _, image_trg_kf, _, name = target_batch
-        file_name = name[0].split('/')[-1]
-        frame = int(file_name.replace('_leftImg8bit.png', '')[-6:])
-        frame1 = frame - 1
-        flow_int16_x10_name_trg = file_name.replace('leftImg8bit.png', str(frame1).zfill(6) + '_int16_x10')
-        flow_int16_x10_trg = np.load(os.path.join(cfg.TRAIN.flow_path, flow_int16_x10_name_trg + '.npy'))
-        trg_flow = torch.from_numpy(flow_int16_x10_trg / 10.0).permute(2, 0, 1).unsqueeze(0)
-        trg_pred_aux, trg_pred, trg_pred_cf_aux, trg_pred_cf, trg_pred_kf_aux, trg_pred_kf = model(trg_img_cf.cuda(device), image_trg_kf.cuda(device), trg_flow, device)
+            with profiler.region('adversarial'), autocast(device, cfg.TRAIN.AMP):
+                ###### Cross-domain TCR
+                ### adversarial training ot fool the discriminator
+                # softmax inputs of the spatial-temporal (sta) and spatial (sa) alignment discriminators,
+                # computed once and reused by the discriminator updates
+                if cfg.TRAIN.MULTI_LEVEL:
+                    trg_d_input = discriminator_inputs([trg_pred_cf, trg_pred_cf_aux], [trg_pred_kf, trg_pred_kf_aux], interp_target)
+                else:
+                    trg_d_input = discriminator_inputs([trg_pred_cf], [trg_pred_kf], interp_target)
+                loss_sta, loss_sa, loss_sta_aux, loss_sa_aux = \
+                    unpack_losses(discriminator_losses(d_bank, trg_d_input, source_label))
+                loss = loss + (cfg.TRAIN.lamda_u * loss_sta
+                        + cfg.TRAIN.lamda_u * adversarial_factor_aux * loss_sta_aux)
+                loss = loss + (cfg.TRAIN.lamda_u * cfg.TRAIN.lamda_sa * loss_sa
+                        + cfg.TRAIN.lamda_u * cfg.TRAIN.lamda_sa * adversarial_factor_aux * loss_sa_aux)
+            with profiler.region('target_backward'):
+                scaler.scale(loss / accum_steps).backward()
+            ### Train discriminator networks (Enable training mode on discriminator networks)
+            for param in d_bank.parameters():
+                param.requires_grad = True
+            ## Train with source
+            set_grad_sync(ddp_d_bank, False)
+            with profiler.region('discriminator'), autocast(device, cfg.TRAIN.AMP):
+                with torch.no_grad():
+                    if cfg.TRAIN.MULTI_LEVEL:
+                        src_d_input = discriminator_inputs([src_pred_cf, src_pred_cf_aux], [src_pred_kf, src_pred_kf_aux], interp_source)
+                    else:
+                        src_d_input = discriminator_inputs([src_pred_cf], [src_pred_kf], interp_source)
+                loss_d = discriminator_losses(ddp_d_bank, src_d_input, source_label) / 2
+            with profiler.region('discriminator'):
+                scaler.scale(loss_d.sum() / accum_steps).backward()
+            ## Train with target
+            set_grad_sync(ddp_d_bank, last_micro)
+            with profiler.region('discriminator'), autocast(device, cfg.TRAIN.AMP):
+                loss_d = discriminator_losses(ddp_d_bank, trg_d_input.detach(), target_label) / 2
+            with profiler.region('discriminator'):
+                scaler.scale(loss_d.sum() / accum_steps).backward()
+            loss_d_sta, loss_d_sa, loss_d_sta_aux, loss_d_sa_aux = unpack_losses(loss_d)
 
-        ###### Intra-domain TCR
-        adversarial_factor_aux = cfg.TRAIN.LAMBDA_ADV_AUX / cfg.TRAIN.LAMBDA_ADV_MAIN  # as in Advent
-        # for current frame (cf)
-        trg_prob_cf = F.softmax(trg_pred_cf)
-        trg_prob_cf_aux = F.softmax(trg_pred_cf_aux)
-        trg_ent_cf = torch.mean(prob_2_entropy(trg_prob_cf), dim=1).detach().cpu()
-        trg_ent_cf_aux = torch.mean(prob_2_entropy(trg_prob_cf_aux), dim=1).detach().cpu()
-        # for key frame (kf)
-        trg_prob_kf = F.softmax(trg_pred_kf).cpu().numpy()
-        trg_prob_aux_kf = F.softmax(trg_pred_kf_aux).cpu().numpy()
-        trg_ent_kf = torch.mean(prob_2_entropy(F.softmax(trg_pred_kf)), dim=1).cpu().numpy()
-        trg_ent_kf_aux = torch.mean(prob_2_entropy(F.softmax(trg_pred_kf_aux)), dim=1).cpu().numpy()
-        # generate propogated prediction via optical flow
-        interp_flow2trg = nn.Upsample(size=(trg_prob_cf.shape[-2], trg_prob_cf.shape[-1]), mode='bilinear', align_corners=True)
-        interp_flow2trg_ratio = trg_prob_cf.shape[-2] / trg_flow.shape[-2]
-        trg_flow_interp = interp_flow2trg(trg_flow) * interp_flow2trg_ratio
-        trg_flow_interp = trg_flow_interp.cpu().numpy()
-        trg_prob_propagated = np.zeros(trg_prob_cf.shape)
-        trg_prob_propagated_aux = np.zeros(trg_prob_cf_aux.shape)
-        trg_ent_propagated = np.zeros(trg_ent_cf.shape)
-        trg_ent_propagated_aux = np.zeros(trg_ent_cf_aux.shape)
-        for x in range(trg_prob_kf.shape[-1]):
-            for y in range(trg_prob_kf.shape[-2]):
-                x_flow = int(round(x - trg_flow_interp[:, 0, y, x][0]))
-                y_flow = int(round(y - trg_flow_interp[:, 1, y, x][0]))
-                if x_flow >= 0 and x_flow < trg_prob_kf.shape[-1] and y_flow >= 0 and y_flow < trg_prob_kf.shape[-2]:
-                    trg_prob_propagated[:, :, y_flow, x_flow] = trg_prob_kf[:, :, y, x]
-                    trg_prob_propagated_aux[:, :, y_flow, x_flow] = trg_prob_aux_kf[:, :, y, x]
-                    trg_ent_propagated[:,y_flow,x_flow] = trg_ent_kf[:,y,x]
-                    trg_ent_propagated_aux[:,y_flow,x_flow] = trg_ent_kf_aux[:,y,x]
-        trg_prob_propagated = torch.from_numpy(trg_prob_propagated)
-        trg_prob_propagated_aux = torch.from_numpy(trg_prob_propagated_aux)
-        trg_propagated_positions = torch.sum(trg_prob_propagated,1)
-        trg_ent_propagated = torch.from_numpy(trg_ent_propagated)
-        trg_ent_propagated_aux = torch.from_numpy(trg_ent_propagated_aux)
-        # force unconfident predictions in the current frame to be consistent with confident predictions propagated from the previous frames
-        loss_itcr_weights = trg_propagated_positions.float()*(trg_ent_propagated.float() < trg_ent_cf).float()
-        loss_itcr = weighted_l1_loss(trg_prob_cf, trg_prob_propagated.float().cuda(device), loss_itcr_weights.float().cuda(device))
-        if cfg.TRAIN.MULTI_LEVEL:
-            loss_itcr_aux_weights = trg_propagated_positions.float() * (trg_ent_propagated_aux.float() < trg_ent_cf_aux).float()
-            loss_itcr_aux = weighted_l1_loss(trg_prob_cf_aux, trg_prob_propagated_aux.float().cuda(device), loss_itcr_aux_weights.float().cuda(device))
-        else:
-            loss_itcr_aux = 0
-        loss = (cfg.TRAIN.lamda_u * loss_itcr + cfg.TRAIN.lamda_u * loss_itcr_aux)
+            accumulate_losses(current_losses, {'loss_src_aux': loss_seg_src_aux,
+                                               'loss_src': loss_seg_src_main,
+                                               'loss_itcr_aux': loss_itcr_aux,
+                                               'loss_itcr': loss_itcr,
+                                               'loss_sta_aux': loss_sta_aux,
+                                               'loss_sa_aux': loss_sa_aux,
+                                               'loss_sta': loss_sta,
+                                               'loss_sa': loss_sa,
+                                               'loss_d_sta_aux': loss_d_sta_aux,
+                                               'loss_d_sa_aux': loss_d_sa_aux,
+                                               'loss_d_sta': loss_d_sta,
+                                               'loss_d_sa': loss_d_sa}, accum_steps)
 
-        ###### Cross-domain TCR
-        ### adversarial training ot fool the discriminator
-        # spatial-temporal alignment (sta)
-        src_sta_pred = torch.cat((src_pred_cf, src_pred_kf), dim=1)
-        trg_sta_pred = torch.cat((trg_pred_cf, trg_pred_kf), dim=1)
-        src_sta_pred = interp_source(src_sta_pred)
-        trg_sta_pred = interp_target(trg_sta_pred)
-        d_out_sta = d_sta_main(F.softmax(trg_sta_pred))
-        loss_sta = bce_loss(d_out_sta, source_label)
-        if cfg.TRAIN.MULTI_LEVEL:
-            src_sta_pred_aux = torch.cat((src_pred_cf_aux, src_pred_kf_aux), dim=1)
-            trg_sta_pred_aux = torch.cat((trg_pred_cf_aux, trg_pred_kf_aux), dim=1)
-            src_sta_pred_aux = interp_source(src_sta_pred_aux)
-            trg_sta_pred_aux = interp_target(trg_sta_pred_aux)
-            d_out_sta_aux = d_sta_aux(F.softmax(trg_sta_pred_aux))
-            loss_sta_aux = bce_loss(d_out_sta_aux, source_label)
-        else:
-            loss_sta_aux = 0
-        loss = loss + (cfg.TRAIN.lamda_u * loss_sta
-                + cfg.TRAIN.lamda_u * adversarial_factor_aux * loss_sta_aux)
-        # spatial alignment (sa)
-        src_sa_pred = torch.cat((src_pred_cf, src_pred_cf), dim=1)
-        trg_sa_pred = torch.cat((trg_pred_cf, trg_pred_cf), dim=1)
-        src_sa_pred = interp_source(src_sa_pred)
-        trg_sa_pred = interp_target(trg_sa_pred)
-        d_out_sa = d_sa_main(F.softmax(trg_sa_pred))
-        loss_sa = bce_loss(d_out_sa, source_label)
-        if cfg.TRAIN.MULTI_LEVEL:
-            src_sa_pred_aux = torch.cat((src_pred_cf_aux, src_pred_cf_aux), dim=1)
-            trg_sa_pred_aux = torch.cat((trg_pred_cf_aux, trg_pred_cf_aux), dim=1)
-            src_sa_pred_aux = interp_source(src_sa_pred_aux)
-            trg_sa_pred_aux = interp_target(trg_sa_pred_aux)
-            d_out_sa_aux = d_sa_aux(F.softmax(trg_sa_pred_aux))
-            loss_sa_aux = bce_loss(d_out_sa_aux, source_label)
-        else:
-            loss_sa_aux = 0
-        loss = loss + (cfg.TRAIN.lamda_u * cfg.TRAIN.lamda_sa * loss_sa
-                + cfg.TRAIN.lamda_u * cfg.TRAIN.lamda_sa * adversarial_factor_aux * loss_sa_aux)
-        loss.backward()
-        ### Train discriminator networks (Enable training mode on discriminator networks)
-        for param in d_sta_aux.parameters():
-            param.requires_grad = True
-        for param in d_sta_main.parameters():
-            param.requires_grad = True
-        for param in d_sa_aux.parameters():
-            param.requires_grad = True
-        for param in d_sa_main.parameters():
-            param.requires_grad = True
-        ## Train with source
-        # spatial-temporal alignment (sta)
-        src_sta_pred = src_sta_pred.detach()
-        d_out_sta = d_sta_main(F.softmax(src_sta_pred))
-        loss_d_sta = bce_loss(d_out_sta, source_label) / 2
-        loss_d_sta.backward()
-        if cfg.TRAIN.MULTI_LEVEL:
-            src_sta_pred_aux = src_sta_pred_aux.detach()
-            d_out_sta_aux = d_sta_aux(F.softmax(src_sta_pred_aux))
-            loss_d_sta_aux = bce_loss(d_out_sta_aux, source_label) / 2
-            loss_d_sta_aux.backward()
-        # spatial alignment (sa)
-        src_sa_pred = src_sa_pred.detach()
-        d_out_sa = d_sa_main(F.softmax(src_sa_pred))
-        loss_d_sa = bce_loss(d_out_sa, source_label) / 2
-        loss_d_sa.backward()
-        if cfg.TRAIN.MULTI_LEVEL:
-            src_sa_pred_aux = src_sa_pred_aux.detach()
-            d_out_sa_aux = d_sa_aux(F.softmax(src_sa_pred_aux))
-            loss_d_sa_aux = bce_loss(d_out_sa_aux, source_label) / 2
-            loss_d_sa_aux.backward()
-        ## Train with target
-        # spatial-temporal alignment (sta)
-        trg_sta_pred = trg_sta_pred.detach()
-        d_out_sta = d_sta_main(F.softmax(trg_sta_pred))
-        loss_d_sta = bce_loss(d_out_sta, target_label) / 2
-        loss_d_sta.backward()
-        if cfg.TRAIN.MULTI_LEVEL:
-            trg_sta_pred_aux = trg_sta_pred_aux.detach()
-            d_out_sta_aux = d_sta_aux(F.softmax(trg_sta_pred_aux))
-            loss_d_sta_aux = bce_loss(d_out_sta_aux, target_label) / 2
-            loss_d_sta_aux.backward()
-        else:
-            loss_d_sta_aux = 0
-        # spatial alignment (sa)
-        trg_sa_pred = trg_sa_pred.detach()
-        d_out_sa = d_sa_main(F.softmax(trg_sa_pred))
-        loss_d_sa = bce_loss(d_out_sa, target_label) / 2
-        loss_d_sa.backward()
-        if cfg.TRAIN.MULTI_LEVEL:
-            trg_sa_pred_aux = trg_sa_pred_aux.detach()
-            d_out_sa_aux = d_sa_aux(F.softmax(trg_sa_pred_aux))
-            loss_d_sa_aux = bce_loss(d_out_sa_aux, target_label) / 2
-            loss_d_sa_aux.backward()
-        else:
-            loss_d_sa_aux = 0
+        with profiler.region('optimizer'):
+            # Discriminators' weights discrepancy (wd)
+            loss_wd, loss_wd_aux = unpack_losses(d_bank.weight_discrepancy(), 2)
+            loss = (cfg.TRAIN.lamda_u * cfg.TRAIN.lamda_wd * loss_wd + cfg.TRAIN.lamda_u * cfg.TRAIN.lamda_wd * loss_wd_aux)
+            scaler.scale(loss).backward()
 
-        # Discriminators' weights discrepancy (wd)
-        k = 0
-        loss_wd = 0
-        for (W1, W2) in zip(d_sta_main.parameters(), d_sa_main.parameters()):
-            W1 = W1.view(-1)
-            W2 = W2.view(-1)
-            loss_wd = loss_wd + (torch.matmul(W1, W2) / (torch.norm(W1) * torch.norm(W2)) + 1)
-            k += 1
-        loss_wd = loss_wd / k
-        if cfg.TRAIN.MULTI_LEVEL:
-            k = 0
-            loss_wd_aux = 0
-            for (W1_aux, W2_aux) in zip(d_sta_aux.parameters(), d_sa_aux.parameters()):
-                W1_aux = W1_aux.view(-1)
-                W2_aux = W2_aux.view(-1)
-                loss_wd_aux = loss_wd_aux + (torch.matmul(W1_aux, W2_aux) / (torch.norm(W1_aux) * torch.norm(W2_aux)) + 1)
-                k += 1
-            loss_wd_aux = loss_wd_aux / k
-        else:
-            loss_wd_aux = 0
-        loss = (cfg.TRAIN.lamda_u * cfg.TRAIN.lamda_wd * loss_wd + cfg.TRAIN.lamda_u * cfg.TRAIN.lamda_wd * loss_wd_aux)
-        loss.backward()
-        
-        torch.nn.utils.clip_grad_norm_(model.parameters(), 1)
-        torch.nn.utils.clip_grad_norm_(d_sta_aux.parameters(), 1)
-        torch.nn.utils.clip_grad_norm_(d_sta_main.parameters(), 1)
-        torch.nn.utils.clip_grad_norm_(d_sa_aux.parameters(), 1)
-        torch.nn.utils.clip_grad_norm_(d_sa_main.parameters(), 1)
-        optimizer.step()
-        if cfg.TRAIN.MULTI_LEVEL:
-            optimizer_d_sta_aux.step()
-            optimizer_d_sa_aux.step()
-        optimizer_d_sta_main.step()
-        optimizer_d_sa_main.step()
-        current_losses = {'loss_src_aux': loss_seg_src_aux,
-                          'loss_src': loss_seg_src_main,
-                          'loss_itcr_aux': loss_itcr_aux,
-                          'loss_itcr': loss_itcr,
-                          'loss_sta_aux': loss_sta_aux,
-                          'loss_sa_aux': loss_sa_aux,
-                          'loss_sta': loss_sta,
-                          'loss_sa': loss_sa,
-                          'loss_d_sta_aux': loss_d_sta_aux,
-                          'loss_d_sa_aux': loss_d_sa_aux,
-                          'loss_d_sta': loss_d_sta,
-                          'loss_d_sa': loss_d_sa,
-                          'loss_wd_aux': loss_wd_aux,
-                          'loss_wd': loss_wd}
-        print_losses(current_losses, i_iter)
+            scaler.unscale_(optimizer)
+            scaler.unscale_(optimizer_d)
+            torch.nn.utils.clip_grad_norm_(model.parameters(), 1)
+            d_bank.clip_grad_norm_(1)
+            scaler.step(optimizer)
+            scaler.step(optimizer_d)
+            scaler.update()
+        current_losses['loss_wd_aux'] = loss_wd_aux
+        current_losses['loss_wd'] = loss_wd
+        if loss_logger is not None:
+            with profiler.region('logging'):
+                loss_logger.log(current_losses, i_iter)
         if i_iter % cfg.TRAIN.SAVE_PRED_EVERY == 0 and i_iter != 0:
-            print('taking snapshot ...')
-            print('exp =', cfg.TRAIN.SNAPSHOT_DIR)
-            snapshot_dir = Path(cfg.TRAIN.SNAPSHOT_DIR)
-            torch.save(model.state_dict(), snapshot_dir / f'model_{i_iter}.pth')
+            if is_main_process():
+                loss_logger.flush(wait=True)
+                print('taking snapshot ...')
+                print('exp =', cfg.TRAIN.SNAPSHOT_DIR)
+                with profiler.region('snapshot'):
+                    snapshot_dir = Path(cfg.TRAIN.SNAPSHOT_DIR)
+                    model_state = model.state_dict()
+                    consumed = (i_iter + 1) * accum_steps
+                    train_state = {'iteration': i_iter,
+                                   'model': model_state,
+                                   'd_bank': d_bank.state_dict(),
+                                   'optimizer': optimizer.state_dict(),
+                                   'optimizer_d': optimizer_d.state_dict(),
+                                   'scaler': scaler.state_dict(),
+                                   'rng': get_rng_state(device),
+                                   'samples_source': consumed * source_loader.batch_size,
+                                   'samples_target': consumed * target_loader.batch_size}
+                    checkpoint_writer.save({snapshot_dir / f'model_{i_iter}.pth': model_state,
+                                            snapshot_dir / 'train_state.pth': train_state}, device)
             if i_iter >= cfg.TRAIN.EARLY_STOP - 1:
                 break
         sys.stdout.flush()
-        if viz_tensorboard:
-            log_losses_tensorboard(writer, current_losses, i_iter)
+        profiler.step(i_iter)
+    if loss_logger is not None:
+        loss_logger.close()
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+    profiler.close()
+
+def propagate_kf_predictions(pred_kf, pred_kf_aux, flow):
+    """Warp the key-frame probabilities and entropies (main and aux) to the
+    current frame with a single splat along `flow`.
+    """
+    maps = []
+    for pred in (pred_kf, pred_kf_aux):
+        if pred is not None:
+            prob = F.softmax(pred, dim=1)
+            maps += [prob, torch.mean(prob_2_entropy(prob), dim=1, keepdim=True)]
+    sizes = [m.shape[1] for m in maps]
+    (propagated,), _ = propagate_by_flow([torch.cat(maps, dim=1)], flow)
+    propagated = list(torch.split(propagated, sizes, dim=1))
+    return propagated + [None] * (4 - len(propagated))
+
+def discriminator_inputs(preds_cf, preds_kf, interp):
+    """Input of the discriminator bank for each output level: the softmax of the
+    upsampled cat(cf, kf) (sta) and cat(cf, cf) (sa) predictions.
+
+    Each prediction is upsampled and normalized once: the sa softmax is softmax(cf) / 2
+    twice and the sta softmax is rebuilt from the log-sum-exp of both halves, its cf
+    half as the sa one rescaled by a single-channel weight so that the backward graph
+    holds no more full-resolution maps than the per-input softmax did.
+    """
+    inputs = []
+    for pred_cf, pred_kf in zip(preds_cf, preds_kf):
+        pred_cf = interp(pred_cf)
+        pred_kf = interp(pred_kf)
+        lse_cf = torch.logsumexp(pred_cf, dim=1, keepdim=True)
+        lse_kf = torch.logsumexp(pred_kf, dim=1, keepdim=True)
+        prob_sa = torch.exp(pred_cf - (lse_cf + math.log(2)))
+        weight_cf = torch.sigmoid(lse_cf - lse_kf)
+        prob_sta_kf = torch.exp(pred_kf - torch.logaddexp(lse_cf, lse_kf))
+        inputs += [prob_sa * (2 * weight_cf), prob_sta_kf, prob_sa, prob_sa]
+    return torch.cat(inputs, dim=1)
+
+def discriminator_losses(d_bank, d_input, y_label):
+    # bce loss (as advent.utils.func.bce_loss) of each discriminator of the bank
+    d_out = d_bank(d_input)
+    y_truth_tensor = torch.full_like(d_out, y_label)
+    loss = F.binary_cross_entropy_with_logits(d_out, y_truth_tensor, reduction='none')
+    return loss.mean(dim=(0, 2, 3))
+
+def unpack_losses(losses, n=4):
+    # per-discriminator losses, 0 for the aux ones when not multi-level
+    return list(losses) + [0] * (n - len(losses))
 
 def weighted_l1_loss(input, target, weights):
     loss = weights * torch.abs(input - target)
     loss = torch.mean(loss)
     return loss
 
-def print_losses(current_losses, i_iter):
-    list_strings = []
-    for loss_name, loss_value in current_losses.items():
-        list_strings.append(f'{loss_name} = {to_numpy(loss_value):.3f} ')
-    full_string = ' '.join(list_strings)
-    tqdm.write(f'iter = {i_iter} {full_string}')
-
-def log_losses_tensorboard(writer, current_losses, i_iter):
-    for loss_name, loss_value in current_losses.items():
-        writer.add_scalar(f'data/{loss_name}', to_numpy(loss_value), i_iter)
-
-def to_numpy(tensor):
-    if isinstance(tensor, (int, float)):
-        return tensor
-    else:
-        return tensor.data.cpu().numpy()
+def accumulate_losses(current_losses, losses, accum_steps):
+    # running mean over the micro-batches of an iteration
+    for loss_name, loss_value in losses.items():
+        if torch.is_tensor(loss_value):
+            loss_value = loss_value.detach()
+        current_losses[loss_name] = current_losses.get(loss_name, 0) + loss_value / accum_steps
@@ -1,5 +1,9 @@
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from davsn.utils.flow import resize_flow, propagate_by_flow
+from davsn.utils.profiler import profile_region
 
 affine_par = True
 
@@ -44,6 +48,35 @@ class Bottleneck(nn.Module):
         out = self.relu(out)
         return out
 
+def _recompute_without_stats(segment, x):
+    # the running statistics of the BatchNorms were updated by the first pass; they are still
+    # passed to the recomputation, which must save the same tensors, and restored afterwards
+    buffers = [b for m in segment.modules() if isinstance(m, nn.BatchNorm2d) for b in m.buffers()]
+    saved = [b.clone() for b in buffers]
+    try:
+        return segment(x)
+    finally:
+        with torch.no_grad():
+            for b, value in zip(buffers, saved):
+                b.copy_(value)
+
+def checkpoint_segment(segment, x):
+    """Run `segment` on `x` without keeping its activations, recomputed in the backward.
+
+    The recomputation gives the same outputs and gradients: BatchNorms in
+    training mode normalize with the batch statistics of `x` again, but
+    update their running statistics only once.
+    """
+    passes = []
+
+    def run(x):
+        if passes:
+            return _recompute_without_stats(segment, x)
+        passes.append(True)
+        return segment(x)
+
+    return checkpoint(run, x, use_reentrant=False, preserve_rng_state=False)
+
 class ClassifierModule(nn.Module):
     def __init__(self, inplanes, dilation_series, padding_series, num_classes):
         super(ClassifierModule, self).__init__()
@@ -88,6 +121,27 @@ class ResNetMulti(nn.Module):
                 m.weight.data.fill_(1)
                 m.bias.data.zero_()
         self.sf_layer = self.get_score_fusion_layer(num_classes)
+        self.checkpointing = {}
+
+    def set_gradient_checkpointing(self, layers=(), blocks=0):
+        """Recompute the activations of `layers` ('layer1' to 'layer4') in the
+        backward instead of storing them, in segments of `blocks` Bottlenecks
+        (0 for whole layers). Only passes with gradients are affected, i.e.
+        the current frame in `forward`.
+        """
+        for name in layers:
+            if name not in ('layer1', 'layer2', 'layer3', 'layer4'):
+                raise NotImplementedError(f"Not yet supported gradient checkpointing of {name}")
+        self.checkpointing = {name: blocks for name in layers}
+
+    def run_layer(self, name, x):
+        layer = getattr(self, name)
+        if name not in self.checkpointing or not torch.is_grad_enabled():
+            return layer(x)
+        blocks = self.checkpointing[name] or len(layer)
+        for start in range(0, len(layer), blocks):
+            x = checkpoint_segment(layer[start:start + blocks], x)
+        return x
 
     def get_score_fusion_layer(self, num_classes):
         sf_layer = nn.Conv2d(num_classes * 2, num_classes, kernel_size=1, stride=1, padding=0, bias=False)
@@ -115,59 +169,43 @@ class ResNetMulti(nn.Module):
             layers.append(block(self.inplanes, planes, dilation=dilation))
         return nn.Sequential(*layers)
 
-    def forward(self, cf, kf, flow, device):
-        cf = self.conv1(cf)
-        cf = self.bn1(cf)
-        cf = self.relu(cf)
-        cf = self.maxpool(cf)
-        cf = self.layer1(cf)
-        cf = self.layer2(cf)
-        cf = self.layer3(cf)
+    def extract(self, x):
+        x = self.conv1(x)
+        x = self.bn1(x)
+        x = self.relu(x)
+        x = self.maxpool(x)
+        x = self.run_layer('layer1', x)
+        x = self.run_layer('layer2', x)
+        x = self.run_layer('layer3', x)
         if self.multi_level:
-            cf_aux = self.layer5(cf)
+            x_aux = self.layer5(x)
         else:
-            cf_aux = None
-        cf = self.layer4(cf)
-        cf = self.layer6(cf)
+            x_aux = None
+        x = self.run_layer('layer4', x)
+        x = self.layer6(x)
+        return x_aux, x
+
+    def fuse(self, cf_aux, cf, kf_aux, kf, flow):
+        assert flow.shape[0] == cf.shape[0], 'Expected one flow per frame of the batch'
+        with profile_region('warp'):
+            flow_cf = resize_flow(flow.to(cf.device), cf.shape[-2:])
+            (kf_aux_rec, kf_rec), rec_positions = propagate_by_flow([kf_aux, kf], flow_cf)
+        if self.multi_level:
+            pred_aux = self.sf_layer(torch.cat((cf_aux, rec_positions * kf_aux_rec), dim=1))
+        else:
+            pred_aux = None
+        pred = self.sf_layer(torch.cat((cf, rec_positions * kf_rec), dim=1))
+        return pred_aux, pred
+
+    def forward(self, cf, kf, flow, device, fused=True):
+        # fused=False skips the score fusion (pred_aux and pred are None) when only the per-frame logits are needed
+        cf_aux, cf = self.extract(cf)
         with torch.no_grad():
-            kf = self.conv1(kf)
-            kf = self.bn1(kf)
-            kf = self.relu(kf)
-            kf = self.maxpool(kf)
-            kf = self.layer1(kf)
-            kf = self.layer2(kf)
-            kf = self.layer3(kf)
-            if self.multi_level:
-                kf_aux = self.layer5(kf)
-            else:
-                kf_aux = None
-            kf = self.layer4(kf)
-            kf = self.layer6(kf)
-        kf_aux_cpu = kf_aux.cpu().numpy()
-        kf_cpu = kf.cpu().numpy()
-        interp_flow2cf = nn.Upsample(size=(cf.shape[-2], cf.shape[-1]), mode='bilinear', align_corners=True)
-        interp_flow2cf_ratio = cf.shape[-2] / flow.shape[-2]
-        flow_cf = interp_flow2cf(flow) * interp_flow2cf_ratio
-        flow_cf = flow_cf.cpu().numpy()
-        import numpy as np
-        kf_aux_rec = np.zeros(cf_aux.shape)
-        kf_rec = np.zeros(cf.shape)
-        rec_positions = np.zeros(cf.shape)
-        for x in range(cf.shape[-1]):
-            for y in range(cf.shape[-2]):
-                x_flow = int(round(x - flow_cf[:, 0, y, x][0]))
-                y_flow = int(round(y - flow_cf[:, 1, y, x][0]))
-                if x_flow >= 0 and x_flow < flow_cf.shape[-1] and y_flow >= 0 and y_flow < flow_cf.shape[-2]:
-                    kf_aux_rec[:, :, y_flow, x_flow] = kf_aux_cpu[:, :, y, x]
-                    kf_rec[:, :, y_flow, x_flow] = kf_cpu[:, :, y, x]
-                    rec_positions[:, :, y_flow, x_flow] = 1
-        kf_aux_rec = torch.from_numpy(kf_aux_rec)
-        kf_rec = torch.from_numpy(kf_rec)
-        rec_positions = torch.from_numpy(rec_positions)
-
-
-        pred_aux = self.sf_layer(torch.cat((cf_aux, (rec_positions*kf_aux_rec).float().cuda(device)), dim=1))
-        pred = self.sf_layer(torch.cat((cf, (rec_positions*kf_rec).float().cuda(device)), dim=1))
+            kf_aux, kf = self.extract(kf)
+        if fused:
+            pred_aux, pred = self.fuse(cf_aux, cf, kf_aux, kf, flow)
+        else:
+            pred_aux, pred = None, None
         return pred_aux, pred, cf_aux, cf, kf_aux, kf
 
     def get_1x_lr_params_no_scale(self):
@@ -0,0 +1,86 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class DiscriminatorBank(nn.Module):
+    """Several fully-convolutional discriminators evaluated as one network.
+
+    Built from `advent.model.discriminator.get_fc_discriminator` networks of
+    identical architecture, whose weights are stacked along the output channels
+    so that each layer runs as a single grouped convolution. The input is the
+    concatenation of the inputs of every discriminator along the channels and
+    the output holds one channel per discriminator.
+    Discriminators are paired in order, (0, 1), (2, 3), ... for the weight
+    discrepancy.
+    """
+
+    def __init__(self, discriminators):
+        super(DiscriminatorBank, self).__init__()
+        self.num_discriminators = len(discriminators)
+        layers = list(zip(*discriminators))
+        self.convs = nn.ModuleList()
+        self.negative_slopes = []
+        for layer in layers:
+            if isinstance(layer[0], nn.Conv2d):
+                conv = nn.Conv2d(layer[0].in_channels * self.num_discriminators,
+                                 layer[0].out_channels * self.num_discriminators,
+                                 kernel_size=layer[0].kernel_size, stride=layer[0].stride,
+                                 padding=layer[0].padding, groups=self.num_discriminators)
+                conv.weight.data.copy_(torch.cat([l.weight.data for l in layer]))
+                conv.bias.data.copy_(torch.cat([l.bias.data for l in layer]))
+                self.convs.append(conv.to(layer[0].weight.device))
+            elif isinstance(layer[0], nn.LeakyReLU):
+                self.negative_slopes.append(layer[0].negative_slope)
+            else:
+                raise NotImplementedError(f"Not yet supported discriminator layer {layer[0]}")
+        assert len(self.negative_slopes) == len(self.convs) - 1
+
+    def forward(self, x):
+        for conv, negative_slope in zip(self.convs, self.negative_slopes):
+            x = F.leaky_relu(conv(x), negative_slope, inplace=True)
+        return self.convs[-1](x)
+
+    def stacked_parameters(self):
+        """Parameters viewed as (num_discriminators, -1), in the order of the
+        parameters of a single discriminator."""
+        for conv in self.convs:
+            yield conv.weight.reshape(self.num_discriminators, -1)
+            yield conv.bias.reshape(self.num_discriminators, -1)
+
+    def weight_discrepancy(self):
+        """Mean over the parameters of cos(W_a, W_b) + 1 for each pair of discriminators."""
+        loss = 0
+        k = 0
+        for w in self.stacked_parameters():
+            w1, w2 = w[0::2], w[1::2]
+            loss = loss + (torch.sum(w1 * w2, dim=1) / (torch.norm(w1, dim=1) * torch.norm(w2, dim=1)) + 1)
+            k += 1
+        return loss / k
+
+    def clip_grad_norm_(self, max_norm):
+        """`torch.nn.utils.clip_grad_norm_` applied to each discriminator separately."""
+        grads = [p.grad for p in self.parameters() if p.grad is not None]
+        if len(grads) == 0:
+            return None
+        norms = torch.stack([g.reshape(self.num_discriminators, -1).norm(dim=1) for g in grads])
+        total_norm = norms.norm(dim=0)
+        clip_coef = torch.clamp(max_norm / (total_norm + 1e-6), max=1.0)
+        for g in grads:
+            coef = clip_coef.repeat_interleave(g.shape[0] // self.num_discriminators)
+            g.mul_(coef.view(-1, *([1] * (g.dim() - 1))))
+        return total_norm
+
+    def discriminator(self, index):
+        """Export discriminator `index` as a standalone `nn.Sequential`."""
+        layers = []
+        for i, conv in enumerate(self.convs):
+            out_channels = conv.out_channels // self.num_discriminators
+            single = nn.Conv2d(conv.in_channels // self.num_discriminators, out_channels,
+                               kernel_size=conv.kernel_size, stride=conv.stride, padding=conv.padding)
+            single.weight.data.copy_(conv.weight.data[index * out_channels:(index + 1) * out_channels])
+            single.bias.data.copy_(conv.bias.data[index * out_channels:(index + 1) * out_channels])
+            layers.append(single.to(conv.weight.device))
+            if i < len(self.negative_slopes):
+                layers.append(nn.LeakyReLU(negative_slope=self.negative_slopes[i], inplace=True))
+        return nn.Sequential(*layers)
@@ -0,0 +1,141 @@
+import copy
+import time
+
+import torch
+import torch.nn as nn
+
+from davsn.model.accel_deeplabv2 import Bottleneck, ClassifierModule
+
+
+def fold_bn(conv, bn):
+    """Return a conv equivalent to `bn(conv(x))` for a frozen BatchNorm."""
+    std = torch.sqrt(bn.running_var + bn.eps)
+    scale = bn.weight / std if bn.affine else 1.0 / std
+    shift = bn.bias - bn.running_mean * scale if bn.affine else -bn.running_mean * scale
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, kernel_size=conv.kernel_size,
+                      stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                      groups=conv.groups, bias=True)
+    fused.weight.data.copy_(conv.weight.data * scale.view(-1, 1, 1, 1))
+    bias = conv.bias.data if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    fused.bias.data.copy_(bias * scale + shift)
+    return fused.to(conv.weight.device)
+
+
+class FusedClassifierModule(nn.Module):
+    """ASPP classifier with the branch biases summed into a single one and an
+    optional 1x1 projection (the current-frame part of `sf_layer`) folded into
+    every branch.
+    """
+
+    def __init__(self, classifier, projection=None):
+        super(FusedClassifierModule, self).__init__()
+        self.conv2d_list = nn.ModuleList()
+        bias = 0
+        for i, conv in enumerate(classifier.conv2d_list):
+            weight = conv.weight.data
+            if projection is not None:
+                weight = torch.einsum('oc,cikl->oikl', projection, weight)
+            fused = nn.Conv2d(conv.in_channels, weight.shape[0], kernel_size=conv.kernel_size,
+                              stride=conv.stride, padding=conv.padding, dilation=conv.dilation,
+                              bias=i == 0)
+            fused.weight.data.copy_(weight)
+            self.conv2d_list.append(fused.to(weight.device))
+            bias = bias + conv.bias.data
+        if projection is not None:
+            bias = projection @ bias
+        self.conv2d_list[0].bias.data.copy_(bias)
+
+    def forward(self, x):
+        out = self.conv2d_list[0](x)
+        for conv in self.conv2d_list[1:]:
+            out += conv(x)
+        return out
+
+
+class FoldedScoreFusion(nn.Module):
+    """`sf_layer` once its current-frame half W_cf is folded into the heads.
+
+    The heads then emit u = W_cf * logits for every frame, so the fused score
+    W_cf * cf + W_kf * warp(kf) becomes u_cf + (W_kf W_cf^-1) * warp(u_kf).
+    The input is still the concatenation built by `ResNetMulti.fuse`.
+    """
+
+    def __init__(self, sf_layer, num_classes):
+        super(FoldedScoreFusion, self).__init__()
+        weight = sf_layer.weight.data[:, :, 0, 0].double()
+        w_cf, w_kf = weight[:, :num_classes], weight[:, num_classes:]
+        self.num_classes = num_classes
+        self.kf_layer = nn.Conv2d(num_classes, num_classes, kernel_size=1, bias=False)
+        self.kf_layer.weight.data.copy_((w_kf @ torch.inverse(w_cf))[:, :, None, None])
+        self.kf_layer.to(sf_layer.weight.device)
+
+    def forward(self, x):
+        return x[:, :self.num_classes] + self.kf_layer(x[:, self.num_classes:])
+
+
+def _fold_bottleneck(block):
+    block.conv1, block.bn1 = fold_bn(block.conv1, block.bn1), nn.Identity()
+    block.conv2, block.bn2 = fold_bn(block.conv2, block.bn2), nn.Identity()
+    block.conv3, block.bn3 = fold_bn(block.conv3, block.bn3), nn.Identity()
+    if block.downsample is not None:
+        block.downsample = nn.Sequential(fold_bn(block.downsample[0], block.downsample[1]))
+
+
+def optimize_for_inference(model, fold_score_fusion=True, max_condition=1e4):
+    """Return an inference-only copy of a `ResNetMulti` with identical predictions.
+
+    All frozen BatchNorms are folded into their convolutions and the ASPP
+    classifiers apply a single bias. With `fold_score_fusion`, the current-frame
+    half of `sf_layer` is folded into `layer5`/`layer6` as well, provided it is
+    well conditioned; only `pred_aux`/`pred` of the returned model then match
+    the original, the intermediate logits being projected.
+    """
+    model = copy.deepcopy(model).eval()
+    with torch.no_grad():
+        model.conv1, model.bn1 = fold_bn(model.conv1, model.bn1), nn.Identity()
+        for m in model.modules():
+            if isinstance(m, Bottleneck):
+                _fold_bottleneck(m)
+        num_classes = model.sf_layer.out_channels
+        projection = None
+        if fold_score_fusion and isinstance(model.sf_layer, nn.Conv2d):
+            w_cf = model.sf_layer.weight.data[:, :num_classes, 0, 0]
+            singular_values = torch.svd(w_cf.double())[1]
+            if singular_values.max() / singular_values.min() < max_condition:
+                projection = w_cf
+        for name in ('layer5', 'layer6'):
+            if isinstance(getattr(model, name, None), ClassifierModule):
+                setattr(model, name, FusedClassifierModule(getattr(model, name), projection))
+        if projection is not None:
+            model.sf_layer = FoldedScoreFusion(model.sf_layer, num_classes)
+    for param in model.parameters():
+        param.requires_grad = False
+    return model
+
+
+def compare_for_inference(model, optimized, cf, kf, flow, repeats=5, atol=1e-3):
+    """Check an optimized model against the original on the same inputs.
+
+    Returns the max absolute difference of `pred_aux`/`pred`, whether it is
+    within `atol` ('passed') and the mean latency of both models in
+    milliseconds.
+    """
+    model.eval()
+    results = {}
+    with torch.no_grad():
+        outputs = {}
+        for key, m in (('original', model), ('optimized', optimized)):
+            m(cf, kf, flow, cf.device)  # warm up
+            if cf.device.type == 'cuda':
+                torch.cuda.synchronize(cf.device)
+            start = time.time()
+            for _ in range(repeats):
+                outputs[key] = m(cf, kf, flow, cf.device)[:2]
+            if cf.device.type == 'cuda':
+                torch.cuda.synchronize(cf.device)
+            results[f'latency_ms_{key}'] = 1000 * (time.time() - start) / repeats
+    diffs = [(a - b).abs().max().item()
+             for a, b in zip(outputs['original'], outputs['optimized']) if a is not None]
+    results['max_abs_diff'] = max(diffs)
+    results['passed'] = results['max_abs_diff'] <= atol
+    return results
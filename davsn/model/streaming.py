@@ -0,0 +1,84 @@
+import re
+
+import torch
+
+from davsn.utils.amp import autocast
+
+_FRAME_PATTERN = re.compile(r'^(.*?)(\d+)(_leftImg8bit)?\.\w+$')
+
+
+def parse_frame_id(name):
+    """Split a dataset image name into (sequence, frame index).
+
+    Works for the CityscapesSeq ('aachen/aachen_000000_000019_leftImg8bit.png'),
+    Viper ('001/001_00010.jpg') and SynthiaSeq ('000001.png') naming schemes.
+    """
+    match = _FRAME_PATTERN.match(name)
+    if match is None:
+        raise ValueError(f'Cannot parse frame index from {name}')
+    return match.group(1), int(match.group(2))
+
+
+class StreamingAccel:
+    """Stateful video inference around `ResNetMulti`.
+
+    Frames of a stream are fed in order. The backbone logits of each frame are
+    cached and reused as the key-frame logits of the next frame, so contiguous
+    frames only run the backbone once. The cache is invalidated when the next
+    frame is not the direct successor of the cached one (new sequence, skipped
+    frame) or when the input size changes. `KeyFrameSegmenter` shares this
+    cache, storing propagated logits for the frames it does not run the
+    backbone on.
+    """
+
+    def __init__(self, model, device=None, amp=''):
+        self.model = model
+        self.device = device
+        self.amp = amp
+        self.reset()
+
+    def reset(self):
+        self._frame_id = None
+        self._shape = None
+        self._logits = None
+
+    def is_cached(self, frame_id, shape):
+        if self._frame_id is None or self._shape != shape:
+            return False
+        sequence, frame = frame_id
+        return self._frame_id == (sequence, frame - 1)
+
+    def cached_logits(self, frame_id, shape):
+        """(aux, main) logits of the frame preceding `frame_id`, None when not cached."""
+        return self._logits if self.is_cached(frame_id, shape) else None
+
+    def update(self, frame_id, shape, logits):
+        self._frame_id, self._shape, self._logits = frame_id, tuple(shape), logits
+
+    def extract(self, image):
+        with autocast(self.device, self.amp):
+            x_aux, x = self.model.extract(image)
+        return (None if x_aux is None else x_aux.float()), x.float()
+
+    @torch.no_grad()
+    def step(self, cf, kf, flow, frame_id):
+        """Segment the current frame `cf`, frame `frame_id` (sequence, index) of the stream.
+
+        `kf` is only run through the backbone when the previous frame is not
+        cached; it may be None when the caller knows the cache is valid.
+        Returns the same outputs as `ResNetMulti.forward`.
+        """
+        shape = tuple(cf.shape)
+        if self.is_cached(frame_id, shape):
+            kf_aux, kf = self._logits
+        else:
+            assert kf is not None, f'Key frame required at sequence boundary {frame_id}'
+            kf_aux, kf = self.extract(kf)
+        cf_aux, cf = self.extract(cf)
+        self.update(frame_id, shape, (cf_aux, cf))
+        pred_aux, pred = self.model.fuse(cf_aux, cf, kf_aux, kf, flow)
+        return pred_aux, pred, cf_aux, cf, kf_aux, kf
+
+    def __call__(self, cf, kf, flow, name):
+        """`step` on the frame of the image named `name`."""
+        return self.step(cf, kf, flow, parse_frame_id(name))
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils import data
+from torch.utils.data.distributed import DistributedSampler
+
+from davsn.model.accel_deeplabv2 import get_accel_deeplab_v2
+from davsn.domain_adaptation.config import cfg, cfg_from_file
+from davsn.domain_adaptation.train_video_UDA import train_DAVSN
+from davsn.utils.distributed import init_distributed, cleanup_distributed
+
+
+class RandomVideoDataSet(data.Dataset):
+    """In-memory random (frame, label, key frame, shape, name, flow) samples."""
+
+    def __init__(self, length, size, num_classes):
+        self.length = length
+        self.size = size
+        self.num_classes = num_classes
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        rng = np.random.RandomState(index)
+        w, h = self.size
+        image = rng.randn(3, h, w).astype(np.float32)
+        image_kf = rng.randn(3, h, w).astype(np.float32)
+        label = rng.randint(0, self.num_classes, (h, w)).astype(np.float32)
+        flow = (rng.randn(2, h, w) * 20).astype(np.int16)
+        return image, label, image_kf, np.array(image.shape), f'{index:06d}.png', flow
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Scaling of multi-process train_DAVSN on synthetic data")
+    parser.add_argument('--cfg', type=str, default=None,
+                        help='optional config file', )
+    parser.add_argument('--num-processes', type=int, nargs='+', default=[1, 2, 4],
+                        help='process counts to benchmark')
+    parser.add_argument('--iters', type=int, default=10,
+                        help='timed iterations per process count')
+    parser.add_argument('--size', type=int, nargs=2, default=[256, 128],
+                        help='input width and height of both domains')
+    parser.add_argument('--cpu', action='store_true',
+                        help='run on the CPU with the gloo backend')
+    parser.add_argument('--output', type=str, default=None,
+                        help='optional JSON file for the results')
+    return parser.parse_args()
+
+
+def run_worker(rank, world_size, args, port, results):
+    if args.cfg is not None:
+        cfg_from_file(args.cfg)
+    if args.cpu:
+        cfg.DEVICE = 'cpu'
+        cfg.DIST_BACKEND = 'gloo'
+        # share the cores between the processes
+        cfg.NUM_THREADS = max(1, (os.cpu_count() or 1) // world_size)
+    elif torch.cuda.is_available():
+        cfg.GPU_ID = rank
+    cfg.DIST_URL = f'tcp://127.0.0.1:{port}'
+    cfg.TRAIN.INPUT_SIZE_SOURCE = tuple(args.size)
+    cfg.TRAIN.INPUT_SIZE_TARGET = tuple(args.size)
+    cfg.TRAIN.TENSORBOARD_LOGDIR = ''
+    init_distributed(cfg, rank, world_size)
+    torch.manual_seed(cfg.TRAIN.RANDOM_SEED)
+    model = get_accel_deeplab_v2(num_classes=cfg.NUM_CLASSES, multi_level=cfg.TRAIN.MULTI_LEVEL)
+    timings = {}
+    # first pass to warm up, second one timed
+    for key, iters in (('warmup', 1), ('timed', args.iters)):
+        cfg.TRAIN.EARLY_STOP = iters - 1
+        cfg.TRAIN.SAVE_PRED_EVERY = iters + 1
+        loaders = []
+        for batch_size in (cfg.TRAIN.BATCH_SIZE_SOURCE, cfg.TRAIN.BATCH_SIZE_TARGET):
+            dataset = RandomVideoDataSet(iters * batch_size * cfg.TRAIN.ACCUM_STEPS * world_size,
+                                         args.size, cfg.NUM_CLASSES)
+            sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank) if world_size > 1 else None
+            loaders.append(data.DataLoader(dataset, batch_size=batch_size, sampler=sampler))
+        if world_size > 1:
+            dist.barrier()
+        start = time.time()
+        train_DAVSN(model, loaders[0], loaders[1], cfg)
+        if world_size > 1:
+            dist.barrier()
+        timings[key] = time.time() - start
+    if rank == 0:
+        samples = args.iters * cfg.TRAIN.BATCH_SIZE_SOURCE * cfg.TRAIN.ACCUM_STEPS * world_size
+        results[world_size] = {'seconds_per_iter': timings['timed'] / args.iters,
+                               'samples_per_second': samples / timings['timed']}
+    cleanup_distributed()
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    results = mp.Manager().dict()
+    for i, world_size in enumerate(args.num_processes):
+        port = 29500 + 10 * i + world_size
+        if world_size == 1:
+            run_worker(0, 1, args, port, results)
+        else:
+            mp.spawn(run_worker, args=(world_size, args, port, results), nprocs=world_size)
+    base = results[min(results.keys())]
+    base_per_process = base['samples_per_second'] / min(results.keys())
+    report = {}
+    for world_size in sorted(results.keys()):
+        result = dict(results[world_size])
+        result['scaling_efficiency'] = result['samples_per_second'] / (world_size * base_per_process)
+        report[world_size] = result
+        print(f'{world_size} processes: {result["seconds_per_iter"]:.3f} s/iter, '
+              f'{result["samples_per_second"]:.2f} samples/s, efficiency {result["scaling_efficiency"]:.2f}')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import argparse
+
+from davsn.dataset.Viper import ViperDataSet
+from davsn.dataset.SynthiaSeq import SynthiaSeqDataSet
+from davsn.dataset.CityscapesSeq import CityscapesSeqDataSet
+from davsn.dataset.image_cache import build_image_cache, build_label_cache
+from davsn.domain_adaptation.config import cfg, cfg_from_file
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Build a cache of resized frames or trainId labels for a dataset")
+    parser.add_argument('--cfg', type=str, default=None,
+                        help='optional config file', )
+    parser.add_argument('--domain', type=str, default='target', choices=['source', 'target', 'test'],
+                        help='dataset to cache: training source/target or test target')
+    parser.add_argument('--output', type=str, required=True,
+                        help='cache to write (.npy), then set as IMAGE_CACHE_* / LABEL_CACHE_* in the config')
+    parser.add_argument('--labels', action='store_true',
+                        help='cache trainId label maps instead of frames (source domain only)')
+    parser.add_argument('--num-workers', type=int, default=8,
+                        help='number of decoding processes')
+    return parser.parse_args()
+
+
+def get_dataset(domain):
+    if domain == 'source' and cfg.SOURCE == 'Viper':
+        return ViperDataSet(root=cfg.DATA_DIRECTORY_SOURCE,
+                            list_path=cfg.DATA_LIST_SOURCE,
+                            set=cfg.TRAIN.SET_SOURCE,
+                            crop_size=cfg.TRAIN.INPUT_SIZE_SOURCE,
+                            mean=cfg.TRAIN.IMG_MEAN)
+    elif domain == 'source' and cfg.SOURCE == 'SynthiaSeq':
+        return SynthiaSeqDataSet(root=cfg.DATA_DIRECTORY_SOURCE,
+                                 list_path=cfg.DATA_LIST_SOURCE,
+                                 set=cfg.TRAIN.SET_SOURCE,
+                                 crop_size=(1280, 760),
+                                 mean=cfg.TRAIN.IMG_MEAN)
+    elif domain == 'target':
+        return CityscapesSeqDataSet(root=cfg.DATA_DIRECTORY_TARGET,
+                                    list_path=cfg.DATA_LIST_TARGET,
+                                    set=cfg.TRAIN.SET_TARGET,
+                                    info_path=cfg.TRAIN.INFO_TARGET,
+                                    crop_size=cfg.TRAIN.INPUT_SIZE_TARGET,
+                                    mean=cfg.TRAIN.IMG_MEAN)
+    elif domain == 'test':
+        return CityscapesSeqDataSet(root=cfg.DATA_DIRECTORY_TARGET,
+                                    list_path=cfg.DATA_LIST_TARGET,
+                                    set=cfg.TEST.SET_TARGET,
+                                    info_path=cfg.TEST.INFO_TARGET,
+                                    crop_size=cfg.TEST.INPUT_SIZE_TARGET,
+                                    mean=cfg.TEST.IMG_MEAN,
+                                    labels_size=cfg.TEST.OUTPUT_SIZE_TARGET)
+    raise NotImplementedError(f"Not yet supported {cfg.SOURCE}")
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    assert args.cfg is not None, 'Missing cfg file'
+    cfg_from_file(args.cfg)
+    dataset = get_dataset(args.domain)
+    if args.labels:
+        assert args.domain == 'source', 'Label cache is only supported for the source domain'
+        num_labels = build_label_cache(dataset, args.output, args.num_workers)
+        print(f'Cached {num_labels} label maps into {args.output}')
+    else:
+        num_frames = build_image_cache(dataset, args.output, args.num_workers)
+        print(f'Cached {num_frames} frames into {args.output}')
+
+
+if __name__ == '__main__':
+    main()
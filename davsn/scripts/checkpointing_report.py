@@ -0,0 +1,136 @@
+import argparse
+import copy
+import json
+import time
+import warnings
+
+import torch
+from torch import nn
+from advent.utils.func import loss_calc
+
+from davsn.domain_adaptation.config import cfg, cfg_from_file
+from davsn.model.accel_deeplabv2 import get_accel_deeplab_v2
+from davsn.utils.amp import autocast
+from davsn.utils.device import setup_device, model_to_device
+
+warnings.filterwarnings("ignore")
+
+DEFAULT_MODES = ['none', 'layer3', 'layer3:8', 'layer3:4', 'layer3:1', 'layer1,layer2,layer3,layer4:1']
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Gradients, peak memory and step time of gradient checkpointing")
+    parser.add_argument('--cfg', type=str, default=None,
+                        help='optional config file', )
+    parser.add_argument('--modes', type=str, nargs='+', default=DEFAULT_MODES,
+                        help="'none' or checkpointed layers with optional blocks per segment, e.g. layer3:4")
+    parser.add_argument('--size', type=int, nargs=2, default=None,
+                        help='input width and height (default: INPUT_SIZE_SOURCE)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='default: BATCH_SIZE_SOURCE')
+    parser.add_argument('--steps', type=int, default=5,
+                        help='timed steps per mode')
+    parser.add_argument('--output', type=str, default=None,
+                        help='optional JSON file for the report')
+    return parser.parse_args()
+
+
+def parse_mode(mode):
+    if mode == 'none':
+        return (), 0
+    layers, _, blocks = mode.partition(':')
+    return tuple(layers.split(',')), int(blocks or 0)
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def source_step(model, batch, device):
+    """Forward and backward of the source segmentation loss, as in training."""
+    cf, kf, flow, label = batch
+    interp = nn.Upsample(size=label.shape[-2:], mode='bilinear', align_corners=True)
+    with autocast(device, cfg.TRAIN.AMP):
+        pred_aux, pred = model(cf, kf, flow, device)[:2]
+        loss = cfg.TRAIN.LAMBDA_SEG_MAIN * loss_calc(interp(pred), label, device)
+        if model.multi_level:
+            loss = loss + cfg.TRAIN.LAMBDA_SEG_AUX * loss_calc(interp(pred_aux), label, device)
+    loss.backward()
+
+
+def check_gradients(model, layers, blocks, batch, device):
+    """Compare the gradients and BatchNorm statistics after one step of `model`
+    with and without checkpointing. Returns their largest absolute difference
+    and whether they are identical."""
+    models = [copy.deepcopy(model), copy.deepcopy(model)]
+    models[0].set_gradient_checkpointing()
+    models[1].set_gradient_checkpointing(layers, blocks)
+    for m in models:
+        source_step(m, batch, device)
+    pairs = [(p.grad, q.grad) for p, q in zip(models[0].parameters(), models[1].parameters()) if p.grad is not None]
+    pairs += list(zip(models[0].buffers(), models[1].buffers()))
+    max_diff = max((a.float() - b.float()).abs().max().item() for a, b in pairs)
+    return max_diff, all(torch.equal(a, b) for a, b in pairs)
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    assert args.cfg is not None, 'Missing cfg file'
+    cfg_from_file(args.cfg)
+    device = setup_device(cfg)
+    # the recomputation must choose the same kernels for identical gradients
+    torch.backends.cudnn.benchmark = False
+    torch.backends.cudnn.deterministic = True
+    width, height = args.size or cfg.TRAIN.INPUT_SIZE_SOURCE
+    batch_size = args.batch_size or cfg.TRAIN.BATCH_SIZE_SOURCE
+    model = get_accel_deeplab_v2(num_classes=cfg.NUM_CLASSES, multi_level=cfg.TRAIN.MULTI_LEVEL)
+    model.train()
+    model_to_device(model, device, cfg)
+    batch = (torch.randn(batch_size, 3, height, width, device=device),
+             torch.randn(batch_size, 3, height, width, device=device),
+             torch.randn(batch_size, 2, height, width, device=device, dtype=torch.float64) * 5,
+             torch.randint(cfg.NUM_CLASSES, (batch_size, height, width), device=device))
+
+    report = {'input_size': [width, height], 'batch_size': batch_size, 'amp': cfg.TRAIN.AMP, 'modes': {}}
+    print(f'{"mode":<32}{"identical":>10}{"max diff":>10}{"peak MB":>9}{"ms/step":>10}{"memory":>8}{"time":>7}')
+    for mode in args.modes:
+        layers, blocks = parse_mode(mode)
+        max_diff, identical = check_gradients(model, layers, blocks, batch, device)
+        model.set_gradient_checkpointing(layers, blocks)
+        model.zero_grad(set_to_none=True)
+        source_step(model, batch, device)
+        model.zero_grad(set_to_none=True)
+        synchronize(device)
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+            baseline = torch.cuda.memory_allocated(device)
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            source_step(model, batch, device)
+            model.zero_grad(set_to_none=True)
+        synchronize(device)
+        result = {'identical': identical,
+                  'max_diff': max_diff,
+                  'peak_mb': (torch.cuda.max_memory_allocated(device) - baseline) / 2 ** 20
+                  if device.type == 'cuda' else None,
+                  'ms_per_step': 1000 * (time.perf_counter() - start) / args.steps}
+        report['modes'][mode] = result
+        # memory and step time relative to the first mode
+        first = next(iter(report['modes'].values()))
+        memory = '-' if result['peak_mb'] is None else f'{result["peak_mb"] / first["peak_mb"]:.2f}'
+        peak = '-' if result['peak_mb'] is None else f'{result["peak_mb"]:.0f}'
+        print(f'{mode:<32}{str(identical):>10}{max_diff:>10.2e}{peak:>9}{result["ms_per_step"]:>10.1f}'
+              f'{memory:>8}{result["ms_per_step"] / first["ms_per_step"]:>7.2f}')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import argparse
+
+from davsn.dataset.flow_generation import FLOW_METHODS, DIS_PRESETS, generate_flows
+from davsn.domain_adaptation.config import cfg, cfg_from_file
+from davsn.scripts.build_image_cache import get_dataset
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Estimate the _int16_x10.npy optical flows of a dataset with OpenCV")
+    parser.add_argument('--cfg', type=str, default=None,
+                        help='optional config file', )
+    parser.add_argument('--domain', type=str, default='target', choices=['source', 'target', 'test'],
+                        help='dataset to process: training source/target or test target')
+    parser.add_argument('--output', type=str, default=None,
+                        help='flow directory (default: flow_path_src / flow_path of the config)')
+    parser.add_argument('--method', type=str, default='dis', choices=FLOW_METHODS,
+                        help='OpenCV flow estimator')
+    parser.add_argument('--preset', type=str, default='medium', choices=list(DIS_PRESETS),
+                        help='DIS preset')
+    parser.add_argument('--num-workers', type=int, default=8,
+                        help='number of estimation processes')
+    return parser.parse_args()
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    assert args.cfg is not None, 'Missing cfg file'
+    cfg_from_file(args.cfg)
+    output = args.output
+    if output is None:
+        output = {'source': cfg.TRAIN.flow_path_src,
+                  'target': cfg.TRAIN.flow_path,
+                  'test': cfg.TEST.flow_path}[args.domain]
+    assert not output.endswith('.npy'), 'Flows are written to a directory, pack it afterwards with pack_flow.py'
+    dataset = get_dataset(args.domain)
+    # SynthiaSeq frames lose their 120 bottom rows in the loader
+    crop_bottom = 120 if args.domain == 'source' and cfg.SOURCE == 'SynthiaSeq' else 0
+    stats = generate_flows(dataset, output, args.method, args.preset, crop_bottom, args.num_workers)
+    print(f'Computed {stats["computed"]} flows into {output} ({stats["skipped"]} already there) '
+          f'in {stats["seconds"]:.1f} s: {stats["pairs_per_second"]:.2f} pairs/s, '
+          f'{stats["megapixels_per_second"]:.2f} MPix/s')
+
+
+if __name__ == '__main__':
+    main()
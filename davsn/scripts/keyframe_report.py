@@ -0,0 +1,135 @@
+import argparse
+import json
+import time
+import warnings
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils import data
+from tqdm import tqdm
+
+from davsn.dataset.CityscapesSeq import CityscapesSeqClipDataSet
+from davsn.domain_adaptation.config import cfg, cfg_from_file
+from davsn.domain_adaptation.eval_video_UDA import load_checkpoint_for_evaluation
+from davsn.domain_adaptation.keyframe_inference import KeyFrameScheduler, KeyFrameSegmenter
+from davsn.model.accel_deeplabv2 import get_accel_deeplab_v2
+from davsn.model.streaming import StreamingAccel, parse_frame_id
+from davsn.utils.amp import autocast
+from davsn.utils.device import setup_device, images_to_device
+from davsn.utils.metrics import ConfusionMatrix, ignored_classes
+
+warnings.filterwarnings("ignore")
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Latency / mIoU trade-off of key-frame scheduling on the val clips")
+    parser.add_argument('--cfg', type=str, default=None,
+                        help='optional config file', )
+    parser.add_argument('--max-intervals', type=int, nargs='+', default=None,
+                        help='KF_MAX_INTERVAL values to compare (default: the config one)')
+    parser.add_argument('--corrections', type=str, nargs='+', default=None, choices=['lowres', 'none'],
+                        help='KF_CORRECTION values to compare (default: the config one)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='optional JSON file for the report')
+    return parser.parse_args()
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    assert args.cfg is not None, 'Missing cfg file'
+    cfg_from_file(args.cfg)
+    device = setup_device(cfg)
+    model = get_accel_deeplab_v2(num_classes=cfg.NUM_CLASSES, multi_level=cfg.TEST.MULTI_LEVEL[0])
+    load_checkpoint_for_evaluation(model, cfg.TEST.RESTORE_FROM[0], device, cfg)
+
+    dataset = CityscapesSeqClipDataSet(root=cfg.DATA_DIRECTORY_TARGET,
+                                       list_path=cfg.DATA_LIST_TARGET,
+                                       set=cfg.TEST.SET_TARGET,
+                                       clip_length=cfg.TEST.KF_CLIP_LENGTH,
+                                       flow_method=cfg.TEST.KF_FLOW_METHOD,
+                                       crop_size=cfg.TEST.INPUT_SIZE_TARGET,
+                                       mean=cfg.TEST.IMG_MEAN,
+                                       info_path=cfg.TEST.INFO_TARGET,
+                                       labels_size=cfg.TEST.OUTPUT_SIZE_TARGET,
+                                       image_cache=cfg.TEST.IMAGE_CACHE_TARGET or None)
+    loader = data.DataLoader(dataset, batch_size=1, num_workers=cfg.NUM_WORKERS, shuffle=False, pin_memory=True)
+    interp = nn.Upsample(size=(cfg.TEST.OUTPUT_SIZE_TARGET[1], cfg.TEST.OUTPUT_SIZE_TARGET[0]), mode='bilinear',
+                         align_corners=True)
+
+    # 'full' is ResNetMulti.forward on every frame pair, the reference of the trade-off, and 'streaming'
+    # the same predictions reusing the logits of the previous frame as key frame
+    segmenters = {'full': None, 'streaming': StreamingAccel(model, device, cfg.TEST.AMP)}
+    for correction in args.corrections or [cfg.TEST.KF_CORRECTION]:
+        for max_interval in args.max_intervals or [cfg.TEST.KF_MAX_INTERVAL]:
+            scheduler = KeyFrameScheduler(max_interval, cfg.TEST.KF_FLOW_THRESHOLD, cfg.TEST.KF_COVERAGE_THRESHOLD)
+            segmenters[f'kf_{correction}_max{max_interval}'] = KeyFrameSegmenter(
+                model, scheduler, device, correction, cfg.TEST.KF_CORRECTION_SCALE, cfg.TEST.AMP)
+    metrics = {run: ConfusionMatrix(cfg.NUM_CLASSES, device, ignored_classes(cfg)) for run in segmenters}
+    seconds = dict.fromkeys(segmenters, 0.0)
+    key_frames = dict.fromkeys(segmenters, 0)
+    num_frames = 0
+    flow_seconds = 0.0
+
+    with torch.no_grad():
+        for frames, label, flows, clip_flow_seconds, name in tqdm(loader):
+            frames = [images_to_device(frames[:, t], device, cfg) for t in range(frames.shape[1])]
+            flows = [None] + [flows[:, t].to(device).double() for t in range(flows.shape[1])]
+            sequence, frame = parse_frame_id(name[0])
+            frame_ids = [(sequence, frame + t + 1 - len(frames)) for t in range(len(frames))]
+            num_frames += len(frames)
+            flow_seconds += float(clip_flow_seconds.sum())
+            for run, segmenter in segmenters.items():
+                synchronize(device)
+                start = time.perf_counter()
+                if segmenter is None:
+                    # the first frame has no predecessor, as for the scheduled runs it only extracts
+                    with autocast(device, cfg.TEST.AMP):
+                        model.extract(frames[0])
+                        for t in range(1, len(frames)):
+                            pred = model(frames[t], frames[t - 1], flows[t], device)[1]
+                    key_frames[run] += len(frames)
+                elif isinstance(segmenter, StreamingAccel):
+                    # the first pair extracts both frames, the next ones find the previous frame cached
+                    for t in range(1, len(frames)):
+                        pred = segmenter.step(frames[t], frames[t - 1], flows[t], frame_ids[t])[1]
+                    key_frames[run] += len(frames)
+                else:
+                    for image, flow, frame_id in zip(frames, flows, frame_ids):
+                        pred, is_key = segmenter.step(image, flow, frame_id)
+                        key_frames[run] += int(is_key)
+                synchronize(device)
+                seconds[run] += time.perf_counter() - start
+                # the label is the one of the last frame
+                metrics[run].update(label, torch.argmax(interp(pred.float()), dim=1))
+
+    report = {'clip_length': cfg.TEST.KF_CLIP_LENGTH,
+              'flow_ms_per_frame': 1000 * flow_seconds / num_frames,
+              'runs': {}}
+    print(f'{"run":<24}{"key frames":>12}{"ms/frame":>12}{"speedup":>9}{"mIoU":>8}')
+    for run in segmenters:
+        result = {'key_frame_ratio': key_frames[run] / num_frames,
+                  'ms_per_frame': 1000 * seconds[run] / num_frames,
+                  'speedup': seconds['full'] / seconds[run],
+                  'miou': round(float(np.nanmean(metrics[run].reported_iu())) * 100, 2)}
+        report['runs'][run] = result
+        print(f'{run:<24}{result["key_frame_ratio"]:>12.2f}{result["ms_per_frame"]:>12.2f}{result["speedup"]:>9.2f}'
+              f'{result["miou"]:>8.2f}')
+    print(f'flow estimation: {report["flow_ms_per_frame"]:.2f} ms/frame ({cfg.TEST.KF_FLOW_METHOD}, in the loader)')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import sys
+
+import torch
+
+from davsn.model.accel_deeplabv2 import get_accel_deeplab_v2
+from davsn.model.optimize import optimize_for_inference, compare_for_inference
+from davsn.domain_adaptation.config import cfg, cfg_from_file
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Fold BatchNorm and score fusion of a trained model for deployment")
+    parser.add_argument('--cfg', type=str, default=None,
+                        help='optional config file', )
+    parser.add_argument('--restore-from', type=str, default=None,
+                        help='checkpoint to optimize (default: TEST.RESTORE_FROM)')
+    parser.add_argument('--output', type=str, required=True,
+                        help='where to save the optimized model (whole module)')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='number of timed CPU forward passes')
+    parser.add_argument('--atol', type=float, default=1e-3,
+                        help='max abs difference of the predictions allowed, nothing is saved beyond it')
+    return parser.parse_args()
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    assert args.cfg is not None, 'Missing cfg file'
+    cfg_from_file(args.cfg)
+    restore_from = args.restore_from or cfg.TEST.RESTORE_FROM[0]
+    model = get_accel_deeplab_v2(num_classes=cfg.NUM_CLASSES, multi_level=cfg.TEST.MULTI_LEVEL[0])
+    model.load_state_dict(torch.load(restore_from, map_location='cpu'))
+    model.eval()
+    optimized = optimize_for_inference(model)
+    # validate on random frames and flow at the test input size, on CPU
+    width, height = cfg.TEST.INPUT_SIZE_TARGET
+    cf = torch.randn(1, 3, height, width)
+    kf = torch.randn(1, 3, height, width)
+    flow = torch.randn(1, 2, height, width).double() * 5
+    results = compare_for_inference(model, optimized, cf, kf, flow, args.repeats, args.atol)
+    print(f"max abs diff = {results['max_abs_diff']:.2e}")
+    print(f"latency (ms) = {results['latency_ms_original']:.1f} -> {results['latency_ms_optimized']:.1f}")
+    if not results['passed']:
+        print(f'Optimized model differs from the original beyond atol = {args.atol:.1e}, not saved')
+        sys.exit(1)
+    torch.save(optimized, args.output)
+    print('Optimized model saved to', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import argparse
+
+from davsn.dataset.flow_store import pack_flow_dir
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Pack a directory of _int16_x10.npy optical flows")
+    parser.add_argument('--flow-dir', type=str, required=True,
+                        help='directory of estimated optical flow (.npy files)')
+    parser.add_argument('--output', type=str, required=True,
+                        help='packed flow store to write, e.g. '
+                             '../../data/Estimated_optical_flow_Cityscapes-Seq_train.npy')
+    return parser.parse_args()
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    num_flows = pack_flow_dir(args.flow_dir, args.output)
+    print(f'Packed {num_flows} flows into {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -67,7 +67,9 @@ def main(config_file, exp_suffix):
                                      info_path=cfg.TEST.INFO_TARGET,
                                      crop_size=cfg.TEST.INPUT_SIZE_TARGET,
                                      mean=cfg.TEST.IMG_MEAN,
-                                     labels_size=cfg.TEST.OUTPUT_SIZE_TARGET)
+                                     labels_size=cfg.TEST.OUTPUT_SIZE_TARGET,
+                                     flow_path=cfg.TEST.flow_path,
+                                     image_cache=cfg.TEST.IMAGE_CACHE_TARGET or None)
     test_loader = data.DataLoader(test_dataset,
                                   batch_size=cfg.TEST.BATCH_SIZE_TARGET,
                                   num_workers=cfg.NUM_WORKERS,
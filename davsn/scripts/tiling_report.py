@@ -0,0 +1,145 @@
+import argparse
+import json
+import sys
+import time
+import warnings
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils import data
+from tqdm import tqdm
+
+from davsn.dataset.CityscapesSeq import CityscapesSeqDataSet
+from davsn.domain_adaptation.config import cfg, cfg_from_file
+from davsn.domain_adaptation.eval_video_UDA import load_checkpoint_for_evaluation
+from davsn.domain_adaptation.tiled_inference import TiledSegmenter, tile_starts
+from davsn.model.accel_deeplabv2 import get_accel_deeplab_v2
+from davsn.utils.device import setup_device, images_to_device
+from davsn.utils.flow import decode_flow
+from davsn.utils.metrics import ConfusionMatrix, ignored_classes
+
+warnings.filterwarnings("ignore")
+
+
+def get_arguments():
+    """
+    Parse input arguments
+    """
+    parser = argparse.ArgumentParser(description="Peak memory / speed / accuracy of tiled inference on the val set")
+    parser.add_argument('--cfg', type=str, default=None,
+                        help='optional config file', )
+    parser.add_argument('--budgets', type=float, nargs='+', default=None,
+                        help='TILE_MEMORY_MB values to compare (default: the config one)')
+    parser.add_argument('--num-images', type=int, default=0,
+                        help='number of val images, 0 for all')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='max difference of the probabilities with whole-image inference allowed')
+    parser.add_argument('--output', type=str, default=None,
+                        help='optional JSON file for the report')
+    return parser.parse_args()
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def main():
+    args = get_arguments()
+    print('Called with args:')
+    print(args)
+    assert args.cfg is not None, 'Missing cfg file'
+    cfg_from_file(args.cfg)
+    device = setup_device(cfg)
+    model = get_accel_deeplab_v2(num_classes=cfg.NUM_CLASSES, multi_level=cfg.TEST.MULTI_LEVEL[0])
+    load_checkpoint_for_evaluation(model, cfg.TEST.RESTORE_FROM[0], device, cfg)
+
+    dataset = CityscapesSeqDataSet(root=cfg.DATA_DIRECTORY_TARGET,
+                                   list_path=cfg.DATA_LIST_TARGET,
+                                   set=cfg.TEST.SET_TARGET,
+                                   info_path=cfg.TEST.INFO_TARGET,
+                                   crop_size=cfg.TEST.INPUT_SIZE_TARGET,
+                                   mean=cfg.TEST.IMG_MEAN,
+                                   labels_size=cfg.TEST.OUTPUT_SIZE_TARGET,
+                                   flow_path=cfg.TEST.flow_path,
+                                   image_cache=cfg.TEST.IMAGE_CACHE_TARGET or None)
+    loader = data.DataLoader(dataset, batch_size=1, num_workers=cfg.NUM_WORKERS, shuffle=False, pin_memory=True)
+    interp = nn.Upsample(size=(cfg.TEST.OUTPUT_SIZE_TARGET[1], cfg.TEST.OUTPUT_SIZE_TARGET[0]), mode='bilinear',
+                         align_corners=True)
+
+    # 'whole' is the untiled inference, the reference of the comparison
+    segmenters = {'whole': TiledSegmenter(model, device, amp=cfg.TEST.AMP)}
+    for budget in args.budgets or [cfg.TEST.TILE_MEMORY_MB]:
+        segmenters[f'budget_{budget:g}mb'] = TiledSegmenter(model, device, budget, cfg.TEST.TILE_OVERLAP,
+                                                           cfg.TEST.TILE_BYTES_PER_PIXEL, cfg.TEST.AMP)
+    metrics = {run: ConfusionMatrix(cfg.NUM_CLASSES, device, ignored_classes(cfg)) for run in segmenters}
+    seconds = dict.fromkeys(segmenters, 0.0)
+    peak_bytes = dict.fromkeys(segmenters, 0)
+    max_prob_diff = dict.fromkeys(segmenters, 0.0)
+    agreement = dict.fromkeys(segmenters, 0.0)
+    num_images = 0
+
+    with torch.no_grad():
+        for index, (image, label, image2, _, name, flow) in enumerate(tqdm(loader)):
+            if args.num_images and index == args.num_images:
+                break
+            cf = images_to_device(image, device, cfg)
+            kf = images_to_device(image2, device, cfg)
+            flow = decode_flow(flow.to(device))
+            num_images += 1
+            reference = None
+            for run, segmenter in segmenters.items():
+                synchronize(device)
+                if device.type == 'cuda':
+                    torch.cuda.reset_peak_memory_stats(device)
+                    baseline = torch.cuda.memory_allocated(device)
+                start = time.perf_counter()
+                pred = segmenter(cf, kf, flow)
+                synchronize(device)
+                seconds[run] += time.perf_counter() - start
+                if device.type == 'cuda':
+                    peak_bytes[run] = max(peak_bytes[run], torch.cuda.max_memory_allocated(device) - baseline)
+                prob = torch.softmax(interp(pred), dim=1)
+                if reference is None:
+                    reference = prob
+                max_prob_diff[run] = max(max_prob_diff[run], (prob - reference).abs().max().item())
+                pred_argmax = torch.argmax(prob, dim=1)
+                agreement[run] += (pred_argmax == torch.argmax(reference, dim=1)).float().mean().item()
+                metrics[run].update(label, pred_argmax)
+
+    image_size = cf.shape[-2:]
+    report = {'image_size': list(image_size), 'overlap': cfg.TEST.TILE_OVERLAP, 'runs': {}}
+    print(f'{"run":<20}{"tile":>12}{"tiles":>7}{"ms/frame":>10}{"peak MB":>9}{"B/pixel":>9}'
+          f'{"max dp":>8}{"agree":>8}{"mIoU":>8}')
+    for run, segmenter in segmenters.items():
+        tile_h, tile_w = segmenter.tile_size(image_size, 1)
+        num_tiles = len(tile_starts(image_size[0], tile_h, segmenter.overlap)) * \
+            len(tile_starts(image_size[1], tile_w, segmenter.overlap))
+        # peak memory of a forward (blending buffers included) per pixel of its tile, None on CPU
+        peak_mb = peak_bytes[run] / 2 ** 20 if device.type == 'cuda' else None
+        result = {'tile_size': [tile_h, tile_w],
+                  'num_tiles': num_tiles,
+                  'ms_per_frame': 1000 * seconds[run] / num_images,
+                  'peak_mb': peak_mb,
+                  'peak_bytes_per_tile_pixel': peak_bytes[run] / (tile_h * tile_w) if peak_mb is not None else None,
+                  'max_prob_diff': max_prob_diff[run],
+                  'pixel_agreement': agreement[run] / num_images,
+                  'miou': round(float(np.nanmean(metrics[run].reported_iu())) * 100, 2)}
+        report['runs'][run] = result
+        peak = '-' if peak_mb is None else f'{peak_mb:.0f}'
+        bytes_per_pixel = '-' if peak_mb is None else f'{result["peak_bytes_per_tile_pixel"]:.0f}'
+        print(f'{run:<20}{f"{tile_h}x{tile_w}":>12}{num_tiles:>7}{result["ms_per_frame"]:>10.2f}{peak:>9}'
+              f'{bytes_per_pixel:>9}{result["max_prob_diff"]:>8.3f}{result["pixel_agreement"]:>8.4f}'
+              f'{result["miou"]:>8.2f}')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    failed = [run for run, result in report['runs'].items() if result['max_prob_diff'] > args.tolerance]
+    if failed:
+        print(f'{", ".join(failed)} differ from whole-image inference beyond tolerance = {args.tolerance:g}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
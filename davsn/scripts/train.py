@@ -1,4 +1,5 @@
 import argparse
+import math
 import os
 import os.path as osp
 import pprint
@@ -7,13 +8,16 @@ import warnings
 import numpy as np
 import yaml
 import torch
+import torch.multiprocessing as mp
 from torch.utils import data
 from davsn.model.accel_deeplabv2 import get_accel_deeplab_v2
 from davsn.dataset.Viper import ViperDataSet
 from davsn.dataset.SynthiaSeq import SynthiaSeqDataSet
 from davsn.dataset.CityscapesSeq import CityscapesSeqDataSet
+from davsn.dataset.sampler import InfiniteSampler
 from davsn.domain_adaptation.config import cfg, cfg_from_file
 from davsn.domain_adaptation.train_video_UDA import train_domain_adaptation
+from davsn.utils.distributed import init_distributed, cleanup_distributed, is_main_process, launched_with_torchrun
 
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore")
@@ -34,6 +38,10 @@ def get_arguments():
                         help="visualize results.")
     parser.add_argument("--exp-suffix", type=str, default=None,
                         help="optional experiment suffix")
+    parser.add_argument("--num-processes", type=int, default=1,
+                        help="number of training processes (DistributedDataParallel), one per GPU or CPU-only with gloo")
+    parser.add_argument("--resume", type=str, nargs='?', const='', default=None,
+                        help="resume from a training state, train_state.pth of the snapshot dir if no path is given")
     return parser.parse_args()
 
 
@@ -42,7 +50,20 @@ def main():
     args = get_arguments()
     print('Called with args:')
     print(args)
+    if launched_with_torchrun():
+        train_worker(int(os.environ['RANK']), int(os.environ['WORLD_SIZE']), int(os.environ['LOCAL_RANK']), args)
+    elif args.num_processes > 1:
+        mp.spawn(_spawned_worker, args=(args,), nprocs=args.num_processes)
+    else:
+        train_worker(0, 1, 0, args)
+
+
+def _spawned_worker(rank, args):
+    train_worker(rank, args.num_processes, rank, args)
 
+
+def train_worker(rank, world_size, local_rank, args):
+    # each process loads the config, the spawned ones do not share the parent's globals
     assert args.cfg is not None, 'Missing cfg file'
     cfg_from_file(args.cfg)
     # auto-generate exp name if not specified
@@ -55,6 +76,9 @@ def main():
     if cfg.TRAIN.SNAPSHOT_DIR == '':
         cfg.TRAIN.SNAPSHOT_DIR = osp.join(cfg.EXP_ROOT_SNAPSHOT, cfg.EXP_NAME)
         os.makedirs(cfg.TRAIN.SNAPSHOT_DIR, exist_ok=True)
+    if args.resume is not None:
+        cfg.TRAIN.RESUME_FROM = args.resume or osp.join(cfg.TRAIN.SNAPSHOT_DIR, 'train_state.pth')
+        assert osp.exists(cfg.TRAIN.RESUME_FROM), f'Missing training state {cfg.TRAIN.RESUME_FROM}'
     # tensorboard
     if args.tensorboard:
         if cfg.TRAIN.TENSORBOARD_LOGDIR == '':
@@ -64,28 +88,36 @@ def main():
             cfg.TRAIN.TENSORBOARD_VIZRATE = args.viz_every_iter
     else:
         cfg.TRAIN.TENSORBOARD_LOGDIR = ''
-    print('Using config:')
-    pprint.pprint(cfg)
+    # DISTRIBUTED: one device per process
+    if world_size > 1 and not cfg.DEVICE:
+        cfg.GPU_ID = cfg.GPU_ID + local_rank
+    init_distributed(cfg, rank, world_size)
+    if is_main_process():
+        print('Using config:')
+        pprint.pprint(cfg)
 
     # INIT
     _init_fn = None
     if not args.random_train:
+        # same model initialization in all the processes, different data augmentation/workers
         torch.manual_seed(cfg.TRAIN.RANDOM_SEED)
-        torch.cuda.manual_seed(cfg.TRAIN.RANDOM_SEED)
-        np.random.seed(cfg.TRAIN.RANDOM_SEED)
-        random.seed(cfg.TRAIN.RANDOM_SEED)
+        if torch.cuda.is_available():
+            torch.cuda.manual_seed(cfg.TRAIN.RANDOM_SEED)
+        np.random.seed(cfg.TRAIN.RANDOM_SEED + rank)
+        random.seed(cfg.TRAIN.RANDOM_SEED + rank)
 
         def _init_fn(worker_id):
-            np.random.seed(cfg.TRAIN.RANDOM_SEED + worker_id)
+            np.random.seed(cfg.TRAIN.RANDOM_SEED + 1000 * rank + worker_id)
 
     if os.environ.get('ADVENT_DRY_RUN', '0') == '1':
+        cleanup_distributed()
         return
 
     # LOAD SEGMENTATION NET
     assert osp.exists(cfg.TRAIN.RESTORE_FROM), f'Missing init model {cfg.TRAIN.RESTORE_FROM}'
     if cfg.TRAIN.MODEL == 'ACCEL_DeepLabv2':
         model = get_accel_deeplab_v2(num_classes=cfg.NUM_CLASSES, multi_level=cfg.TRAIN.MULTI_LEVEL)
-        saved_state_dict = torch.load(cfg.TRAIN.RESTORE_FROM)
+        saved_state_dict = torch.load(cfg.TRAIN.RESTORE_FROM, map_location='cpu')
         if 'DeepLab_resnet_pretrained_imagenet' in cfg.TRAIN.RESTORE_FROM:
             new_params = model.state_dict().copy()
             for i in saved_state_dict:
@@ -104,21 +136,27 @@ def main():
         source_dataset = ViperDataSet(root=cfg.DATA_DIRECTORY_SOURCE,
                                      list_path=cfg.DATA_LIST_SOURCE,
                                      set=cfg.TRAIN.SET_SOURCE,
-                                     max_iters=cfg.TRAIN.MAX_ITERS * cfg.TRAIN.BATCH_SIZE_SOURCE,
+                                     max_iters=cfg.TRAIN.MAX_ITERS * cfg.TRAIN.BATCH_SIZE_SOURCE * cfg.TRAIN.ACCUM_STEPS * world_size,
                                      crop_size=cfg.TRAIN.INPUT_SIZE_SOURCE,
-                                     mean=cfg.TRAIN.IMG_MEAN)
+                                     mean=cfg.TRAIN.IMG_MEAN,
+                                     flow_path=cfg.TRAIN.flow_path_src,
+                                     image_cache=cfg.TRAIN.IMAGE_CACHE_SOURCE or None,
+                                     label_cache=cfg.TRAIN.LABEL_CACHE_SOURCE or None)
     elif cfg.SOURCE == 'SynthiaSeq':
         INPUT_SIZE_SOURCE = (1280,760)
         source_dataset = SynthiaSeqDataSet(root=cfg.DATA_DIRECTORY_SOURCE,
                                      list_path=cfg.DATA_LIST_SOURCE,
                                      set=cfg.TRAIN.SET_SOURCE,
-                                     max_iters=cfg.TRAIN.MAX_ITERS * cfg.TRAIN.BATCH_SIZE_SOURCE,
+                                     max_iters=cfg.TRAIN.MAX_ITERS * cfg.TRAIN.BATCH_SIZE_SOURCE * cfg.TRAIN.ACCUM_STEPS * world_size,
                                      crop_size=INPUT_SIZE_SOURCE,
-                                     mean=cfg.TRAIN.IMG_MEAN)
+                                     mean=cfg.TRAIN.IMG_MEAN,
+                                     flow_path=cfg.TRAIN.flow_path_src,
+                                     image_cache=cfg.TRAIN.IMAGE_CACHE_SOURCE or None,
+                                     label_cache=cfg.TRAIN.LABEL_CACHE_SOURCE or None)
     source_loader = data.DataLoader(source_dataset,
                                     batch_size=cfg.TRAIN.BATCH_SIZE_SOURCE,
                                     num_workers=cfg.NUM_WORKERS,
-                                    shuffle=True,
+                                    sampler=get_train_sampler(source_dataset, rank, world_size, args),
                                     pin_memory=True,
                                     worker_init_fn=_init_fn)
 
@@ -126,21 +164,35 @@ def main():
                                        list_path=cfg.DATA_LIST_TARGET,
                                        set=cfg.TRAIN.SET_TARGET,
                                        info_path=cfg.TRAIN.INFO_TARGET,
-                                       max_iters=cfg.TRAIN.MAX_ITERS * cfg.TRAIN.BATCH_SIZE_TARGET,
+                                       max_iters=cfg.TRAIN.MAX_ITERS * cfg.TRAIN.BATCH_SIZE_TARGET * cfg.TRAIN.ACCUM_STEPS * world_size,
                                        crop_size=cfg.TRAIN.INPUT_SIZE_TARGET,
-                                       mean=cfg.TRAIN.IMG_MEAN)
+                                       mean=cfg.TRAIN.IMG_MEAN,
+                                       flow_path=cfg.TRAIN.flow_path,
+                                       image_cache=cfg.TRAIN.IMAGE_CACHE_TARGET or None)
     target_loader = data.DataLoader(target_dataset,
                                     batch_size=cfg.TRAIN.BATCH_SIZE_TARGET,
                                     num_workers=cfg.NUM_WORKERS,
-                                    shuffle=True,
+                                    sampler=get_train_sampler(target_dataset, rank, world_size, args),
                                     pin_memory=True,
                                     worker_init_fn=_init_fn)
 
-    with open(osp.join(cfg.TRAIN.SNAPSHOT_DIR, 'train_cfg.yml'), 'w') as yaml_file:
-        yaml.dump(cfg, yaml_file, default_flow_style=False)
+    if is_main_process():
+        with open(osp.join(cfg.TRAIN.SNAPSHOT_DIR, 'train_cfg.yml'), 'w') as yaml_file:
+            yaml.dump(cfg, yaml_file, default_flow_style=False)
 
     # UDA TRAINING
     train_domain_adaptation(model, source_loader, target_loader, cfg)
+    cleanup_distributed()
+
+
+def get_train_sampler(dataset, rank, world_size, args):
+    # reshuffled every epoch over the dataset until the max_iters samples of the run are drawn,
+    # the same seed in all the processes so that they split each epoch
+    seed = cfg.TRAIN.RANDOM_SEED
+    if args.random_train and world_size == 1:
+        seed = random.randrange(2 ** 31)
+    return InfiniteSampler(len(dataset), num_samples=math.ceil(dataset.max_iters / world_size),
+                           shuffle=True, seed=seed, rank=rank, num_replicas=world_size)
 
 
 if __name__ == '__main__':
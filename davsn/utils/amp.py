@@ -0,0 +1,28 @@
+import contextlib
+
+import torch
+
+AMP_DTYPES = {'': None, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+def amp_dtype(mode):
+    if mode not in AMP_DTYPES:
+        raise NotImplementedError(f"Not yet supported AMP mode {mode}")
+    return AMP_DTYPES[mode]
+
+
+def autocast(device, mode):
+    """Autocast context for `mode` ('' disables it, 'fp16' or 'bf16')."""
+    dtype = amp_dtype(mode)
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+
+def grad_scaler(device, mode):
+    """Gradient scaler, only enabled for fp16 on CUDA (bf16 keeps the fp32 range)."""
+    enabled = amp_dtype(mode) == torch.float16 and device.type == 'cuda'
+    if hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler('cuda', enabled=enabled)
+    # torch < 2.3
+    return torch.cuda.amp.GradScaler(enabled=enabled)
@@ -0,0 +1,119 @@
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+
+from davsn.dataset.sampler import InfiniteSampler
+
+
+def resume_loader(loader, num_samples):
+    """Make the next iterator of `loader` skip the `num_samples` already consumed."""
+    assert isinstance(loader.sampler, InfiniteSampler), 'Loader position can only be restored with an InfiniteSampler'
+    loader.sampler.start = num_samples
+
+
+def get_rng_state(device):
+    state = {'python': random.getstate(),
+             'numpy': np.random.get_state(),
+             'torch': torch.get_rng_state()}
+    if device.type == 'cuda':
+        state['cuda'] = torch.cuda.get_rng_state(device)
+    return state
+
+
+def set_rng_state(state, device):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if device.type == 'cuda' and 'cuda' in state:
+        torch.cuda.set_rng_state(state['cuda'], device)
+
+
+def _snapshot(obj, pin_memory, memo):
+    # copy the tensors of a (nested) state dict to the host, asynchronously from CUDA,
+    # tensors shared between several states are copied once
+    if torch.is_tensor(obj):
+        if id(obj) not in memo:
+            if obj.device.type == 'cuda':
+                copy = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=pin_memory)
+                memo[id(obj)] = copy.copy_(obj.detach(), non_blocking=pin_memory)
+            else:
+                memo[id(obj)] = obj.detach().clone()
+        return memo[id(obj)]
+    if isinstance(obj, dict):
+        return type(obj)((k, _snapshot(v, pin_memory, memo)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(v, pin_memory, memo) for v in obj)
+    return obj
+
+
+def load_checkpoint(path):
+    try:
+        return torch.load(path, map_location='cpu', weights_only=False)
+    except TypeError:
+        # torch < 1.13
+        return torch.load(path, map_location='cpu')
+
+
+class CheckpointWriter:
+    """Write checkpoints on a background thread.
+
+    `save` snapshots the state on the host and returns; the training loop may
+    keep updating the weights while the file is written. CUDA tensors are
+    copied into pinned memory on the current stream, the writer waits for the
+    copies before serializing. Files are written to `<path>.tmp` and renamed,
+    so a checkpoint is either complete or absent.
+    """
+
+    def __init__(self, max_pending=2):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            files, event = item
+            try:
+                if event is not None:
+                    event.synchronize()
+                for path, state in files.items():
+                    tmp_path = f'{path}.tmp'
+                    torch.save(state, tmp_path)
+                    os.replace(tmp_path, path)
+            except Exception as e:
+                self._error = e
+            self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('Writing a checkpoint failed') from error
+
+    def save(self, files, device):
+        """Queue the writing of `files`, a dict {path: state}."""
+        self._check()
+        pin_memory = device.type == 'cuda'
+        files = {str(path): _snapshot(state, pin_memory, {}) for path, state in files.items()}
+        event = None
+        if pin_memory:
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(device))
+        self._queue.put((files, event))
+
+    def wait(self):
+        """Block until all the pending checkpoints are written."""
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._check()
@@ -0,0 +1,49 @@
+import torch
+
+
+def as_device(device):
+    """Turn a GPU index or a device string ('cpu', 'cuda:1') into a torch.device."""
+    if isinstance(device, torch.device):
+        return device
+    if isinstance(device, int):
+        return torch.device('cuda', device)
+    return torch.device(device)
+
+
+def get_device(cfg):
+    """Device selected by `cfg.DEVICE`, or `cuda:GPU_ID` when CUDA is available,
+    or the CPU otherwise.
+    """
+    if cfg.DEVICE:
+        return as_device(cfg.DEVICE)
+    if torch.cuda.is_available():
+        return torch.device('cuda', cfg.GPU_ID)
+    return torch.device('cpu')
+
+
+def setup_device(cfg):
+    """Resolve the execution device and apply the CPU thread settings."""
+    device = get_device(cfg)
+    if cfg.NUM_THREADS > 0:
+        torch.set_num_threads(cfg.NUM_THREADS)
+    if cfg.NUM_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(cfg.NUM_INTEROP_THREADS)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work
+            print('Could not set the number of inter-op threads')
+    return device
+
+
+def model_to_device(model, device, cfg):
+    model.to(device)
+    if cfg.CHANNELS_LAST:
+        model.to(memory_format=torch.channels_last)
+    return model
+
+
+def images_to_device(images, device, cfg):
+    images = images.to(device, non_blocking=True)
+    if cfg.CHANNELS_LAST:
+        images = images.contiguous(memory_format=torch.channels_last)
+    return images
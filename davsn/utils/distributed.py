@@ -0,0 +1,66 @@
+import os
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+
+def get_rank():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank()
+    return 0
+
+
+def get_world_size():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_world_size()
+    return 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def launched_with_torchrun():
+    return int(os.environ.get('WORLD_SIZE', '1')) > 1
+
+
+def init_distributed(cfg, rank, world_size):
+    """Join the process group of a multi-process run (no-op for a single process).
+
+    Processes started by `torchrun` rendezvous through the environment, the
+    ones spawned by `scripts/train.py` through `cfg.DIST_URL`. The backend is
+    `cfg.DIST_BACKEND`, or nccl on CUDA and gloo on the CPU.
+    """
+    if world_size <= 1:
+        return
+    backend = cfg.DIST_BACKEND
+    if not backend:
+        use_cuda = torch.cuda.is_available() and not cfg.DEVICE.startswith('cpu')
+        backend = 'nccl' if use_cuda else 'gloo'
+    init_method = 'env://' if launched_with_torchrun() else cfg.DIST_URL
+    dist.init_process_group(backend, init_method=init_method, rank=rank, world_size=world_size)
+
+
+def cleanup_distributed():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def wrap_ddp(module, device):
+    """DistributedDataParallel wrapper of `module` in a multi-process run.
+
+    Unused parameters are expected: the aux classifier without multi-level
+    outputs and `sf_layer` in the target-domain pass.
+    """
+    if get_world_size() == 1:
+        return module
+    device_ids = [device] if device.type == 'cuda' else None
+    return DistributedDataParallel(module, device_ids=device_ids, find_unused_parameters=True)
+
+
+def set_grad_sync(module, sync):
+    """Whether the next forward/backward of a DDP module all-reduces the
+    gradients, `DistributedDataParallel.no_sync` without the context manager."""
+    if isinstance(module, DistributedDataParallel):
+        module.require_backward_grad_sync = sync
@@ -0,0 +1,89 @@
+import torch
+import torch.nn.functional as F
+
+
+def decode_flow(flow_int16_x10):
+    """Convert stored int16 flows (pixels x 10) to float64 displacements."""
+    return flow_int16_x10.double() / 10.0
+
+
+def resize_flow(flow, size):
+    """Bilinearly resize a (B, 2, H, W) flow field to `size` and rescale its
+    displacements by the height ratio, as done for the feature maps.
+    """
+    ratio = size[0] / flow.shape[-2]
+    return F.interpolate(flow, size=tuple(size), mode='bilinear', align_corners=True) * ratio
+
+
+def flow_splat_index(flow):
+    """Compute the (source, target) pixel pairs of a forward splat along `flow`.
+
+    Every pixel (y, x) of the key frame is moved to
+    (round(y - flow_y), round(x - flow_x)) of the current frame. Pixels landing
+    outside the frame are dropped and, when several pixels land on the same
+    target, the one visited last by a column-major scan (x outer, y inner)
+    wins. Indices are flattened over (B, H, W) so that each sample of the batch
+    is splatted along its own flow.
+    """
+    b, _, h, w = flow.shape
+    device = flow.device
+    ys = torch.arange(h, device=device, dtype=flow.dtype).view(1, h, 1)
+    xs = torch.arange(w, device=device, dtype=flow.dtype).view(1, 1, w)
+    x_flow = torch.round(xs - flow[:, 0]).long()
+    y_flow = torch.round(ys - flow[:, 1]).long()
+    valid = (x_flow >= 0) & (x_flow < w) & (y_flow >= 0) & (y_flow < h)
+    batch = torch.arange(b, device=device).view(b, 1, 1) * (h * w)
+    src = (batch + torch.arange(h * w, device=device).view(1, h, w)).expand(b, h, w)
+    dst = batch + y_flow * w + x_flow
+    order = (torch.arange(w, device=device).view(1, 1, w) * h
+             + torch.arange(h, device=device).view(1, h, 1)).expand(b, h, w)
+    src, dst, order = src[valid], dst[valid], order[valid]
+    # resolve collisions: sort by target then by scan order, keep the last writer
+    _, perm = torch.sort(dst * (h * w) + order)
+    src, dst = src[perm], dst[perm]
+    last = torch.ones_like(dst, dtype=torch.bool)
+    last[:-1] = dst[1:] != dst[:-1]
+    return src[last], dst[last]
+
+
+def splat(input, index):
+    """Scatter a (B, C, H, W) or (B, H, W) map along a `flow_splat_index`.
+
+    Untouched positions are zero.
+    """
+    src, dst = index
+    squeeze = input.dim() == 3
+    if squeeze:
+        input = input.unsqueeze(1)
+    b, c, h, w = input.shape
+    values = input.permute(0, 2, 3, 1).reshape(b * h * w, c)
+    output = values.new_zeros(b * h * w, c)
+    output[dst] = values[src]
+    output = output.view(b, h, w, c).permute(0, 3, 1, 2)
+    if squeeze:
+        output = output.squeeze(1)
+    return output
+
+
+def splat_positions(index, reference):
+    """Return the (B, 1, H, W) coverage mask of a splat, 1 where a pixel landed."""
+    _, dst = index
+    b, _, h, w = reference.shape
+    positions = reference.new_zeros(b * h * w)
+    positions[dst] = 1
+    return positions.view(b, 1, h, w)
+
+
+def propagate_by_flow(inputs, flow):
+    """Warp several maps of the same spatial size along `flow` in one pass.
+
+    `flow` must already match the spatial size of the inputs. `None` entries are
+    passed through. Returns the warped maps and the coverage mask.
+    """
+    index = flow_splat_index(flow)
+    reference = next(x for x in inputs if x is not None)
+    if reference.dim() == 3:
+        reference = reference.unsqueeze(1)
+    outputs = [None if x is None else splat(x, index) for x in inputs]
+    return outputs, splat_positions(index, reference)
+
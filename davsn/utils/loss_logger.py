@@ -0,0 +1,79 @@
+import queue
+import threading
+
+import torch
+from tqdm import tqdm
+
+
+class LossLogger:
+    """Deferred console and tensorboard logging of the training losses.
+
+    `log` stacks the losses of an iteration into one tensor on the device and
+    returns without synchronizing. Every `flush_every` iterations the buffered
+    rows are handed to a background thread, which copies them to the host in a
+    single transfer and writes one `iter = ...` line and one `data/<loss>`
+    scalar per loss and iteration, as the per-iteration logging did.
+    """
+
+    def __init__(self, device, flush_every=1, writer=None):
+        self.device = device
+        self.flush_every = max(1, flush_every)
+        self.writer = writer
+        self._names = None
+        self._iters = []
+        self._rows = []
+        self._error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _as_tensor(self, value):
+        # the aux losses are plain 0 without multi-level outputs
+        if torch.is_tensor(value):
+            return value.detach().float().reshape(())
+        return torch.full((), float(value), device=self.device)
+
+    def log(self, losses, i_iter):
+        names = list(losses)
+        if self._names is not None and names != self._names:
+            self.flush()
+        self._names = names
+        self._rows.append(torch.stack([self._as_tensor(value) for value in losses.values()]))
+        self._iters.append(i_iter)
+        if len(self._rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self, wait=False):
+        """Hand the buffered iterations to the writing thread, and wait until they
+        are written with `wait`."""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('Logging the losses failed') from error
+        if self._rows:
+            self._queue.put((self._names, self._iters, torch.stack(self._rows)))
+            self._iters, self._rows = [], []
+        if wait:
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            names, iters, rows = item
+            try:
+                for i_iter, values in zip(iters, rows.cpu().numpy()):
+                    full_string = ' '.join(f'{name} = {value:.3f} ' for name, value in zip(names, values))
+                    tqdm.write(f'iter = {i_iter} {full_string}')
+                    if self.writer is not None:
+                        for name, value in zip(names, values):
+                            self.writer.add_scalar(f'data/{name}', value, i_iter)
+            except Exception as e:
+                self._error = e
+            self._queue.task_done()
+
+    def close(self):
+        self.flush(wait=True)
+        self._queue.put(None)
+        self._thread.join()
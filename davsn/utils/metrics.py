@@ -0,0 +1,54 @@
+import numpy as np
+import torch
+
+
+class ConfusionMatrix:
+    """Confusion matrix accumulated on the inference device.
+
+    `update` takes batches of labels and predicted class maps and only runs
+    device ops; the matrix is copied to the host when the IoUs are requested.
+    Rows are labels and columns predictions, as in `advent.utils.func.fast_hist`.
+    `ignore_classes` are dropped from the reported IoUs only (e.g. 'fence' when
+    adapting from SynthiaSeq), not from the matrix.
+    """
+
+    def __init__(self, num_classes, device, ignore_classes=()):
+        self.num_classes = num_classes
+        self.device = device
+        self.ignore_classes = tuple(ignore_classes)
+        self.reset()
+
+    def reset(self):
+        self.hist = torch.zeros(self.num_classes ** 2, dtype=torch.long, device=self.device)
+
+    def update(self, label, pred):
+        n = self.num_classes
+        label = label.to(self.device, non_blocking=True).long().view(-1)
+        pred = pred.to(self.device).long().view(-1)
+        k = (label >= 0) & (label < n)
+        self.hist += torch.bincount(n * label[k] + pred[k], minlength=n ** 2)
+
+    def get_hist(self):
+        return self.hist.view(self.num_classes, self.num_classes).cpu().numpy().astype(np.float64)
+
+    def per_class_iu(self):
+        hist = self.get_hist()
+        return np.diag(hist) / (hist.sum(1) + hist.sum(0) - np.diag(hist))
+
+    def reported_iu(self):
+        return drop_ignored_classes(self.per_class_iu(), self.ignore_classes)
+
+    def miou(self):
+        return np.nanmean(self.reported_iu())
+
+
+def drop_ignored_classes(inters_over_union_classes, ignore_classes):
+    keep = [i for i in range(len(inters_over_union_classes)) if i not in ignore_classes]
+    return inters_over_union_classes[keep]
+
+
+def ignored_classes(cfg):
+    if cfg.SOURCE == 'SynthiaSeq':
+        ### ignore 'fence' class during evaluation
+        return (3,)
+    return ()
@@ -0,0 +1,139 @@
+import contextlib
+import json
+import resource
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+import torch
+
+_NULL_REGION = contextlib.nullcontext()
+_active_profiler = None
+
+
+def profile_region(name):
+    """Timing region of the active profiler, a no-op context when profiling is off.
+
+    Used inside modules (e.g. the flow warp of `ResNetMulti.fuse`) which have no
+    handle on the training loop's profiler.
+    """
+    if _active_profiler is None:
+        return _NULL_REGION
+    return _active_profiler.region(name)
+
+
+class _Region:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.synchronize()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.synchronize()
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+class StageProfiler:
+    """Wall-clock time of named regions of the training step.
+
+    The time spent in each region is summed over an iteration (regions may be
+    entered once per micro-batch and nested), `step` closes the iteration.
+    Every `log_every` iterations the mean and percentiles over the last
+    `window` iterations and the memory high-water marks are written as one
+    JSON line to `jsonl_path` and to the tensorboardX `writer`, when given.
+
+    Without `sync` the times of device work are the times to launch it; with
+    `sync` CUDA is synchronized around each region, which is exact but slower.
+    A disabled profiler only returns no-op contexts.
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, device, enabled=True, sync=False, window=100, log_every=100,
+                 jsonl_path=None, writer=None):
+        global _active_profiler
+        self.device = device
+        self.enabled = enabled
+        self.sync = sync and device.type == 'cuda'
+        self.log_every = log_every
+        self.writer = writer
+        self.history = defaultdict(lambda: deque(maxlen=window))
+        self.current = defaultdict(float)
+        self.jsonl_file = None
+        if enabled:
+            if jsonl_path:
+                self.jsonl_file = open(jsonl_path, 'a')
+            if device.type == 'cuda':
+                torch.cuda.reset_peak_memory_stats(device)
+            _active_profiler = self
+        self.last_step = time.perf_counter()
+
+    def region(self, name):
+        if not self.enabled:
+            return _NULL_REGION
+        return _Region(self, name)
+
+    def synchronize(self):
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+
+    def add(self, name, seconds):
+        self.current[name] += seconds
+
+    def step(self, i_iter):
+        """End of iteration `i_iter`."""
+        if not self.enabled:
+            return
+        self.synchronize()
+        now = time.perf_counter()
+        self.current['iteration'] = now - self.last_step
+        self.last_step = now
+        for name, seconds in self.current.items():
+            self.history[name].append(seconds)
+        self.current.clear()
+        if (i_iter + 1) % self.log_every == 0:
+            self.log(i_iter)
+            # excluded from the next iteration
+            self.last_step = time.perf_counter()
+
+    def summary(self):
+        regions = {}
+        for name, seconds in self.history.items():
+            ms = np.array(seconds) * 1000
+            stats = {'mean_ms': float(ms.mean()), 'count': len(ms)}
+            for p, value in zip(self.PERCENTILES, np.percentile(ms, self.PERCENTILES)):
+                stats[f'p{p}_ms'] = float(value)
+            regions[name] = stats
+        memory = {'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+        if self.device.type == 'cuda':
+            memory['max_allocated_mb'] = torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+            memory['max_reserved_mb'] = torch.cuda.max_memory_reserved(self.device) / 2 ** 20
+        return {'regions': regions, 'memory': memory}
+
+    def log(self, i_iter):
+        summary = self.summary()
+        if self.jsonl_file is not None:
+            self.jsonl_file.write(json.dumps({'iteration': i_iter, **summary}) + '\n')
+            self.jsonl_file.flush()
+        if self.writer is not None:
+            for name, stats in summary['regions'].items():
+                for key in ('mean_ms', 'p50_ms', 'p90_ms', 'p99_ms'):
+                    self.writer.add_scalar(f'profile/{name}/{key}', stats[key], i_iter)
+            for key, value in summary['memory'].items():
+                self.writer.add_scalar(f'profile/memory/{key}', value, i_iter)
+        # device high-water mark per logging period, the host one is process-wide
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+    def close(self):
+        global _active_profiler
+        if _active_profiler is self:
+            _active_profiler = None
+        if self.jsonl_file is not None:
+            self.jsonl_file.close()
+            self.jsonl_file = None
@@ -0,0 +1,55 @@
+import os.path as osp
+import threading
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    # polling fallback
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    def __init__(self, changed):
+        super().__init__()
+        self.changed = changed
+
+    def on_any_event(self, event):
+        self.changed.set()
+
+
+class SnapshotWatcher:
+    """Wait for the checkpoints the trainer writes into `snapshot_dir`.
+
+    `CheckpointWriter` writes each file under a temporary name and renames it
+    to `model_<iter>.pth` once complete, so only final names are reported and
+    a file being written is never loaded. Changes of the directory are
+    picked up from filesystem events (watchdog, inotify on Linux); without
+    watchdog installed the directory is polled every `poll_interval` seconds.
+    """
+
+    def __init__(self, snapshot_dir, poll_interval):
+        self.snapshot_dir = snapshot_dir
+        self.poll_interval = poll_interval
+        self._changed = threading.Event()
+        self._observer = None
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.daemon = True
+            self._observer.schedule(_ChangeHandler(self._changed), snapshot_dir)
+            self._observer.start()
+
+    def is_ready(self, path):
+        name = osp.basename(path)
+        return name.startswith('model_') and name.endswith('.pth') and osp.isfile(path)
+
+    def wait(self, path):
+        while not self.is_ready(path):
+            self._changed.wait(None if self._observer is not None else self.poll_interval)
+            self._changed.clear()
+
+    def close(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
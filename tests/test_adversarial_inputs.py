@@ -0,0 +1,34 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+pytest.importorskip('advent.utils.func')
+
+from davsn.domain_adaptation.train_video_UDA import discriminator_inputs
+
+
+def reference_inputs(preds_cf, preds_kf, interp):
+    # the softmax of the upsampled sta and sa concatenations, as before discriminator_inputs
+    probs = []
+    for pred_cf, pred_kf in zip(preds_cf, preds_kf):
+        probs += [F.softmax(interp(torch.cat((pred_cf, pred_kf), dim=1)), dim=1),
+                  F.softmax(interp(torch.cat((pred_cf, pred_cf), dim=1)), dim=1)]
+    return torch.cat(probs, dim=1)
+
+
+def test_matches_concatenated_softmax():
+    generator = torch.Generator().manual_seed(0)
+    # main and aux levels, with large and shifted logits
+    preds = [(torch.randn(2, 5, 7, 9, generator=generator, dtype=torch.float64) * scale + shift).requires_grad_()
+             for scale, shift in ((1, 0), (20, 0), (20, 50), (5, -30))]
+    preds_cf, preds_kf = preds[0::2], preds[1::2]
+    interp = lambda x: F.interpolate(x, size=(15, 19), mode='bilinear', align_corners=True)
+    weights = torch.randn(1, 40, 15, 19, generator=generator, dtype=torch.float64)
+
+    output = discriminator_inputs(preds_cf, preds_kf, interp)
+    expected = reference_inputs(preds_cf, preds_kf, interp)
+    assert torch.allclose(output, expected, rtol=0, atol=1e-12)
+    grads = torch.autograd.grad((output * weights).sum(), preds)
+    grads_expected = torch.autograd.grad((expected * weights).sum(), preds)
+    for grad, grad_expected in zip(grads, grads_expected):
+        assert torch.allclose(grad, grad_expected, rtol=0, atol=1e-12)
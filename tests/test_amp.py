@@ -0,0 +1,55 @@
+import warnings
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+from davsn.utils.amp import autocast, grad_scaler
+
+
+def small_model():
+    torch.manual_seed(0)
+    return ResNetMulti(Bottleneck, [1, 1, 1, 1], num_classes=4, multi_level=True).train()
+
+
+def inputs():
+    generator = torch.Generator().manual_seed(0)
+    return (torch.randn(1, 3, 33, 41, generator=generator), torch.randn(1, 3, 33, 41, generator=generator),
+            torch.randint(-30, 31, (1, 2, 33, 41), generator=generator).double() / 10.0,
+            torch.randint(4, (1, 33, 41), generator=generator))
+
+
+def test_grad_scaler_without_deprecation():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        scaler = grad_scaler(torch.device('cpu'), 'fp16')
+    # only fp16 on CUDA scales the losses
+    assert not scaler.is_enabled()
+
+
+@pytest.mark.parametrize('mode', ['', 'bf16'])
+def test_training_step_on_cpu(mode):
+    device = torch.device('cpu')
+    model = small_model()
+    optimizer = torch.optim.SGD([p for p in model.parameters() if p.requires_grad], lr=1e-3, momentum=0.9)
+    scaler = grad_scaler(device, mode)
+    before = {name: p.detach().clone() for name, p in model.named_parameters() if p.requires_grad}
+    cf, kf, flow, label = inputs()
+    with autocast(device, mode):
+        pred_aux, pred = model(cf, kf, flow, device)[:2]
+        assert pred.dtype == (torch.bfloat16 if mode else torch.float32)
+        pred = F.interpolate(pred, size=label.shape[-2:], mode='bilinear', align_corners=True)
+        loss = F.cross_entropy(pred.float(), label)
+    scaler.scale(loss).backward()
+    scaler.unscale_(optimizer)
+    torch.nn.utils.clip_grad_norm_(model.parameters(), 1)
+    scaler.step(optimizer)
+    scaler.update()
+    assert torch.isfinite(loss)
+    for name, p in model.named_parameters():
+        if name in before and p.grad is not None:
+            # the weights and their gradients stay in float32
+            assert p.dtype == p.grad.dtype == torch.float32
+            assert torch.isfinite(p.grad).all()
+    assert any(not torch.equal(p, before[name]) for name, p in model.named_parameters() if name in before)
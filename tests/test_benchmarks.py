@@ -0,0 +1,24 @@
+import copy
+
+import pytest
+import torch
+
+pytest.importorskip('advent.utils.serialization')
+
+from davsn.benchmarks.suite import run_suite
+from davsn.benchmarks.synthetic import ensure_synthetic_data
+from davsn.domain_adaptation.config import cfg
+
+
+def test_suite_runs(tmp_path):
+    config = copy.deepcopy(cfg)
+    config.DEVICE = 'cpu'
+    config.NUM_WORKERS = 0
+    size = (64, 32)
+    ensure_synthetic_data(str(tmp_path / 'data'), size, num_sequences=2)
+    (tmp_path / 'work').mkdir()
+    results = run_suite(str(tmp_path / 'data'), config, size, torch.device('cpu'), repeats=1, train_iters=1,
+                        work_dir=str(tmp_path / 'work'))
+    for name in ('getitem/Viper', 'getitem/SynthiaSeq', 'getitem/CityscapesSeq', 'warp', 'itcr',
+                 'train_iteration', 'eval_pass'):
+        assert results[name]['median_s'] > 0, name
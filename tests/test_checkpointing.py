@@ -0,0 +1,44 @@
+import copy
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+
+
+def small_model():
+    torch.manual_seed(0)
+    # two Bottlenecks per layer, so that per-block segments differ from whole layers
+    return ResNetMulti(Bottleneck, [2, 2, 2, 2], num_classes=4, multi_level=True).train()
+
+
+def batch():
+    generator = torch.Generator().manual_seed(0)
+    return (torch.randn(2, 3, 33, 41, generator=generator), torch.randn(2, 3, 33, 41, generator=generator),
+            torch.randint(-30, 31, (2, 2, 33, 41), generator=generator).double() / 10.0,
+            torch.randint(4, (2, 33, 41), generator=generator))
+
+
+def source_step(model, cf, kf, flow, label):
+    # as the source segmentation loss of train_DAVSN
+    pred_aux, pred = model(cf, kf, flow, torch.device('cpu'))[:2]
+    loss = sum(F.cross_entropy(F.interpolate(p, size=label.shape[-2:], mode='bilinear', align_corners=True), label)
+               for p in (pred, pred_aux))
+    loss.backward()
+
+
+@pytest.mark.parametrize('layers, blocks', [(('layer3',), 0), (('layer1', 'layer3', 'layer4'), 0),
+                                            (('layer3',), 1), (('layer1', 'layer2', 'layer3', 'layer4'), 1)])
+def test_checkpointing_is_exact(layers, blocks):
+    model = small_model()
+    checkpointed = copy.deepcopy(model)
+    checkpointed.set_gradient_checkpointing(layers, blocks)
+    for m in (model, checkpointed):
+        source_step(m, *batch())
+    grads = [(p.grad, q.grad) for p, q in zip(model.parameters(), checkpointed.parameters()) if p.requires_grad]
+    assert grads and all(a is not None and torch.equal(a, b) for a, b in grads)
+    # running statistics and num_batches_tracked, not updated again by the recomputation
+    for a, b in zip(model.buffers(), checkpointed.buffers()):
+        assert torch.equal(a, b)
+
@@ -0,0 +1,83 @@
+import copy
+
+import pytest
+import torch
+import torch.nn.functional as F
+from torch import optim
+
+pytest.importorskip('advent.model.discriminator')
+
+from advent.model.discriminator import get_fc_discriminator
+from davsn.model.discriminator import DiscriminatorBank
+
+NUM_CHANNELS = 8
+
+
+def discriminators():
+    torch.manual_seed(0)
+    # (sta, sa) main, then (sta, sa) aux, as in train_DAVSN
+    return [get_fc_discriminator(num_classes=NUM_CHANNELS, ndf=8).train() for _ in range(4)]
+
+
+def single_losses(nets, x, y_label):
+    outputs = [net(x_k) for net, x_k in zip(nets, x.split(NUM_CHANNELS, dim=1))]
+    return torch.stack([F.binary_cross_entropy_with_logits(out, torch.full_like(out, y_label)) for out in outputs])
+
+
+def bank_losses(bank, x, y_label):
+    out = bank(x)
+    return F.binary_cross_entropy_with_logits(out, torch.full_like(out, y_label), reduction='none').mean(dim=(0, 2, 3))
+
+
+def single_weight_discrepancy(d1, d2):
+    # the zipped-parameter loop of the original train_DAVSN
+    k = 0
+    loss_wd = 0
+    for (W1, W2) in zip(d1.parameters(), d2.parameters()):
+        W1 = W1.view(-1)
+        W2 = W2.view(-1)
+        loss_wd = loss_wd + (torch.matmul(W1, W2) / (torch.norm(W1) * torch.norm(W2)) + 1)
+        k += 1
+    return loss_wd / k
+
+
+def assert_close(a, b):
+    assert torch.allclose(a, b, rtol=1e-4, atol=1e-6)
+
+
+def test_bank_matches_separate_discriminators():
+    nets = discriminators()
+    bank = DiscriminatorBank(copy.deepcopy(nets))
+    generator = torch.Generator().manual_seed(0)
+    x = torch.softmax(torch.randn(2, 4 * NUM_CHANNELS, 64, 96, generator=generator), dim=1)
+
+    losses = single_losses(nets, x, 0)
+    losses_bank = bank_losses(bank, x, 0)
+    assert_close(losses_bank, losses)
+    wd = torch.stack([single_weight_discrepancy(nets[0], nets[1]), single_weight_discrepancy(nets[2], nets[3])])
+    wd_bank = bank.weight_discrepancy()
+    assert_close(wd_bank, wd)
+
+    (losses.sum() + wd.sum()).backward()
+    (losses_bank.sum() + wd_bank.sum()).backward()
+    # a small max norm, so that every discriminator is clipped
+    norms = torch.stack([torch.nn.utils.clip_grad_norm_(net.parameters(), 0.01) for net in nets])
+    assert_close(bank.clip_grad_norm_(0.01), norms)
+    for k, net in enumerate(nets):
+        for conv, single in zip(bank.convs, net[0::2]):
+            n = single.out_channels
+            assert_close(conv.weight.grad[k * n:(k + 1) * n], single.weight.grad)
+            assert_close(conv.bias.grad[k * n:(k + 1) * n], single.bias.grad)
+
+    # the LEARNING_RATE_D of the config
+    optimizers = [optim.Adam(net.parameters(), lr=1e-4, betas=(0.9, 0.99)) for net in nets]
+    optimizer_bank = optim.Adam(bank.parameters(), lr=1e-4, betas=(0.9, 0.99))
+    for optimizer in optimizers + [optimizer_bank]:
+        optimizer.step()
+    for k, net in enumerate(nets):
+        exported = bank.discriminator(k)
+        assert [type(m) for m in exported] == [type(m) for m in net]
+        for p, q in zip(exported.parameters(), net.parameters()):
+            assert_close(p, q)
+        assert_close(exported(x[:, k * NUM_CHANNELS:(k + 1) * NUM_CHANNELS]),
+                     net(x[:, k * NUM_CHANNELS:(k + 1) * NUM_CHANNELS]))
@@ -0,0 +1,70 @@
+import socket
+
+import torch
+import torch.multiprocessing as mp
+from easydict import EasyDict
+
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+from davsn.utils.distributed import cleanup_distributed, init_distributed, set_grad_sync, wrap_ddp
+
+WORLD_SIZE = 2
+ACCUM_STEPS = 2
+
+
+def small_model():
+    torch.manual_seed(0)
+    # eval: the BatchNorm statistics are per process under DDP
+    return ResNetMulti(Bottleneck, [1, 1, 1, 1], num_classes=4, multi_level=True).eval()
+
+
+def batches():
+    generator = torch.Generator().manual_seed(0)
+    return [(torch.randn(1, 3, 33, 41, generator=generator), torch.randn(1, 3, 33, 41, generator=generator),
+             torch.randint(-30, 31, (1, 2, 33, 41), generator=generator).double() / 10.0)
+            for _ in range(WORLD_SIZE * ACCUM_STEPS)]
+
+
+def micro_batch(ddp_model, cf, kf, flow, last_micro):
+    # as train_DAVSN: a fused source pass, then an unfused target pass whose backward all-reduces
+    set_grad_sync(ddp_model, False)
+    pred_aux, pred, _, _, _, _ = ddp_model(cf, kf, flow, torch.device('cpu'))
+    ((pred_aux.mean() + pred.mean()) / ACCUM_STEPS).backward()
+    set_grad_sync(ddp_model, last_micro)
+    _, _, cf_aux, cf_main, _, _ = ddp_model(cf, kf, flow, torch.device('cpu'), fused=False)
+    ((cf_aux.mean() + cf_main.mean()) / ACCUM_STEPS).backward()
+
+
+def run_worker(rank, port, path):
+    cfg = EasyDict(DEVICE='cpu', DIST_BACKEND='gloo', DIST_URL=f'tcp://127.0.0.1:{port}')
+    init_distributed(cfg, rank, WORLD_SIZE)
+    model = small_model()
+    ddp_model = wrap_ddp(model, torch.device('cpu'))
+    for i_micro in range(ACCUM_STEPS):
+        micro_batch(ddp_model, *batches()[rank * ACCUM_STEPS + i_micro], i_micro == ACCUM_STEPS - 1)
+    if rank == 0:
+        torch.save({name: param.grad for name, param in model.named_parameters()}, path)
+    cleanup_distributed()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_ddp_gradients_match_single_process(tmp_path):
+    path = str(tmp_path / 'grads.pth')
+    mp.spawn(run_worker, args=(free_port(), path), nprocs=WORLD_SIZE)
+    grads = torch.load(path)
+    model = small_model()
+    # one process over all the micro-batches; DDP averages the gradients over the processes
+    for cf, kf, flow in batches():
+        micro_batch(model, cf, kf, flow, True)
+    for param in model.parameters():
+        if param.grad is not None:
+            param.grad /= WORLD_SIZE
+    for name, param in model.named_parameters():
+        if param.grad is None:
+            assert grads[name] is None, name
+        else:
+            assert torch.allclose(grads[name], param.grad, rtol=1e-4, atol=1e-6), name
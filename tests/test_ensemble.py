@@ -0,0 +1,53 @@
+import copy
+
+import pytest
+import torch
+
+pytest.importorskip('advent.utils.serialization')
+
+from davsn.domain_adaptation.config import cfg
+from davsn.domain_adaptation.eval_video_UDA import Ensemble
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+from davsn.utils.flow import decode_flow
+
+WEIGHTS = (0.5, 0.3, 0.2)
+
+
+def small_model(seed):
+    torch.manual_seed(seed)
+    model = ResNetMulti(Bottleneck, [1, 1, 1, 1], num_classes=4, multi_level=True).eval()
+    # the score fusion reads the propagated key-frame logits, so that the flow matters
+    model.sf_layer.weight.data.normal_()
+    return model
+
+
+def inputs():
+    generator = torch.Generator().manual_seed(0)
+    # the flow as read from the store, decoded by the ensemble
+    return (torch.randn(1, 3, 33, 41, generator=generator), torch.randn(1, 3, 33, 41, generator=generator),
+            torch.randint(-30, 31, (1, 2, 33, 41), generator=generator, dtype=torch.int16))
+
+
+def test_ensemble_matches_sequential_weighted_sum(tmp_path):
+    config = copy.deepcopy(cfg)
+    config.TEST.TILE_MEMORY_MB = 0
+    restore_froms = []
+    for k in range(len(WEIGHTS)):
+        restore_froms.append(str(tmp_path / f'model_{k}.pth'))
+        torch.save(small_model(k).state_dict(), restore_froms[-1])
+    # the members only match the checkpoints once loaded
+    models = [small_model(100 + k) for k in range(len(WEIGHTS))]
+    ensemble = Ensemble(models, WEIGHTS, restore_froms, [torch.device('cpu')], config)
+    cf, kf, flow = inputs()
+    try:
+        with torch.no_grad():
+            output = ensemble(cf, kf, flow)
+    finally:
+        ensemble.close()
+    expected = None
+    with torch.no_grad():
+        for k, weight in enumerate(WEIGHTS):
+            pred_main = weight * small_model(k)(cf, kf, decode_flow(flow), torch.device('cpu'))[1]
+            expected = pred_main if expected is None else expected + pred_main
+    assert output.shape == expected.shape
+    assert torch.allclose(output, expected, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,32 @@
+import copy
+
+import pytest
+import torch
+
+pytest.importorskip('advent.utils.serialization')
+
+from davsn.domain_adaptation import eval_video_UDA
+from davsn.domain_adaptation.config import cfg
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+from davsn.utils.snapshot_watcher import SnapshotWatcher
+
+
+def test_watcher_closed_when_interrupted(tmp_path, monkeypatch):
+    closed = []
+
+    class InterruptedWatcher(SnapshotWatcher):
+        def wait(self, path):
+            raise KeyboardInterrupt
+
+        def close(self):
+            super().close()
+            closed.append(True)
+
+    monkeypatch.setattr(eval_video_UDA, 'SnapshotWatcher', InterruptedWatcher)
+    config = copy.deepcopy(cfg)
+    config.TEST.SNAPSHOT_DIR = [str(tmp_path)]
+    config.TEST.WAIT_MODEL = True
+    model = ResNetMulti(Bottleneck, [1, 1, 1, 1], num_classes=4, multi_level=True)
+    with pytest.raises(KeyboardInterrupt):
+        eval_video_UDA.eval_video_best(config, [model], torch.device('cpu'), None, None, True, False)
+    assert closed == [True]
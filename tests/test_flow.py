@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import torch
+
+from davsn.utils.flow import propagate_by_flow
+
+
+def splat_reference(input, flow):
+    """The per-pixel NumPy loop `ResNetMulti.forward` used to warp the key frame.
+
+    The flow of the first sample is applied to the whole batch. Returns
+    (warped, positions) as float64 arrays of the input shape.
+    """
+    input = np.asarray(input)
+    flow = np.asarray(flow)
+    warped = np.zeros(input.shape)
+    positions = np.zeros(input.shape)
+    for x in range(input.shape[-1]):
+        for y in range(input.shape[-2]):
+            x_flow = int(round(x - flow[:, 0, y, x][0]))
+            y_flow = int(round(y - flow[:, 1, y, x][0]))
+            if x_flow >= 0 and x_flow < flow.shape[-1] and y_flow >= 0 and y_flow < flow.shape[-2]:
+                warped[..., y_flow, x_flow] = input[..., y, x]
+                positions[..., y_flow, x_flow] = 1
+    return warped, positions
+
+
+def assert_matches_reference(input, flow):
+    (warped,), positions = propagate_by_flow([input], flow)
+    for b in range(input.shape[0]):
+        warped_ref, positions_ref = splat_reference(input[b:b + 1].numpy(), flow[b:b + 1].numpy())
+        warped_ref = (torch.from_numpy(positions_ref) * torch.from_numpy(warped_ref)).float()
+        assert torch.equal(warped[b:b + 1] * positions[b:b + 1], warped_ref)
+        assert torch.equal(positions[b:b + 1].expand_as(warped[b:b + 1]).double(), torch.from_numpy(positions_ref))
+
+
+def stored_flow(shape, scale, generator):
+    # displacements as decoded from the int16 x 10 files
+    return torch.randint(-scale * 10, scale * 10 + 1, shape, generator=generator).double() / 10.0
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_random_flow(seed):
+    generator = torch.Generator().manual_seed(seed)
+    input = torch.randn(1, 4, 13, 17, generator=generator)
+    assert_matches_reference(input, stored_flow((1, 2, 13, 17), 4, generator))
+
+
+def test_collisions_last_writer_wins():
+    input = torch.arange(1 * 2 * 4 * 5, dtype=torch.float32).view(1, 2, 4, 5)
+    flow = torch.zeros(1, 2, 4, 5, dtype=torch.float64)
+    # (y=0, x=1), (y=2, x=1) and (y=1, x=3) all land on (y=1, x=2)
+    flow[0, :, 0, 1] = torch.tensor([-1.0, -1.0])
+    flow[0, :, 2, 1] = torch.tensor([-1.0, 1.0])
+    flow[0, :, 1, 3] = torch.tensor([1.0, 0.0])
+    assert_matches_reference(input, flow)
+    (warped,), _ = propagate_by_flow([input], flow)
+    # x=3 comes last in the column-major scan
+    assert torch.equal(warped[0, :, 1, 2], input[0, :, 1, 3])
+
+
+def test_half_pixel_rounding():
+    generator = torch.Generator().manual_seed(0)
+    input = torch.randn(1, 3, 6, 7, generator=generator)
+    # +-0.5 and +-1.5 displacements, rounded half to even by both implementations
+    halves = torch.tensor([-1.5, -0.5, 0.5, 1.5], dtype=torch.float64)
+    flow = halves[torch.randint(len(halves), (1, 2, 6, 7), generator=generator)]
+    assert_matches_reference(input, flow)
+
+
+def test_out_of_bounds_targets():
+    generator = torch.Generator().manual_seed(0)
+    input = torch.randn(1, 3, 8, 9, generator=generator)
+    flow = stored_flow((1, 2, 8, 9), 20, generator)
+    flow[0, :, 0, 0] = torch.tensor([100.0, 0.0])
+    flow[0, :, 7, 8] = torch.tensor([0.0, -100.0])
+    assert_matches_reference(input, flow)
+    _, positions = propagate_by_flow([input], flow)
+    assert positions.sum() < 8 * 9
+
+
+def test_batch_uses_each_sample_flow():
+    generator = torch.Generator().manual_seed(0)
+    input = torch.randn(3, 5, 10, 11, generator=generator)
+    assert_matches_reference(input, stored_flow((3, 2, 10, 11), 3, generator))
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import torch
+
+from davsn.benchmarks.synthetic import make_viper
+from davsn.dataset.flow_generation import encode_flow, flow_jobs, generate_flows
+from davsn.dataset.Viper import ViperDataSet
+from davsn.utils.flow import decode_flow
+
+
+def test_encode_decode_round_trip():
+    rng = np.random.default_rng(0)
+    flow = rng.uniform(-1000, 1000, (33, 41, 2)).astype(np.float32)
+    encoded = encode_flow(flow)
+    assert encoded.dtype == np.int16
+    decoded = decode_flow(torch.from_numpy(encoded)).numpy()
+    assert np.abs(decoded - flow).max() <= 0.05 + 1e-4
+    # tenths of a pixel are stored exactly
+    tenths = rng.integers(-32768, 32768, (33, 41, 2)) / 10.0
+    np.testing.assert_array_equal(decode_flow(torch.from_numpy(encode_flow(tenths))).numpy(), tenths)
+    # displacements beyond the int16 range are clipped
+    np.testing.assert_array_equal(encode_flow(np.array([-4000.0, 4000.0])), [-32768, 32767])
+
+
+def test_generate_flows_resumes(tmp_path):
+    make_viper(tmp_path, 2, 2, (40, 20), (40, 20), np.random.RandomState(0))
+    dataset = ViperDataSet(tmp_path / 'Viper', str(tmp_path / 'Viper_list/{}.txt'), crop_size=(32, 16))
+    output_dir = str(tmp_path / 'flow')
+    stats = generate_flows(dataset, output_dir, preset='ultrafast', num_workers=1)
+    assert (stats['computed'], stats['skipped']) == (4, 0)
+    outputs = [output for _, _, output in flow_jobs(dataset, output_dir)]
+    flows = [np.load(output) for output in outputs]
+    for flow in flows:
+        assert flow.dtype == np.int16 and flow.shape == (16, 32, 2)
+    # as after an interruption: one flow missing, the others kept as they are on disk
+    os.remove(outputs[1])
+    np.save(outputs[2], np.zeros_like(flows[2]))
+    stats = generate_flows(dataset, output_dir, preset='ultrafast', num_workers=1)
+    assert (stats['computed'], stats['skipped']) == (1, 3)
+    np.testing.assert_array_equal(np.load(outputs[1]), flows[1])
+    np.testing.assert_array_equal(np.load(outputs[2]), 0)
+    assert sorted(os.listdir(output_dir)) == sorted(os.path.basename(output) for output in outputs)
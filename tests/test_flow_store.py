@@ -0,0 +1,48 @@
+import pickle
+
+import numpy as np
+
+from davsn.dataset.flow_store import NpyFlowStore, PackedFlowStore, open_flow_store, pack_flow_dir
+
+
+def write_flows(flow_dir):
+    rng = np.random.default_rng(0)
+    flow_dir.mkdir()
+    names = []
+    for i, (h, w) in enumerate([(33, 41), (16, 20), (33, 41)]):
+        name = f'frame_{i:06d}_int16_x10'
+        np.save(flow_dir / (name + '.npy'), rng.integers(-300, 301, (h, w, 2), dtype=np.int16))
+        names.append(name)
+    # not a flow: left out of the container
+    np.save(flow_dir / 'other.npy', np.zeros(3))
+    return names
+
+
+def test_packed_store_matches_npy_store(tmp_path):
+    names = write_flows(tmp_path / 'flow')
+    output = tmp_path / 'flow.npy'
+    assert pack_flow_dir(tmp_path / 'flow', output) == len(names)
+    npy_store = open_flow_store(tmp_path / 'flow')
+    packed_store = open_flow_store(output)
+    assert isinstance(npy_store, NpyFlowStore)
+    assert isinstance(packed_store, PackedFlowStore)
+    assert 'other' in npy_store and 'other' not in packed_store
+    for name in names:
+        assert name in packed_store
+        flow = packed_store[name]
+        assert flow.dtype == np.int16 and not flow.flags.writeable
+        np.testing.assert_array_equal(flow, npy_store[name])
+
+
+def test_packed_store_pickles_without_mapping(tmp_path):
+    names = write_flows(tmp_path / 'flow')
+    output = tmp_path / 'flow.npy'
+    pack_flow_dir(tmp_path / 'flow', output)
+    store = PackedFlowStore(output)
+    expected = np.array(store[names[1]])
+    assert store._data is not None
+    # as sent to a DataLoader worker
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy._data is None and store._data is not None
+    np.testing.assert_array_equal(copy[names[1]], expected)
+    assert copy.index == store.index
@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from davsn.benchmarks.synthetic import make_cityscapes_seq, make_synthia_seq, make_viper
+from davsn.dataset.image_cache import build_image_cache, build_label_cache
+
+INFO_PATH = Path(__file__).resolve().parents[1] / 'davsn/dataset/CityscapesSeq_list/info_Viper.json'
+
+# frames are written larger than the loader size, so that the caches resize them
+SIZE = (40, 20)
+CROP_SIZE = (32, 16)
+
+
+def make_data(name, root):
+    rng = np.random.RandomState(0)
+    if name == 'CityscapesSeq':
+        make_cityscapes_seq(root, 'val', 2, SIZE, SIZE, rng)
+    elif name == 'Viper':
+        make_viper(root, 2, 2, SIZE, SIZE, rng)
+    else:
+        # the loader crops the 120 bottom rows
+        make_synthia_seq(root, 3, (SIZE[0], SIZE[1] + 120), SIZE, rng)
+
+
+def make_dataset(name, root, **kwargs):
+    if name == 'CityscapesSeq':
+        pytest.importorskip('advent.utils.serialization')
+        from davsn.dataset.CityscapesSeq import CityscapesSeqDataSet
+        return CityscapesSeqDataSet(root / 'Cityscapes', str(root / 'CityscapesSeq_list/{}.txt'), set='val',
+                                    crop_size=CROP_SIZE, info_path=INFO_PATH, **kwargs)
+    if name == 'Viper':
+        from davsn.dataset.Viper import ViperDataSet
+        return ViperDataSet(root / 'Viper', str(root / 'Viper_list/{}.txt'), crop_size=CROP_SIZE, **kwargs)
+    pytest.importorskip('advent.utils.serialization')
+    from davsn.dataset.SynthiaSeq import SynthiaSeqDataSet
+    return SynthiaSeqDataSet(root / 'SynthiaSeq', str(root / 'SynthiaSeq_list/{}.txt'), set='train',
+                             crop_size=(CROP_SIZE[0], CROP_SIZE[1] + 120), **kwargs)
+
+
+def assert_same_samples(dataset, cached):
+    for index in range(len(dataset)):
+        for sample, cached_sample in zip(dataset[index], cached[index]):
+            np.testing.assert_array_equal(cached_sample, sample)
+
+
+@pytest.mark.parametrize('name', ['CityscapesSeq', 'Viper', 'SynthiaSeq'])
+def test_image_cache_matches_decoded_frames(tmp_path, name):
+    make_data(name, tmp_path)
+    dataset = make_dataset(name, tmp_path)
+    files = []
+    for img_id in dataset.img_ids:
+        img_file, _ = dataset.get_metadata(str(img_id))
+        files += [img_file, dataset.get_kf_file(str(img_id))]
+    # consecutive SynthiaSeq frames are both current and key frames
+    files = list(dict.fromkeys(files))
+    output = tmp_path / 'images.npy'
+    assert build_image_cache(dataset, output, num_workers=1) == len(files)
+    cached = make_dataset(name, tmp_path, image_cache=output)
+    for file in files:
+        image = dataset.get_image(file)
+        cached_image = cached.get_image(file)
+        assert cached_image.dtype == np.uint8
+        np.testing.assert_array_equal(cached_image, image)
+        np.testing.assert_array_equal(cached.preprocess(cached_image), dataset.preprocess(image))
+    assert_same_samples(dataset, cached)
+
+
+@pytest.mark.parametrize('name', ['Viper', 'SynthiaSeq'])
+def test_label_cache_matches_converted_labels(tmp_path, name):
+    make_data(name, tmp_path)
+    dataset = make_dataset(name, tmp_path)
+    files = [dataset.get_metadata(str(img_id))[1] for img_id in dataset.img_ids]
+    output = tmp_path / 'labels.npy'
+    assert build_label_cache(dataset, output, num_workers=1) == len(files)
+    cached = make_dataset(name, tmp_path, label_cache=output)
+    for file in files:
+        label = dataset.get_trainid_labels(file)
+        cached_label = cached.get_trainid_labels(file)
+        assert cached_label.dtype == np.uint8
+        assert cached_label.shape == (CROP_SIZE[1], CROP_SIZE[0])
+        np.testing.assert_array_equal(cached_label, label)
+    assert_same_samples(dataset, cached)
@@ -0,0 +1,56 @@
+import torch
+
+from davsn.domain_adaptation.keyframe_inference import KeyFrameScheduler, KeyFrameSegmenter
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+
+
+def small_model():
+    torch.manual_seed(0)
+    return ResNetMulti(Bottleneck, [1, 1, 1, 1], num_classes=4, multi_level=True).eval()
+
+
+def clip(num_frames, size=(33, 41)):
+    generator = torch.Generator().manual_seed(0)
+    frames = [torch.randn(1, 3, *size, generator=generator) for _ in range(num_frames)]
+    flows = [None] + [torch.randint(-30, 31, (1, 2, *size), generator=generator).double() / 10.0
+                      for _ in range(num_frames - 1)]
+    return frames, flows
+
+
+def test_scheduler_max_interval():
+    scheduler = KeyFrameScheduler(max_interval=3, flow_threshold=1e9, coverage_threshold=0.0)
+    assert [scheduler.is_key_frame(0.0, 1.0) for _ in range(6)] == [False, False, True, False, False, True]
+
+
+def test_scheduler_motion_and_coverage():
+    scheduler = KeyFrameScheduler(max_interval=100, flow_threshold=10.0, coverage_threshold=0.5)
+    assert not scheduler.is_key_frame(6.0, 1.0)
+    assert scheduler.is_key_frame(6.0, 1.0)
+    assert scheduler.is_key_frame(0.0, 0.4)
+
+
+def test_every_frame_key_matches_forward():
+    model = small_model()
+    frames, flows = clip(4)
+    segmenter = KeyFrameSegmenter(model, KeyFrameScheduler(max_interval=1), torch.device('cpu'))
+    with torch.no_grad():
+        for t in range(len(frames)):
+            pred, is_key = segmenter.step(frames[t], flows[t], ('seq', t))
+            assert is_key
+            if t > 0:
+                assert torch.equal(pred, model(frames[t], frames[t - 1], flows[t], torch.device('cpu'))[1])
+
+
+def test_non_key_frames_and_boundaries():
+    model = small_model()
+    frames, flows = clip(4)
+    for correction in ('lowres', 'none'):
+        segmenter = KeyFrameSegmenter(model, KeyFrameScheduler(max_interval=10, flow_threshold=1e9,
+                                                               coverage_threshold=0.0),
+                                      torch.device('cpu'), correction)
+        outputs = [segmenter.step(frame, flow, ('seq', t)) for t, (frame, flow) in enumerate(zip(frames, flows))]
+        assert [is_key for _, is_key in outputs] == [True, False, False, False]
+        assert all(pred.shape == outputs[0][0].shape for pred, _ in outputs)
+        # a skipped frame or a new sequence restarts the stream with a key frame
+        assert segmenter.step(frames[0], flows[1], ('seq', 5))[1]
+        assert segmenter.step(frames[1], flows[1], ('other', 6))[1]
@@ -0,0 +1,67 @@
+import pytest
+import torch
+from tqdm import tqdm
+
+from davsn.utils.loss_logger import LossLogger
+
+
+class FakeWriter:
+    def __init__(self):
+        self.scalars = []
+
+    def add_scalar(self, tag, value, step):
+        self.scalars.append((tag, float(value), step))
+
+
+# the per-iteration logging of train_DAVSN that LossLogger replaces
+def to_numpy(tensor):
+    if isinstance(tensor, (int, float)):
+        return tensor
+    else:
+        return tensor.data.cpu().numpy()
+
+
+def print_losses(current_losses, i_iter):
+    list_strings = []
+    for loss_name, loss_value in current_losses.items():
+        list_strings.append(f'{loss_name} = {to_numpy(loss_value):.3f} ')
+    full_string = ' '.join(list_strings)
+    tqdm.write(f'iter = {i_iter} {full_string}')
+
+
+def log_losses_tensorboard(writer, current_losses, i_iter):
+    for loss_name, loss_value in current_losses.items():
+        writer.add_scalar(f'data/{loss_name}', to_numpy(loss_value), i_iter)
+
+
+def iteration_losses(num_iters):
+    generator = torch.Generator().manual_seed(0)
+    weight = torch.randn(4, requires_grad=True, generator=generator)
+    for i_iter in range(num_iters):
+        losses = {'loss_seg_src_aux': 0,
+                  'loss_seg_src_main': (weight * torch.randn(4, generator=generator)).sum(),
+                  'loss_adv_trg_main': torch.rand((), generator=generator) * 10}
+        if i_iter >= 5:
+            # a new set of losses flushes the rows buffered so far
+            losses['loss_d_main'] = torch.rand((), generator=generator)
+        yield losses, i_iter
+
+
+@pytest.mark.parametrize('flush_every', [1, 3])
+def test_loss_logger_matches_per_iteration_logging(capsys, flush_every):
+    expected_writer = FakeWriter()
+    for losses, i_iter in iteration_losses(8):
+        print_losses(losses, i_iter)
+        log_losses_tensorboard(expected_writer, losses, i_iter)
+    expected = capsys.readouterr().out
+    writer = FakeWriter()
+    logger = LossLogger(torch.device('cpu'), flush_every, writer)
+    for losses, i_iter in iteration_losses(8):
+        logger.log(losses, i_iter)
+    logger.close()
+    assert capsys.readouterr().out == expected
+    assert len(writer.scalars) == len(expected_writer.scalars)
+    for (tag, value, step), (expected_tag, expected_value, expected_step) in zip(writer.scalars,
+                                                                                 expected_writer.scalars):
+        assert (tag, step) == (expected_tag, expected_step)
+        assert value == pytest.approx(expected_value, rel=1e-6)
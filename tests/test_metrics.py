@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip('advent.utils.func')
+
+from advent.utils.func import fast_hist, per_class_iu
+from davsn.utils.metrics import ConfusionMatrix
+
+NUM_CLASSES = 6
+
+
+def batches():
+    generator = torch.Generator().manual_seed(0)
+    for _ in range(4):
+        label = torch.randint(NUM_CLASSES, (2, 17, 23), generator=generator)
+        # ignore-label pixels, and class 5 never labeled
+        label[torch.rand(label.shape, generator=generator) < 0.2] = 255
+        label[label == 5] = 255
+        pred = torch.where(torch.rand(label.shape, generator=generator) < 0.6, label.clamp(max=NUM_CLASSES - 1),
+                           torch.randint(NUM_CLASSES, label.shape, generator=generator))
+        yield label, pred
+
+
+@pytest.mark.parametrize('ignore_classes', [(), (3,)])
+def test_matches_fast_hist(ignore_classes):
+    metrics = ConfusionMatrix(NUM_CLASSES, torch.device('cpu'), ignore_classes)
+    hist = np.zeros((NUM_CLASSES, NUM_CLASSES))
+    for label, pred in batches():
+        metrics.update(label, pred)
+        # as the original evaluation, one image at a time on the host
+        for label_, pred_ in zip(label.numpy(), pred.numpy()):
+            hist += fast_hist(label_.flatten(), pred_.flatten(), NUM_CLASSES)
+    np.testing.assert_array_equal(metrics.get_hist(), hist)
+    inters_over_union_classes = per_class_iu(hist)
+    if ignore_classes:
+        ### ignore 'fence' class during evaluation
+        inters_over_union_classes = np.concatenate((inters_over_union_classes[:3], inters_over_union_classes[4:]))
+    np.testing.assert_array_equal(metrics.reported_iu(), inters_over_union_classes)
+    assert metrics.miou() == np.nanmean(inters_over_union_classes)
+    metrics.reset()
+    assert metrics.get_hist().sum() == 0
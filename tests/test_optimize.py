@@ -0,0 +1,40 @@
+import torch
+from torch import nn
+
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+from davsn.model.optimize import optimize_for_inference, compare_for_inference
+
+
+def small_model():
+    torch.manual_seed(0)
+    model = ResNetMulti(Bottleneck, [1, 1, 1, 1], num_classes=4, multi_level=True)
+    # non-trivial statistics, so that folding actually changes the weights
+    for m in model.modules():
+        if isinstance(m, nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2.0)
+            m.weight.data.uniform_(0.5, 1.5)
+            m.bias.data.uniform_(-0.5, 0.5)
+    return model.eval()
+
+
+def inputs():
+    generator = torch.Generator().manual_seed(0)
+    return (torch.randn(1, 3, 33, 41, generator=generator), torch.randn(1, 3, 33, 41, generator=generator),
+            torch.randint(-30, 31, (1, 2, 33, 41), generator=generator).double() / 10.0)
+
+
+def test_optimized_model_passes():
+    model = small_model()
+    results = compare_for_inference(model, optimize_for_inference(model), *inputs(), repeats=1)
+    assert results['passed']
+    assert results['max_abs_diff'] < 1e-3
+
+
+def test_mismatch_fails():
+    model = small_model()
+    optimized = optimize_for_inference(model)
+    with torch.no_grad():
+        optimized.layer6.conv2d_list[0].bias.add_(1.0)
+    results = compare_for_inference(model, optimized, *inputs(), repeats=1)
+    assert not results['passed']
@@ -0,0 +1,84 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+from torch.utils import data
+
+pytest.importorskip('advent.utils.func')
+
+from davsn.dataset.sampler import InfiniteSampler
+from davsn.domain_adaptation.config import cfg
+from davsn.domain_adaptation.train_video_UDA import train_DAVSN
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+from davsn.utils.checkpoint import load_checkpoint
+
+SIZE = (64, 32)
+NUM_CLASSES = 4
+
+
+class RandomVideoDataSet(data.Dataset):
+    """(frame, label, key frame, shape, name, int16_x10 flow) samples drawn from the index."""
+
+    def __len__(self):
+        return 5
+
+    def __getitem__(self, index):
+        rng = np.random.RandomState(index)
+        w, h = SIZE
+        image = rng.randn(3, h, w).astype(np.float32)
+        image_kf = rng.randn(3, h, w).astype(np.float32)
+        label = rng.randint(0, NUM_CLASSES, (h, w)).astype(np.float32)
+        flow = (rng.randn(2, h, w) * 20).astype(np.int16)
+        return image, label, image_kf, np.array(image.shape), f'{index:06d}.png', flow
+
+
+def train(snapshot_dir, early_stop, resume_from=''):
+    config = copy.deepcopy(cfg)
+    config.DEVICE = 'cpu'
+    config.NUM_CLASSES = NUM_CLASSES
+    config.TRAIN.INPUT_SIZE_SOURCE = SIZE
+    config.TRAIN.INPUT_SIZE_TARGET = SIZE
+    config.TRAIN.SNAPSHOT_DIR = str(snapshot_dir)
+    config.TRAIN.SAVE_PRED_EVERY = 2
+    config.TRAIN.EARLY_STOP = early_stop
+    config.TRAIN.LOG_LOSSES_EVERY = 1
+    config.TRAIN.RESUME_FROM = resume_from
+    snapshot_dir.mkdir(exist_ok=True)
+    torch.manual_seed(0)
+    model = ResNetMulti(Bottleneck, [1, 1, 1, 1], NUM_CLASSES, multi_level=True)
+    # shuffled epochs of 5 samples, so that the resumed loaders start mid-epoch
+    loaders = [data.DataLoader(RandomVideoDataSet(), batch_size=1,
+                               sampler=InfiniteSampler(5, num_samples=2 * early_stop, seed=seed))
+               for seed in (0, 1)]
+    train_DAVSN(model, *loaders, config)
+    return load_checkpoint(str(snapshot_dir / 'train_state.pth'))
+
+
+def assert_equal_states(a, b):
+    if torch.is_tensor(a):
+        assert torch.equal(a, b)
+    elif isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert_equal_states(a[key], b[key])
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_equal_states(x, y)
+    else:
+        assert a == b
+
+
+def test_resume_is_exact(tmp_path):
+    # iterations 0-4 in one run, snapshots after iterations 2 and 4
+    full = train(tmp_path / 'full', early_stop=5)
+    # iterations 0-2, then 3-4 resumed from the snapshot of iteration 2
+    first = train(tmp_path / 'resumed', early_stop=3)
+    assert first['iteration'] == 2 and full['iteration'] == 4
+    assert not all(torch.equal(first['model'][k], full['model'][k]) for k in full['model'])
+    resumed = train(tmp_path / 'resumed', early_stop=5, resume_from=str(tmp_path / 'resumed' / 'train_state.pth'))
+    assert resumed['iteration'] == 4
+    for key in ('model', 'd_bank', 'optimizer', 'optimizer_d', 'scaler', 'samples_source', 'samples_target'):
+        assert_equal_states(resumed[key], full[key])
+    assert_equal_states(resumed['rng']['torch'], full['rng']['torch'])
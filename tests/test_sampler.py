@@ -0,0 +1,47 @@
+import itertools
+
+import pytest
+
+from davsn.dataset.sampler import InfiniteSampler
+
+
+def take(sampler, n):
+    return list(itertools.islice(iter(sampler), n))
+
+
+def test_epochs_are_seeded_permutations():
+    indices = take(InfiniteSampler(7, seed=3), 21)
+    epochs = [indices[i:i + 7] for i in range(0, 21, 7)]
+    assert all(sorted(epoch) == list(range(7)) for epoch in epochs)
+    # reshuffled every epoch, identically for the same seed
+    assert len({tuple(epoch) for epoch in epochs}) > 1
+    assert take(InfiniteSampler(7, seed=3), 21) == indices
+    assert take(InfiniteSampler(7, seed=4), 21) != indices
+    assert take(InfiniteSampler(7, shuffle=False), 10) == list(range(7)) + [0, 1, 2]
+
+
+def test_ranks_are_disjoint():
+    samplers = [InfiniteSampler(9, num_samples=6, seed=0, rank=rank, num_replicas=3) for rank in range(3)]
+    per_rank = [list(sampler) for sampler in samplers]
+    # the first epoch is dealt in turn between the ranks
+    assert sorted(sum((indices[:3] for indices in per_rank), [])) == list(range(9))
+    dealt = [per_rank[rank][i] for i in range(6) for rank in range(3)]
+    assert dealt == take(InfiniteSampler(9, seed=0), 18)
+
+
+def test_start_continues_the_sequence():
+    for rank in range(2):
+        sampler = InfiniteSampler(5, num_samples=12, seed=1, rank=rank, num_replicas=2)
+        indices = list(sampler)
+        sampler.start = 7
+        assert list(sampler) == indices[7:]
+
+
+def test_len():
+    assert len(InfiniteSampler(5, num_samples=12)) == 12
+    assert len(list(InfiniteSampler(5, num_samples=12))) == 12
+    assert len(InfiniteSampler(5, num_samples=12, start=5)) == 7
+    assert len(InfiniteSampler(5, num_samples=12, start=20)) == 0
+    assert list(InfiniteSampler(5, num_samples=12, start=20)) == []
+    with pytest.raises(TypeError):
+        len(InfiniteSampler(5))
@@ -0,0 +1,49 @@
+import os
+import threading
+import time
+
+import pytest
+
+from davsn.utils import snapshot_watcher
+from davsn.utils.snapshot_watcher import SnapshotWatcher
+
+
+@pytest.fixture(params=['events', 'polling'])
+def watcher(request, tmp_path, monkeypatch):
+    if request.param == 'events':
+        pytest.importorskip('watchdog')
+    else:
+        monkeypatch.setattr(snapshot_watcher, 'Observer', None)
+    watcher = SnapshotWatcher(str(tmp_path), poll_interval=0.05)
+    yield watcher
+    watcher.close()
+
+
+def write_snapshot(path, delay):
+    # as CheckpointWriter: a temporary file renamed once complete
+    time.sleep(delay)
+    with open(f'{path}.tmp', 'wb') as f:
+        f.write(b'partial')
+    time.sleep(delay)
+    os.replace(f'{path}.tmp', path)
+
+
+def test_only_renamed_snapshots_are_ready(watcher, tmp_path):
+    path = str(tmp_path / 'model_1000.pth')
+    assert not watcher.is_ready(path)
+    with open(f'{path}.tmp', 'wb') as f:
+        f.write(b'partial')
+    assert not watcher.is_ready(path)
+    assert not watcher.is_ready(f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+    assert watcher.is_ready(path)
+    assert not watcher.is_ready(str(tmp_path / 'train_state.pth'))
+
+
+def test_wait_returns_once_renamed(watcher, tmp_path):
+    path = str(tmp_path / 'model_2000.pth')
+    writer = threading.Thread(target=write_snapshot, args=(path, 0.1))
+    writer.start()
+    watcher.wait(path)
+    assert os.path.isfile(path) and not os.path.exists(f'{path}.tmp')
+    writer.join()
@@ -0,0 +1,50 @@
+import torch
+
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+from davsn.model.streaming import StreamingAccel, parse_frame_id
+
+
+def small_model():
+    torch.manual_seed(0)
+    return ResNetMulti(Bottleneck, [1, 1, 1, 1], num_classes=4, multi_level=True).eval()
+
+
+def clip(num_frames, size=(33, 41)):
+    generator = torch.Generator().manual_seed(0)
+    frames = [torch.randn(1, 3, *size, generator=generator) for _ in range(num_frames)]
+    flows = [None] + [torch.randint(-30, 31, (1, 2, *size), generator=generator).double() / 10.0
+                      for _ in range(num_frames - 1)]
+    return frames, flows
+
+
+def test_parse_frame_id():
+    assert parse_frame_id('aachen/aachen_000000_000019_leftImg8bit.png') == ('aachen/aachen_000000_', 19)
+    assert parse_frame_id('001/001_00010.jpg') == ('001/001_', 10)
+    assert parse_frame_id('000001.png') == ('', 1)
+
+
+def test_streaming_matches_forward():
+    model = small_model()
+    frames, flows = clip(4)
+    stream = StreamingAccel(model)
+    with torch.no_grad():
+        for t in range(1, len(frames)):
+            expected = model(frames[t], frames[t - 1], flows[t], torch.device('cpu'))
+            # the key frame is only needed at the start of the stream
+            outputs = stream.step(frames[t], frames[t - 1] if t == 1 else None, flows[t], ('seq', t))
+            for output, output_expected in zip(outputs, expected):
+                assert torch.equal(output, output_expected)
+
+
+def test_cache_invalidation():
+    model = small_model()
+    frames, flows = clip(3)
+    stream = StreamingAccel(model)
+    stream.step(frames[1], frames[0], flows[1], ('seq', 1))
+    assert stream.is_cached(('seq', 2), tuple(frames[2].shape))
+    # new sequence, skipped frame, other input size
+    assert not stream.is_cached(('other', 2), tuple(frames[2].shape))
+    assert not stream.is_cached(('seq', 3), tuple(frames[2].shape))
+    assert not stream.is_cached(('seq', 2), (1, 3, 17, 17))
+    stream.reset()
+    assert not stream.is_cached(('seq', 2), tuple(frames[2].shape))
@@ -0,0 +1,58 @@
+import torch
+import torch.nn.functional as F
+
+from davsn.domain_adaptation.tiled_inference import TiledSegmenter
+from davsn.model.accel_deeplabv2 import Bottleneck, ResNetMulti
+from davsn.utils.flow import resize_flow
+
+# 33x41 frames fit in one tile at 4 MB and need 33x24 tiles at 1 MB
+BYTES_PER_PIXEL = 1000
+
+
+def small_model():
+    torch.manual_seed(0)
+    model = ResNetMulti(Bottleneck, [1, 1, 1, 1], num_classes=4, multi_level=True).eval()
+    # the score fusion reads the propagated key-frame logits, so that the flow matters
+    model.sf_layer.weight.data.normal_()
+    return model
+
+
+def inputs(flow_size=(33, 41), max_flow=3):
+    generator = torch.Generator().manual_seed(0)
+    return (torch.randn(1, 3, 33, 41, generator=generator), torch.randn(1, 3, 33, 41, generator=generator),
+            torch.randint(-10 * max_flow, 10 * max_flow + 1, (1, 2, *flow_size), generator=generator).double() / 10.0)
+
+
+def segmenter(model, budget_mb):
+    return TiledSegmenter(model, torch.device('cpu'), budget_mb, overlap=16, bytes_per_pixel=BYTES_PER_PIXEL)
+
+
+def test_budgets_return_one_resolution():
+    model = small_model()
+    cf, kf, flow = inputs()
+    whole, tiled = segmenter(model, 4), segmenter(model, 1)
+    assert whole.tile_size((33, 41), 1) == (33, 41)
+    assert tiled.tile_size((33, 41), 1) == (33, 24)
+    pred_whole, pred_tiled = whole(cf, kf, flow), tiled(cf, kf, flow)
+    # two ensemble members sharing a device budget unevenly are summed
+    assert pred_whole.shape == pred_tiled.shape == (1, 4, 33, 41)
+    assert (pred_whole + pred_tiled).shape == (1, 4, 33, 41)
+    with torch.no_grad():
+        expected = F.interpolate(model(cf, kf, flow, torch.device('cpu'))[1], size=(33, 41), mode='bilinear',
+                                 align_corners=True)
+    assert torch.equal(pred_whole, expected)
+
+
+def test_no_budget_returns_logits():
+    model = small_model()
+    cf, kf, flow = inputs()
+    with torch.no_grad():
+        assert torch.equal(segmenter(model, 0)(cf, kf, flow), model(cf, kf, flow, torch.device('cpu'))[1])
+
+
+def test_flow_resized_before_cropping():
+    model = small_model()
+    # displacements of several pixels at 1/8 resolution
+    cf, kf, flow = inputs(flow_size=(17, 21), max_flow=15)
+    tiled = segmenter(model, 1)
+    assert torch.equal(tiled(cf, kf, flow), tiled(cf, kf, resize_flow(flow, (33, 41))))